@@ -0,0 +1,262 @@
+# audio_codecs.py
+# Compressed audio output (Ogg/Opus or MP3), negotiated per client
+# -------------------------------------------------------
+# TTS and lipsync keep working on PCM WAV; encoding is the last step before
+# the bytes go out, so Rhubarb (and the speech/reply caches) only ever see
+# lossless audio.
+#
+#   wav    PCM16 as before (default)
+#   opus   Ogg/Opus at OPUS_BITRATE: ~3 kB/s of speech vs ~44 kB/s of 22 kHz PCM16
+#   mp3    MP3 at MP3_BITRATE, for clients without Opus playback
+#
+# Every clip is a complete file, because clients decode chunks one by one.
+# ffmpeg start-up stays off the request path: ENCODER_SPARES processes per
+# codec are spawned ahead of time and sit on stdin waiting for PCM16 mono at
+# ENCODE_INPUT_RATE (what TTS already produces, so usually nothing to convert
+# here); each one that gets used is replaced in the background.
+# Without ffmpeg, negotiate() falls back to wav and clients are told so.
+# encode_async() kills its ffmpeg process when the awaiting task is cancelled.
+# -------------------------------------------------------
+
+import os
+import time
+import shutil
+import asyncio
+import logging
+import threading
+import subprocess
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional
+
+from audio_utils import parse_wav, to_pcm16_mono
+from metrics import SUBPROCESS_FAILURES, counter
+
+log = logging.getLogger("audio_codecs")
+
+FFMPEG = os.getenv("FFMPEG", "ffmpeg")
+ENCODE_INPUT_RATE = 22050                               # = the TTS output rate; ffmpeg resamples from here
+OPUS_BITRATE = os.getenv("OPUS_BITRATE", "24k")
+MP3_BITRATE = os.getenv("MP3_BITRATE", "48k")
+ENCODER_SPARES = int(os.getenv("ENCODER_SPARES", "2"))  # idle ffmpeg processes kept per codec
+ENCODE_TIMEOUT_S = float(os.getenv("ENCODE_TIMEOUT_S", "10"))
+
+AUDIO_BYTES = counter("tessa_audio_bytes_total", "Audio bytes handed to clients, before base64.", ["codec"])
+AUDIO_PCM_BYTES = counter("tessa_audio_pcm_bytes_total", "PCM WAV bytes that went into those clips.", ["codec"])
+
+
+class EncodeError(RuntimeError):
+    pass
+
+
+class EncodeCancelled(EncodeError):
+    pass
+
+
+class EncodeJob:
+    """Handle for one encode; cancel() kills its ffmpeg process."""
+
+    def __init__(self):
+        self.proc: Optional[subprocess.Popen] = None
+        self.cancelled = False
+        self._lock = threading.Lock()
+
+    def attach(self, proc: subprocess.Popen) -> None:
+        with self._lock:
+            self.proc = proc
+            if self.cancelled:
+                proc.kill()
+
+    def cancel(self) -> None:
+        with self._lock:
+            self.cancelled = True
+            if self.proc is not None and self.proc.poll() is None:
+                self.proc.kill()
+
+
+@dataclass(frozen=True)
+class Codec:
+    name: str
+    mime: str
+    args: List[str]  # ffmpeg output options
+
+
+CODECS: Dict[str, Codec] = {
+    "opus": Codec("opus", "audio/ogg", ["-ar", "24000", "-c:a", "libopus", "-b:a", OPUS_BITRATE, "-application", "voip", "-f", "ogg"]),
+    "mp3": Codec("mp3", "audio/mpeg", ["-c:a", "libmp3lame", "-b:a", MP3_BITRATE, "-f", "mp3"]),
+}
+MIME_TYPES = {"wav": "audio/wav", **{c.name: c.mime for c in CODECS.values()}}
+
+
+def ffmpeg_encode_cmd(codec: Codec, sample_rate: int = ENCODE_INPUT_RATE) -> List[str]:
+    return [
+        FFMPEG, "-hide_banner", "-loglevel", "error", "-nostdin",
+        "-f", "s16le", "-ar", str(sample_rate), "-ac", "1", "-i", "pipe:0",
+        *codec.args,
+        "pipe:1",
+    ]
+
+
+class AudioEncoder:
+    def __init__(self, spares: int = ENCODER_SPARES, timeout: float = ENCODE_TIMEOUT_S):
+        self.spares = max(0, spares)
+        self.timeout = timeout
+        self._ffmpeg: Optional[str] = None
+        self._probed = False
+        self._idle: Dict[str, Deque[subprocess.Popen]] = {name: deque() for name in CODECS}
+        self._lock = threading.Lock()
+        self._spawner = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ffmpeg-spawn")
+        self._stopped = False
+        self.encoded = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.cold_spawns = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.encode_seconds = 0.0
+
+    @property
+    def ffmpeg(self) -> Optional[str]:
+        if not self._probed:
+            self._ffmpeg = shutil.which(FFMPEG)
+            self._probed = True
+            if self._ffmpeg is None:
+                log.warning("ffmpeg not found (%s): compressed audio falls back to wav", FFMPEG)
+        return self._ffmpeg
+
+    # ---------- public API ----------
+    def negotiate(self, requested: Optional[str]) -> str:
+        """The format this client gets: its request if we can encode it, else wav."""
+        name = (requested or "wav").strip().lower()
+        name = "opus" if name in ("ogg", "ogg/opus") else name
+        if name not in CODECS or self.ffmpeg is None:
+            return "wav"
+        self._top_up(name)  # have encoders waiting before the first chunk
+        return name
+
+    def encode(self, wav_bytes: bytes, codec: str, job: Optional[EncodeJob] = None) -> bytes:
+        """Blocking: one complete clip in `codec` ("wav" passes through)."""
+        if codec == "wav" or not wav_bytes:
+            AUDIO_BYTES.inc(len(wav_bytes), codec="wav")
+            AUDIO_PCM_BYTES.inc(len(wav_bytes), codec="wav")
+            return wav_bytes
+        t0 = time.time()
+        _, frames = parse_wav(to_pcm16_mono(wav_bytes, target_rate=ENCODE_INPUT_RATE))
+        proc = self._take(codec)
+        if job is not None:
+            job.attach(proc)
+        try:
+            out, err = proc.communicate(frames.tobytes(), timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.communicate()
+            self._failed("timeout")
+            raise EncodeError(f"ffmpeg {codec} encode timed out after {self.timeout:.1f}s")
+        if job is not None and job.cancelled:
+            with self._lock:
+                self.cancelled += 1
+            raise EncodeCancelled(f"ffmpeg {codec} encode cancelled")
+        if proc.returncode != 0 or not out:
+            self._failed("encode_failed")
+            raise EncodeError(f"ffmpeg {codec} encode failed (code={proc.returncode}): {err.decode('utf-8', 'replace').strip()}")
+        with self._lock:
+            self.encoded += 1
+            self.bytes_in += len(wav_bytes)
+            self.bytes_out += len(out)
+            self.encode_seconds += time.time() - t0
+        AUDIO_BYTES.inc(len(out), codec=codec)
+        AUDIO_PCM_BYTES.inc(len(wav_bytes), codec=codec)
+        return out
+
+    def encode_or_wav(self, wav_bytes: bytes, codec: str, job: Optional[EncodeJob] = None):
+        """(bytes, format actually used): a failed encode sends the WAV instead of nothing."""
+        try:
+            return self.encode(wav_bytes, codec, job), codec
+        except EncodeCancelled:
+            raise
+        except EncodeError as e:
+            log.warning("%s; sending wav", e)
+            return self.encode(wav_bytes, "wav"), "wav"
+
+    async def encode_async(self, wav_bytes: bytes, codec: str):
+        """encode_or_wav on a worker thread; cancelling the awaiting task kills the ffmpeg process."""
+        job = EncodeJob()
+        try:
+            return await asyncio.to_thread(self.encode_or_wav, wav_bytes, codec, job)
+        except asyncio.CancelledError:
+            job.cancel()
+            raise
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "ffmpeg": self._ffmpeg,
+                "encoded": self.encoded,
+                "failed": self.failed,
+                "cancelled": self.cancelled,
+                "cold_spawns": self.cold_spawns,
+                "idle": {name: len(q) for name, q in self._idle.items()},
+                "compression_ratio": round(self.bytes_in / self.bytes_out, 2) if self.bytes_out else None,
+                "avg_encode_s": round(self.encode_seconds / self.encoded, 4) if self.encoded else 0.0,
+            }
+
+    def shutdown(self) -> None:
+        self._stopped = True
+        self._spawner.shutdown(wait=False, cancel_futures=True)
+        with self._lock:
+            procs = [p for q in self._idle.values() for p in q]
+            for q in self._idle.values():
+                q.clear()
+        for proc in procs:
+            proc.kill()
+            proc.wait()
+
+    # ---------- internals ----------
+    def _spawn(self, codec: str) -> subprocess.Popen:
+        return subprocess.Popen(ffmpeg_encode_cmd(CODECS[codec]), stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def _take(self, codec: str) -> subprocess.Popen:
+        proc = None
+        with self._lock:
+            idle = self._idle[codec]
+            while idle and proc is None:
+                candidate = idle.popleft()
+                if candidate.poll() is None:
+                    proc = candidate
+        if proc is None:
+            with self._lock:
+                self.cold_spawns += 1
+            try:
+                proc = self._spawn(codec)
+            except OSError as e:
+                self._failed("spawn_failed")
+                raise EncodeError(f"could not start ffmpeg: {e}") from e
+        self._top_up(codec)
+        return proc
+
+    def _top_up(self, codec: str) -> None:
+        if not self._stopped:
+            self._spawner.submit(self._fill, codec)
+
+    def _fill(self, codec: str) -> None:
+        while not self._stopped:
+            with self._lock:
+                if len(self._idle[codec]) >= self.spares:
+                    return
+            try:
+                proc = self._spawn(codec)
+            except OSError as e:
+                log.warning("Could not pre-spawn ffmpeg for %s: %s", codec, e)
+                return
+            with self._lock:
+                self._idle[codec].append(proc)
+
+    def _failed(self, reason: str) -> None:
+        with self._lock:
+            self.failed += 1
+        SUBPROCESS_FAILURES.inc(tool="ffmpeg", reason=reason)
+
+
+# one per process, shared by both servers
+audio_encoder = AudioEncoder()
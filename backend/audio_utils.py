@@ -0,0 +1,238 @@
+# audio_utils.py
+# NumPy audio helpers: WAV parsing/wrapping, width conversion, downmix,
+# resampling and silence trimming
+# -------------------------------------------------------
+# Replaces the audioop-based code (audioop is gone in Python 3.13) and the
+# per-sample Python loops. WAV parsing hands out memoryview slices of the
+# input and np.frombuffer views of those, so nothing is copied until a
+# conversion actually has to produce new samples.
+# -------------------------------------------------------
+
+import math
+import struct
+from dataclasses import dataclass
+from typing import Callable, Optional, Tuple, Union
+
+import numpy as np
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+RESAMPLE_ZEROS = 16          # sinc zero crossings on each side of the kernel
+RESAMPLE_ROLLOFF = 0.945     # cutoff as a fraction of the lower Nyquist
+RESAMPLE_KAISER_BETA = 8.6
+RESAMPLE_MAX_PHASES = 4096   # odd rate pairs get their phase quantized to this
+RESAMPLE_BLOCK = 1 << 16     # output samples per vectorized block
+
+
+@dataclass
+class WavInfo:
+    channels: int
+    sample_rate: int
+    sample_width: int  # bytes per sample
+    format_tag: int    # WAVE_FORMAT_PCM or WAVE_FORMAT_IEEE_FLOAT
+
+    @property
+    def frame_bytes(self) -> int:
+        return self.channels * self.sample_width
+
+
+def parse_wav(data: BytesLike) -> Tuple[WavInfo, memoryview]:
+    """
+    Walk the RIFF chunks and return the format plus a zero-copy view of the
+    sample data. Accepts PCM (8/16/24/32 bit) and 32/64-bit float, including
+    WAVE_FORMAT_EXTENSIBLE headers.
+    """
+    view = memoryview(data).cast("B")
+    if len(view) < 12 or bytes(view[0:4]) != b"RIFF" or bytes(view[8:12]) != b"WAVE":
+        raise ValueError("not a RIFF/WAVE file")
+    info = None
+    pos = 12
+    while pos + 8 <= len(view):
+        chunk_id = bytes(view[pos:pos + 4])
+        size = struct.unpack_from("<I", view, pos + 4)[0]
+        body = pos + 8
+        if chunk_id == b"fmt ":
+            tag, channels, rate = struct.unpack_from("<HHI", view, body)
+            bits = struct.unpack_from("<H", view, body + 14)[0]
+            if tag == WAVE_FORMAT_EXTENSIBLE and size >= 40:
+                tag = struct.unpack_from("<H", view, body + 24)[0]  # first two bytes of the subformat GUID
+            if tag not in (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT):
+                raise ValueError(f"unsupported WAV format tag 0x{tag:04x}")
+            info = WavInfo(channels, rate, (bits + 7) // 8, tag)
+        elif chunk_id == b"data":
+            if info is None:
+                raise ValueError("WAV data chunk before fmt chunk")
+            # streamed WAVs (e.g. from ffmpeg pipes) may carry a bogus size
+            end = len(view) if size in (0, 0xFFFFFFFF) else min(body + size, len(view))
+            end -= (end - body) % info.frame_bytes
+            return info, view[body:end]
+        pos = body + size + (size & 1)
+    raise ValueError("WAV has no data chunk")
+
+
+def pcm_to_float(frames: BytesLike, sample_width: int, channels: int = 1,
+                 format_tag: int = WAVE_FORMAT_PCM) -> np.ndarray:
+    """Interleaved sample bytes -> float32 array of shape (n_frames, channels) in [-1, 1]."""
+    buf = memoryview(frames).cast("B")
+    if format_tag == WAVE_FORMAT_IEEE_FLOAT:
+        dtype = "<f4" if sample_width == 4 else "<f8"
+        x = np.frombuffer(buf, dtype=dtype).astype(np.float32, copy=False)
+    elif sample_width == 1:
+        x = (np.frombuffer(buf, dtype=np.uint8).astype(np.float32) - 128.0) * (1.0 / 128.0)
+    elif sample_width == 2:
+        x = np.frombuffer(buf, dtype="<i2").astype(np.float32) * (1.0 / 32768.0)
+    elif sample_width == 3:
+        b = np.frombuffer(buf, dtype=np.uint8).reshape(-1, 3)
+        # place the 3 bytes in the top of an int32 so the sign comes for free
+        ints = (b[:, 0].astype(np.int32) << 8) | (b[:, 1].astype(np.int32) << 16) | (b[:, 2].astype(np.int32) << 24)
+        x = ints.astype(np.float32) * (1.0 / 2147483648.0)
+    elif sample_width == 4:
+        x = np.frombuffer(buf, dtype="<i4").astype(np.float32) * (1.0 / 2147483648.0)
+    else:
+        raise ValueError(f"unsupported sample width: {sample_width}")
+    return x[: x.size // channels * channels].reshape(-1, channels)
+
+
+def float_to_pcm16(x: np.ndarray) -> np.ndarray:
+    """float samples in [-1, 1] -> int16 with rounding and clipping."""
+    y = np.rint(np.asarray(x, dtype=np.float32) * 32768.0)
+    return np.clip(y, -32768, 32767).astype("<i2")
+
+
+def convert_width(frames: BytesLike, from_width: int, to_width: int) -> bytes:
+    """Integer PCM sample-width conversion with WAV conventions (8-bit is unsigned)."""
+    if from_width == to_width:
+        return bytes(frames)
+    x = pcm_to_float(frames, from_width).ravel()
+    if to_width == 1:
+        return (np.clip(np.rint(x * 128.0) + 128, 0, 255)).astype(np.uint8).tobytes()
+    if to_width == 2:
+        return float_to_pcm16(x).tobytes()
+    if to_width == 4:
+        return np.clip(np.rint(x.astype(np.float64) * 2147483648.0), -2147483648, 2147483647).astype("<i4").tobytes()
+    if to_width == 3:
+        ints = np.clip(np.rint(x.astype(np.float64) * 8388608.0), -8388608, 8388607).astype("<i4")
+        return ints.view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+    raise ValueError(f"unsupported sample width: {to_width}")
+
+
+def downmix(x: np.ndarray) -> np.ndarray:
+    """(n_frames, channels) -> mono (n_frames,) by averaging; mono input is returned as a view."""
+    if x.ndim == 1:
+        return x
+    if x.shape[1] == 1:
+        return x[:, 0]
+    return x.mean(axis=1, dtype=np.float32)
+
+
+def _kaiser(t: np.ndarray, beta: float) -> np.ndarray:
+    return np.i0(beta * np.sqrt(np.clip(1.0 - t * t, 0.0, 1.0))) / np.i0(beta)
+
+
+def _resample_table(up: int, src_rate: int, dst_rate: int) -> Tuple[np.ndarray, int]:
+    """Windowed-sinc kernels for each of the `up` output phases; returns (table, half_width)."""
+    cutoff = RESAMPLE_ROLLOFF * 0.5 * min(src_rate, dst_rate) / src_rate  # cycles per input sample
+    half = int(math.ceil(RESAMPLE_ZEROS / (2.0 * cutoff)))
+    offsets = np.arange(-half + 1, half + 1, dtype=np.float64)         # input taps around floor(t)
+    phases = np.arange(up, dtype=np.float64)[:, None] / up              # frac(t) per phase
+    d = offsets[None, :] - phases
+    table = 2.0 * cutoff * np.sinc(2.0 * cutoff * d) * _kaiser(d / half, RESAMPLE_KAISER_BETA)
+    table /= table.sum(axis=1, keepdims=True)  # exact unity gain at DC for every phase
+    return table.astype(np.float32), half
+
+
+def resample(x: np.ndarray, src_rate: int, dst_rate: int) -> np.ndarray:
+    """
+    Band-limited resampling of a mono float signal (Kaiser-windowed sinc,
+    polyphase, evaluated in vectorized blocks).
+    """
+    if src_rate == dst_rate or x.size == 0:
+        return x
+    g = math.gcd(src_rate, dst_rate)
+    up, down = dst_rate // g, src_rate // g
+    exact = up <= RESAMPLE_MAX_PHASES
+    if not exact:
+        up = RESAMPLE_MAX_PHASES  # e.g. 44100 -> 44099: quantize the phase instead of a huge table
+    table, half = _resample_table(up, src_rate, dst_rate)
+    padded = np.concatenate((np.zeros(half, np.float32), np.asarray(x, np.float32), np.zeros(half + 1, np.float32)))
+    taps = np.arange(-half + 1, half + 1) + half
+
+    n_out = int(x.size * dst_rate // src_rate)
+    if up == 1:
+        # integer decimation (44.1k -> 22.05k, 48k -> 16k): one C-level convolution, then stride
+        return np.convolve(padded, table[0][::-1], mode="valid")[1::down][:n_out].astype(np.float32, copy=False)
+    out = np.empty(n_out, dtype=np.float32)
+    for start in range(0, n_out, RESAMPLE_BLOCK):
+        n = np.arange(start, min(start + RESAMPLE_BLOCK, n_out), dtype=np.int64)
+        if exact:
+            pos = n * down
+            base, phase = pos // up, pos % up
+        else:
+            t = n * (src_rate / dst_rate)
+            base = np.floor(t).astype(np.int64)
+            phase = np.rint((t - base) * up).astype(np.int64)
+            wrap = phase == up
+            base[wrap] += 1
+            phase[wrap] = 0
+        window = padded[base[:, None] + taps[None, :]]
+        out[start:start + n.size] = np.einsum("ij,ij->i", window, table[phase])
+    return out
+
+
+def speech_span(mask: np.ndarray, hop: int, pad: int, n_samples: int) -> Tuple[int, int]:
+    """
+    Sample range [start, end) covering the frames flagged in mask (one frame
+    per hop samples) plus pad samples of context on each side; (0, n_samples)
+    when no frame is flagged. The caller decides what counts as speech.
+    """
+    flagged = np.flatnonzero(mask)
+    if flagged.size == 0:
+        return 0, n_samples
+    return max(0, int(flagged[0]) * hop - pad), min(n_samples, (int(flagged[-1]) + 1) * hop + pad)
+
+
+def wrap_wav(frames: BytesLike, sample_rate: int, channels: int = 1, sample_width: int = 2) -> bytes:
+    """PCM sample bytes -> canonical 44-byte-header WAV."""
+    data = memoryview(frames).cast("B")
+    header = struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + len(data), b"WAVE",
+        b"fmt ", 16, WAVE_FORMAT_PCM, channels, sample_rate,
+        sample_rate * channels * sample_width, channels * sample_width, sample_width * 8,
+        b"data", len(data),
+    )
+    return b"".join((header, data))
+
+
+def read_wav(data: BytesLike) -> Tuple[np.ndarray, int]:
+    """WAV bytes -> (float32 mono samples, sample rate)."""
+    info, frames = parse_wav(data)
+    return downmix(pcm_to_float(frames, info.sample_width, info.channels, info.format_tag)), info.sample_rate
+
+
+def to_pcm16_mono(wav_bytes: BytesLike, target_rate: int = 22050,
+                  trim: Optional[Callable[[np.ndarray, int], Tuple[int, int]]] = None) -> bytes:
+    """
+    Any PCM/float WAV -> PCM16 mono WAV at target_rate. trim(samples, rate)
+    may return a narrower (start, end) sample range; it sees the float samples
+    this conversion makes anyway, and the cut happens before resampling.
+    """
+    try:
+        info, frames = parse_wav(wav_bytes)
+    except (ValueError, struct.error) as e:
+        raise RuntimeError(f"Invalid WAV data: {e}")
+    ready = (info.format_tag, info.sample_width, info.channels, info.sample_rate) == (WAVE_FORMAT_PCM, 2, 1, target_rate)
+    if ready and trim is None:
+        return wrap_wav(frames, target_rate)  # already right: just a canonical header
+    x = downmix(pcm_to_float(frames, info.sample_width, info.channels, info.format_tag))
+    if trim is not None:
+        start, end = trim(x, info.sample_rate)
+        if ready:
+            return wrap_wav(frames[start * 2:end * 2], target_rate)
+        x = x[start:end]
+    x = resample(x, info.sample_rate, target_rate)
+    return wrap_wav(float_to_pcm16(x).data, target_rate)
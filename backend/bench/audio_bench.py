@@ -0,0 +1,127 @@
+# bench/audio_bench.py
+# Micro-benchmark: audio_utils.to_pcm16_mono vs the old audioop-based version
+# -------------------------------------------------------
+# Synthesizes long multichannel WAVs (noise + tones, so the resampler has
+# real work to do) and times both implementations on each.
+#
+#   python bench/audio_bench.py                 # default cases
+#   python bench/audio_bench.py --seconds 120 --repeat 5
+#
+# The legacy implementation needs audioop (Python <= 3.12); on newer
+# Pythons only the NumPy side is timed.
+# -------------------------------------------------------
+
+import io
+import sys
+import time
+import wave
+import argparse
+import warnings
+from pathlib import Path
+from typing import Callable, List, Optional
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from audio_utils import to_pcm16_mono, wrap_wav, convert_width  # noqa: E402
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore", DeprecationWarning)
+    try:
+        import audioop
+    except ImportError:
+        audioop = None
+
+CASES = [
+    # (channels, sample width, source rate)
+    (1, 2, 22050),
+    (2, 2, 44100),
+    (6, 2, 48000),
+    (6, 3, 48000),
+    (8, 4, 96000),
+]
+
+
+def legacy_to_pcm16_mono(wav_bytes: bytes, target_rate: int = 22050) -> bytes:
+    """The implementation main-ws.py used before audio_utils (kept here as the baseline)."""
+    with io.BytesIO(wav_bytes) as bio_in:
+        with wave.open(bio_in, "rb") as r:
+            n_channels = r.getnchannels()
+            sampwidth = r.getsampwidth()
+            framerate = r.getframerate()
+            frames = r.readframes(r.getnframes())
+
+    if sampwidth != 2:
+        frames = audioop.lin2lin(frames, sampwidth, 2)
+    if n_channels == 2:
+        frames = audioop.tomono(frames, 2, 0.5, 0.5)
+    elif n_channels != 1:
+        width = 2
+        samples = len(frames) // (n_channels * width)
+        mono = bytearray()
+        for i in range(samples):
+            acc = 0
+            for c in range(n_channels):
+                off = (i * n_channels + c) * width
+                acc += int.from_bytes(frames[off:off+width], "little", signed=True)
+            acc = int(acc / n_channels)
+            mono += int(acc).to_bytes(2, "little", signed=True)
+        frames = bytes(mono)
+    if framerate != target_rate:
+        frames, _ = audioop.ratecv(frames, 2, 1, framerate, target_rate, None)
+
+    out = io.BytesIO()
+    with wave.open(out, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(target_rate)
+        w.writeframes(frames)
+    return out.getvalue()
+
+
+def make_wav(seconds: float, channels: int, width: int, rate: int) -> bytes:
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * rate)) / rate
+    x = np.stack([0.3 * np.sin(2 * np.pi * (220 + 110 * c) * t) + 0.05 * rng.standard_normal(t.size)
+                  for c in range(channels)], axis=1)
+    pcm16 = np.clip(np.rint(x * 32767), -32768, 32767).astype("<i2").tobytes()
+    return wrap_wav(convert_width(pcm16, 2, width), rate, channels, width)
+
+
+def best_of(fn: Callable[[], bytes], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="to_pcm16_mono: NumPy vs audioop")
+    ap.add_argument("--seconds", type=float, default=30.0, help="length of each synthetic input")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--target-rate", type=int, default=22050)
+    ap.add_argument("--legacy-max-seconds", type=float, default=10.0,
+                    help="cap input length for the legacy N-channel loop, which is very slow")
+    args = ap.parse_args(argv)
+
+    print(f"{'case':<22}{'in MB':>8}{'numpy s':>10}{'legacy s':>10}{'speedup':>9}")
+    for channels, width, rate in CASES:
+        data = make_wav(args.seconds, channels, width, rate)
+        ours = best_of(lambda: to_pcm16_mono(data, args.target_rate), args.repeat)
+        legacy_s = speedup = "-"
+        if audioop is not None:
+            seconds = args.seconds
+            if channels > 2 and seconds > args.legacy_max_seconds:
+                seconds = args.legacy_max_seconds  # time a shorter input and scale linearly
+            legacy_data = data if seconds == args.seconds else make_wav(seconds, channels, width, rate)
+            legacy = best_of(lambda: legacy_to_pcm16_mono(legacy_data, args.target_rate), 1) * args.seconds / seconds
+            legacy_s, speedup = f"{legacy:.3f}", f"{legacy / ours:.1f}x"
+        case = f"{channels}ch {8 * width}bit {rate}Hz"
+        print(f"{case:<22}{len(data) / 1e6:>8.1f}{ours:>10.3f}{legacy_s:>10}{speedup:>9}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+# bench/fakes.py
+# Deterministic stand-ins for the heavy engines, so the servers (and the
+# benchmark in bench/run_bench.py) run on a laptop without any models
+# -------------------------------------------------------
+# Selected with FAKE_ENGINES (see engines.py); production modules import
+# this file lazily, only for the engines that are faked.
+#
+# llm      FakeLlama: the slice of the llama_cpp.Llama API the servers use,
+#          with a per-prompt-token eval cost and a fixed per-token decode cost
+# tts      FakeTTSPool: same interface as tts_pool.TTSPool, sine-wave WAVs
+#          whose length follows the text, at a fixed real-time factor
+# stt      fake_transcribe: fixed transcript after a fixed delay
+# rhubarb  bench/stub_rhubarb.py, run through the real RhubarbRunner so the
+#          process/pool overhead is still measured
+#
+# Costs are tunable with the FAKE_* variables below.
+# -------------------------------------------------------
+
+import os
+import sys
+import time
+import zlib
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+FAKE_LLM_PROMPT_MS = float(os.getenv("FAKE_LLM_PROMPT_MS", "0.5"))   # per evaluated prompt token
+FAKE_LLM_TOKEN_MS = float(os.getenv("FAKE_LLM_TOKEN_MS", "30"))      # per generated token
+FAKE_TTS_CHARS_PER_S = float(os.getenv("FAKE_TTS_CHARS_PER_S", "14"))
+FAKE_TTS_RTF = float(os.getenv("FAKE_TTS_RTF", "0.15"))              # synthesis time / audio time
+FAKE_TTS_WORKERS = int(os.getenv("FAKE_TTS_WORKERS", "2"))
+FAKE_STT_MS = float(os.getenv("FAKE_STT_MS", "150"))
+FAKE_STT_TEXT = os.getenv("FAKE_STT_TEXT", "hi there how are you")
+
+STUB_RHUBARB = Path(__file__).resolve().parent / "stub_rhubarb.py"
+FAKE_SAMPLE_RATE = 22050
+
+FAKE_REPLIES = [
+    "Hey! I'm doing great, thanks for asking. How about you?",
+    "Hi there! Nice to hear from you. What's up today?",
+    "Oh, I only do small talk, but I'm happy to chat! How was your day?",
+    "Hello! It's lovely to see you. Anything fun planned?",
+]
+
+
+# ---------- LLM ----------
+class FakeState:
+    def __init__(self, tokens: List[int]):
+        self.tokens = list(tokens)
+        self.llama_state_size = 64 * len(tokens)
+
+
+class FakeLlama:
+    """Deterministic token generator with llama.cpp-like prompt reuse."""
+
+    def __init__(self, *args, **kwargs):
+        self.input_ids: List[int] = []
+        self.n_tokens = 0
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> List[int]:
+        # one token per whitespace-separated piece, so prefixes line up
+        return [zlib.crc32(piece) & 0x7FFF for piece in text.split()]
+
+    def reset(self) -> None:
+        self.n_tokens = 0
+
+    def eval(self, tokens: List[int]) -> None:
+        time.sleep(len(tokens) * FAKE_LLM_PROMPT_MS / 1000.0)
+        self.input_ids = self.input_ids[: self.n_tokens] + list(tokens)
+        self.n_tokens = len(self.input_ids)
+
+    def save_state(self) -> FakeState:
+        return FakeState(self.input_ids[: self.n_tokens])
+
+    def load_state(self, state: FakeState) -> None:
+        self.input_ids = list(state.tokens)
+        self.n_tokens = len(self.input_ids)
+
+    def __call__(self, prompt: str, stream: bool = False, max_tokens: int = 64, **kwargs) -> Any:
+        parts = self._generate(prompt, max_tokens)
+        if stream:
+            return ({"choices": [{"text": p}]} for p in parts)
+        text = "".join(parts)
+        return {"choices": [{"text": text}], "usage": {"completion_tokens": len(text.split())}}
+
+    def _generate(self, prompt: str, max_tokens: int) -> Iterator[str]:
+        tokens = self.tokenize(prompt.encode("utf-8"))
+        keep = 0
+        for a, b in zip(self.input_ids[: self.n_tokens], tokens[:-1]):
+            if a != b:
+                break
+            keep += 1
+        self.n_tokens = keep
+        self.eval(tokens[keep:])
+
+        reply = FAKE_REPLIES[zlib.crc32(prompt.encode("utf-8")) % len(FAKE_REPLIES)]
+        for i, word in enumerate(reply.split()[:max_tokens]):
+            time.sleep(FAKE_LLM_TOKEN_MS / 1000.0)
+            piece = (" " if i else "") + word
+            self.eval(self.tokenize(piece.encode("utf-8")))
+            yield piece
+
+
+# ---------- TTS ----------
+def sine_wav(seconds: float, sample_rate: int = FAKE_SAMPLE_RATE, freq: float = 180.0) -> bytes:
+    import numpy as np
+    from audio_utils import float_to_pcm16, wrap_wav
+
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    # a 4 Hz "syllable" envelope so energy-based consumers see speech-like dips
+    x = 0.3 * np.sin(2 * np.pi * freq * t) * (0.55 + 0.45 * np.sin(2 * np.pi * 4.0 * t))
+    return wrap_wav(float_to_pcm16(x).tobytes(), sample_rate)
+
+
+class FakeTTSPool:
+    """Drop-in for tts_pool.TTSPool."""
+
+    def __init__(self, workers: int = FAKE_TTS_WORKERS):
+        self.size = workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._queued: Dict[str, int] = {}
+
+    def start(self, timeout: float = 0) -> "FakeTTSPool":
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix="fake-tts")
+        return self
+
+    def submit(self, text: str, speaker: str, session_id: Optional[str] = None) -> Future:
+        self.start()
+        with self._lock:
+            self._queued[speaker] = self._queued.get(speaker, 0) + 1
+        return self._executor.submit(self._synthesize, text, speaker)
+
+    def synthesize(self, text: str, speaker: str, session_id: Optional[str] = None) -> bytes:
+        return self.submit(text, speaker).result()
+
+    def queue_depths(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._queued)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _synthesize(self, text: str, speaker: str) -> bytes:
+        with self._lock:
+            self._queued[speaker] -= 1
+        seconds = max(0.3, len(text) / FAKE_TTS_CHARS_PER_S)
+        time.sleep(seconds * FAKE_TTS_RTF)
+        return sine_wav(seconds, freq=220.0 if speaker.lower().startswith("tessa") else 130.0)
+
+
+# ---------- STT ----------
+def fake_transcribe(model, data: bytes, sample_rate: int = 16000) -> str:
+    time.sleep(FAKE_STT_MS / 1000.0)
+    return FAKE_STT_TEXT
+
+
+# ---------- Rhubarb ----------
+def stub_rhubarb_cmd() -> List[str]:
+    """Command prefix standing in for the rhubarb executable."""
+    return [sys.executable, str(STUB_RHUBARB)]
@@ -0,0 +1,339 @@
+# bench/run_bench.py
+# Per-stage latency benchmark for /chat, /chat/stream, /voice (main.py) and /ws/chat (main-ws.py)
+# -------------------------------------------------------
+# Start the servers (from backend/), with fake engines on a laptop:
+#   FAKE_ENGINES=all uvicorn main:app --port 8000
+#   FAKE_ENGINES=all uvicorn main-ws:app --port 3000
+# or without FAKE_ENGINES to measure the real LLM / TTS / Vosk / Rhubarb.
+# Fake engines get their own speech-cache keys. Add TTS_CACHE_MEM_ITEMS=0
+# TTS_CACHE_DISK_MB=0 REPLY_CACHE=0 to time the LLM, TTS and lipsync on every
+# request instead of measuring cache hits.
+#
+# Then:
+#   python bench/run_bench.py --requests 40 --concurrency 4 --out bench/report.json
+#   python bench/run_bench.py ... --baseline old_report.json   # print deltas
+#
+# Every response carries server-side "timings" (seconds); the report gives
+# p50/p95/p99 per stage:
+#   stt, llm (+ llm_ttft, llm_queue_wait, llm_tokens_per_s), tts,
+#   lipsync (Rhubarb or the text mode), encode, ttfa, total
+# plus client_ttft / client_ttfa / client_total as seen from here (first
+# token, first audio, whole reply; the same thing for /chat and /voice,
+# which answer in one piece). The report is plain JSON
+# with sorted keys, so two runs diff cleanly. --audio-format opus|mp3 asks
+# the servers for compressed audio; avg_response_kb shows what it saves.
+# -------------------------------------------------------
+
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import subprocess
+import urllib.request
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+MESSAGES = [
+    "hi",
+    "hello there, how are you?",
+    "what's up today?",
+    "how was your day?",
+    "tell me something nice",
+    "good morning tessa",
+]
+STAGE_ORDER = ["stt", "llm_queue_wait", "llm_ttft", "llm", "llm_tokens_per_s", "tts", "lipsync", "encode",
+               "ttfa", "total", "client_ttft", "client_ttfa", "client_total"]
+
+
+# ---------- stats ----------
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Linear interpolation between closest ranks (numpy's default)."""
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    pos = (len(sorted_values) - 1) * q
+    lo = int(pos)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (pos - lo)
+
+
+def summarize(values: List[float], unit_ms: bool = True) -> Dict[str, float]:
+    v = sorted(values)
+    scale = 1000.0 if unit_ms else 1.0
+    digits = 1 if unit_ms else 2
+    return {
+        "n": len(v),
+        "mean": round(scale * sum(v) / len(v), digits),
+        "p50": round(scale * percentile(v, 0.50), digits),
+        "p95": round(scale * percentile(v, 0.95), digits),
+        "p99": round(scale * percentile(v, 0.99), digits),
+        "max": round(scale * v[-1], digits),
+    }
+
+
+def summarize_records(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    samples: Dict[str, List[float]] = {}
+    errors = [r for r in records if r.get("error")]
+    hits = [r["speech_cache_hit"] for r in records if "speech_cache_hit" in r]
+    reply_hits = [r["reply_cache_hit"] for r in records if "reply_cache_hit" in r]
+    sizes = [r["response_bytes"] for r in records if not r.get("error") and "response_bytes" in r]
+    for r in records:
+        if r.get("error"):
+            continue
+        for stage, values in r["samples"].items():
+            samples.setdefault(stage, []).extend(v for v in values if v is not None)
+    stages = {}
+    for stage in STAGE_ORDER + sorted(set(samples) - set(STAGE_ORDER)):
+        if samples.get(stage):
+            # rates stay in their own unit; everything else is reported in ms
+            stages[stage] = summarize(samples[stage], unit_ms=not stage.endswith("_per_s"))
+    return {
+        "requests": len(records),
+        "errors": len(errors),
+        "error_samples": sorted({r["error"] for r in errors})[:5],
+        "speech_cache_hit_rate": round(sum(hits) / len(hits), 3) if hits else None,
+        "reply_cache_hit_rate": round(sum(reply_hits) / len(reply_hits), 3) if reply_hits else None,
+        "avg_response_kb": round(sum(sizes) / len(sizes) / 1024, 1) if sizes else None,
+        "stages": stages,
+    }
+
+
+# ---------- HTTP (main.py) ----------
+def http_body(url: str, body: Optional[bytes] = None, headers: Optional[Dict[str, str]] = None, timeout: float = 120) -> bytes:
+    req = urllib.request.Request(url, data=body, headers=headers or {}, method="POST" if body is not None else "GET")
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        return resp.read()
+
+
+def http_json(url: str, body: Optional[bytes] = None, headers: Optional[Dict[str, str]] = None, timeout: float = 120) -> Any:
+    return json.loads(http_body(url, body, headers, timeout))
+
+
+def multipart(fields: Dict[str, str], files: Dict[str, tuple]) -> tuple:
+    boundary = uuid.uuid4().hex
+    parts: List[bytes] = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, data, ctype) in files.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f"Content-Type: {ctype}\r\n\r\n".encode() + data + b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def http_record(raw: bytes, elapsed: float) -> Dict[str, Any]:
+    resp = json.loads(raw)
+    t = resp.get("timings") or {}
+    samples = {k: [v] for k, v in t.items() if isinstance(v, (int, float)) and not isinstance(v, bool)}
+    samples.pop("llm_tokens", None)
+    # HTTP answers arrive in one piece: first audio == whole response
+    samples["client_total"] = samples["client_ttfa"] = samples["client_ttft"] = [elapsed]
+    record: Dict[str, Any] = {"samples": samples, "response_bytes": len(raw)}
+    if "speech_cache_hit" in t:
+        record["speech_cache_hit"] = bool(t["speech_cache_hit"])
+    if "reply_cache_hit" in t:
+        record["reply_cache_hit"] = bool(t["reply_cache_hit"])
+    return record
+
+
+def chat_request(base_url: str, i: int, speaker: str, audio_format: str = "wav") -> Dict[str, Any]:
+    body = json.dumps({"message": MESSAGES[i % len(MESSAGES)], "name": speaker, "audio_format": audio_format}).encode()
+    t0 = time.perf_counter()
+    raw = http_body(f"{base_url}/chat", body, {"Content-Type": "application/json"})
+    return http_record(raw, time.perf_counter() - t0)
+
+
+def chat_stream_request(base_url: str, i: int, speaker: str, audio_format: str = "wav") -> Dict[str, Any]:
+    """/chat/stream as NDJSON: the same events as /ws/chat, over one HTTP response."""
+    body = json.dumps({"message": MESSAGES[i % len(MESSAGES)], "name": speaker, "audio_format": audio_format}).encode()
+    req = urllib.request.Request(f"{base_url}/chat/stream", data=body, headers={"Content-Type": "application/json"})
+    samples: Dict[str, List[float]] = {}
+    record: Dict[str, Any] = {"samples": samples, "response_bytes": 0}
+    first_token = first_audio = None
+    t0 = time.perf_counter()
+    with urllib.request.urlopen(req, timeout=120) as resp:
+        for line in resp:
+            record["response_bytes"] += len(line)
+            if not line.strip():
+                continue
+            data = json.loads(line)
+            mtype = data.get("type")
+            if mtype == "token" and first_token is None:
+                first_token = time.perf_counter() - t0
+            elif mtype == "message":
+                if first_audio is None:
+                    first_audio = time.perf_counter() - t0
+                for k, v in (data.get("timings") or {}).items():
+                    samples.setdefault(k, []).append(v)
+            elif mtype == "done":
+                record["reply_cache_hit"] = bool(data.get("reply_cache_hit"))
+                for k, v in (data.get("timings") or {}).items():
+                    if k != "llm_tokens" and isinstance(v, (int, float)) and not isinstance(v, bool):
+                        samples.setdefault(k, []).append(v)
+                break
+            elif mtype == "error":
+                raise RuntimeError(data.get("error"))
+    samples["client_total"] = [time.perf_counter() - t0]
+    samples["client_ttft"] = [first_token]
+    samples["client_ttfa"] = [first_audio]
+    return record
+
+
+def voice_request(base_url: str, audio: bytes, filename: str, speaker: str, audio_format: str = "wav") -> Dict[str, Any]:
+    body, ctype = multipart({"name": speaker, "audio_format": audio_format}, {"file": (filename, audio, "audio/webm")})
+    t0 = time.perf_counter()
+    raw = http_body(f"{base_url}/voice", body, {"Content-Type": ctype})
+    return http_record(raw, time.perf_counter() - t0)
+
+
+# ---------- WebSocket (main-ws.py) ----------
+async def ws_request(ws_url: str, i: int, speaker: str, audio_format: str = "wav") -> Dict[str, Any]:
+    import websockets  # only needed for the /ws/chat leg
+
+    samples: Dict[str, List[float]] = {}
+    record: Dict[str, Any] = {"samples": samples, "response_bytes": 0}
+    async with websockets.connect(ws_url, max_size=None) as ws:
+        await ws.send(json.dumps({"type": "hello", "session_id": f"bench-{i}-{uuid.uuid4().hex[:6]}", "audio_format": audio_format}))
+        await ws.recv()  # hello_ack
+        t0 = time.perf_counter()
+        await ws.send(json.dumps({"type": "user_text", "message": MESSAGES[i % len(MESSAGES)], "name": speaker}))
+        first_token = first_audio = None
+        while True:
+            msg = await ws.recv()
+            record["response_bytes"] += len(msg)
+            if isinstance(msg, bytes):
+                continue
+            data = json.loads(msg)
+            mtype = data.get("type")
+            if mtype == "token" and first_token is None:
+                first_token = time.perf_counter() - t0
+            elif mtype == "tts_chunk":
+                if first_audio is None:
+                    first_audio = time.perf_counter() - t0
+                for k, v in (data.get("timings") or {}).items():
+                    samples.setdefault(k, []).append(v)
+            elif mtype == "done":
+                if "reply_cache_hit" in data:
+                    record["reply_cache_hit"] = bool(data["reply_cache_hit"])
+                for k, v in (data.get("timings") or {}).items():
+                    if k != "llm_tokens":
+                        samples.setdefault(k, []).append(v)
+                break
+            elif mtype == "error":
+                raise RuntimeError(data.get("error"))
+        samples["client_total"] = [time.perf_counter() - t0]
+        samples["client_ttft"] = [first_token]
+        samples["client_ttfa"] = [first_audio]
+    return record
+
+
+# ---------- driver ----------
+async def drive(name: str, make: Callable[[int], Any], total: int, concurrency: int, warmup: int) -> List[Dict[str, Any]]:
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one(i: int) -> Optional[Dict[str, Any]]:
+        async with slots:
+            try:
+                result = make(i)
+                record = await result if asyncio.iscoroutine(result) else await asyncio.to_thread(result)
+            except Exception as e:
+                record = {"error": f"{type(e).__name__}: {e}", "samples": {}}
+        return record if i >= warmup else None
+
+    for i in range(warmup):
+        await one(i)  # sequential, so caches/models are warm before timing
+    t0 = time.perf_counter()
+    records = await asyncio.gather(*(one(i) for i in range(warmup, warmup + total)))
+    elapsed = time.perf_counter() - t0
+    print(f"{name}: {total} requests in {elapsed:.1f}s ({total / elapsed:.2f} req/s)")
+    return [r for r in records if r is not None]
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def print_report(report: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> None:
+    for endpoint, summary in report["endpoints"].items():
+        base = (baseline or {}).get("endpoints", {}).get(endpoint, {}).get("stages", {})
+        print(f"\n== {endpoint}: {summary['requests']} requests, {summary['errors']} errors, "
+              f"speech cache hit rate {summary['speech_cache_hit_rate']}, "
+              f"reply cache hit rate {summary.get('reply_cache_hit_rate')}, "
+              f"avg response {summary.get('avg_response_kb')} kB")
+        print(f"{'stage':<18}{'n':>6}{'p50':>10}{'p95':>10}{'p99':>10}" + (f"{'Δp50':>10}{'Δp95':>10}" if baseline else ""))
+        for stage, s in summary["stages"].items():
+            line = f"{stage:<18}{s['n']:>6}{s['p50']:>10}{s['p95']:>10}{s['p99']:>10}"
+            if baseline and stage in base:
+                line += f"{s['p50'] - base[stage]['p50']:>+10.1f}{s['p95'] - base[stage]['p95']:>+10.1f}"
+            print(line)
+        print("(ms, except *_per_s)")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Per-stage latency benchmark for the Tessa servers")
+    ap.add_argument("--http-url", default="http://localhost:8000", help="main.py base URL")
+    ap.add_argument("--ws-url", default="ws://localhost:3000/ws/chat", help="main-ws.py chat socket")
+    ap.add_argument("--endpoints", default="chat,voice,ws", help="comma list of chat, chat_stream, voice, ws")
+    ap.add_argument("--requests", type=int, default=20, help="timed requests per endpoint")
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--warmup", type=int, default=2, help="untimed sequential requests per endpoint")
+    ap.add_argument("--speaker", default="tessa")
+    ap.add_argument("--audio-format", default="wav", help="wav, opus or mp3 (servers fall back to wav without ffmpeg)")
+    ap.add_argument("--voice-file", type=Path, default=Path("audios/input.webm"))
+    ap.add_argument("--label", default="", help="free text stored in the report")
+    ap.add_argument("--out", type=Path, help="write the JSON report here")
+    ap.add_argument("--baseline", type=Path, help="earlier report to print deltas against")
+    args = ap.parse_args(argv)
+
+    endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+    report: Dict[str, Any] = {
+        "meta": {
+            "label": args.label,
+            "commit": git_commit(),
+            "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "warmup": args.warmup,
+            "audio_format": args.audio_format,
+        },
+        "endpoints": {},
+    }
+
+    async def run_all():
+        if {"chat", "chat_stream", "voice"} & set(endpoints):
+            try:
+                report["meta"]["http_server"] = await asyncio.to_thread(http_json, f"{args.http_url}/")
+            except Exception as e:
+                report["meta"]["http_server"] = {"error": str(e)}
+        for endpoint in endpoints:
+            if endpoint == "chat":
+                make = lambda i: (lambda: chat_request(args.http_url, i, args.speaker, args.audio_format))
+            elif endpoint == "chat_stream":
+                make = lambda i: (lambda: chat_stream_request(args.http_url, i, args.speaker, args.audio_format))
+            elif endpoint == "voice":
+                audio = args.voice_file.read_bytes()
+                make = lambda i: (lambda: voice_request(args.http_url, audio, args.voice_file.name, args.speaker, args.audio_format))
+            elif endpoint == "ws":
+                make = lambda i: ws_request(args.ws_url, i, args.speaker, args.audio_format)
+            else:
+                raise SystemExit(f"unknown endpoint: {endpoint}")
+            records = await drive(endpoint, make, args.requests, args.concurrency, args.warmup)
+            report["endpoints"][endpoint] = summarize_records(records)
+
+    asyncio.run(run_all())
+
+    baseline = json.loads(args.baseline.read_text(encoding="utf-8")) if args.baseline else None
+    print_report(report, baseline)
+    if args.out:
+        args.out.write_text(json.dumps(report, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+        print(f"\nreport written to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,38 @@
+# bench/stub_rhubarb.py
+# Stand-in for the rhubarb executable (FAKE_ENGINES=rhubarb)
+# -------------------------------------------------------
+# Accepts the arguments lipsync.RhubarbRunner passes
+# (-q -f json -r <recognizer> <file.wav>), sleeps FAKE_RHUBARB_RTF times the
+# audio length and prints Rhubarb-style JSON with a fixed cue pattern.
+# -------------------------------------------------------
+
+import os
+import sys
+import json
+import time
+import wave
+
+FAKE_RHUBARB_RTF = float(os.getenv("FAKE_RHUBARB_RTF", "0.25"))
+PATTERN = "BCBDBAFBECB"
+CUE_S = 0.08
+
+
+def main(argv) -> int:
+    wav_path = argv[-1]
+    with wave.open(wav_path, "rb") as wf:
+        duration = wf.getnframes() / float(wf.getframerate())
+    time.sleep(duration * FAKE_RHUBARB_RTF)
+
+    cues = [{"start": 0.0, "end": 0.05, "value": "X"}]
+    t, i = 0.05, 0
+    while t + CUE_S < duration - 0.05:
+        cues.append({"start": round(t, 2), "end": round(t + CUE_S, 2), "value": PATTERN[i % len(PATTERN)]})
+        t += CUE_S
+        i += 1
+    cues.append({"start": round(t, 2), "end": round(duration, 2), "value": "X"})
+    json.dump({"metadata": {"soundFile": wav_path, "duration": round(duration, 2)}, "mouthCues": cues}, sys.stdout)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
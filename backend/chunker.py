@@ -0,0 +1,214 @@
+# chunker.py
+# When to hand streamed LLM text to TTS (the /ws/chat chunking policy)
+# -------------------------------------------------------
+# A Chunker is fed tokens as they stream in and returns the text chunks that
+# should go to the TTS -> lipsync pipeline now; observe() is told about every
+# chunk once its audio has been sent, which is where the adaptive policy
+# learns the speed of the pipeline.
+#
+#   fixed     the original knobs: CHUNK_MAX_TOKENS tokens, sentence-end
+#             punctuation, or 500 ms since the last flush
+#   adaptive  a deliberately small first chunk for time-to-first-audio, then
+#             chunks sized so synthesis stays just ahead of playback:
+#
+#               audio_ahead = sent audio not yet played + audio of the
+#                             chunks still in the pipeline
+#               backlog     = processing time of chunks still in the pipeline
+#               target      = (audio_ahead - backlog) * CHUNK_SAFETY / proc_s_per_char
+#
+#             proc_s_per_char (slowest of TTS / lipsync, they overlap) and
+#             audio_s_per_char are EWMAs shared by every turn in the process.
+#
+# Chunks only end between tokens that start a new word, preferring sentence
+# and then clause boundaries, so words and tokens are never split.
+# CHUNKER=fixed|adaptive picks the policy.
+# -------------------------------------------------------
+
+import os
+import re
+import time
+import threading
+from abc import ABC, abstractmethod
+from typing import List, Optional
+
+from metrics import counter, gauge_func, histogram
+from speech_pipeline import SpeechChunk
+
+CHUNKER = os.getenv("CHUNKER", "adaptive")
+
+# fixed policy
+CHUNK_MAX_TOKENS = 12            # flush to TTS after this many tokens (fallback)
+CHUNK_PUNCTUATION = r"[.!?]\s$"  # regex used to detect sentence-end flush
+CHUNK_TIMER_S = 0.5
+
+# adaptive policy
+CHUNK_FIRST_MIN_CHARS = int(os.getenv("CHUNK_FIRST_MIN_CHARS", "12"))   # ~3 words: shorter sounds choppy
+CHUNK_FIRST_CHARS = int(os.getenv("CHUNK_FIRST_CHARS", "28"))
+CHUNK_MIN_CHARS = int(os.getenv("CHUNK_MIN_CHARS", "16"))
+CHUNK_MAX_CHARS = int(os.getenv("CHUNK_MAX_CHARS", "220"))
+CHUNK_SAFETY = float(os.getenv("CHUNK_SAFETY", "0.7"))
+CHUNK_EWMA = 0.2
+DEFAULT_PROC_S_PER_CHAR = 0.02    # until the first measurement
+DEFAULT_AUDIO_S_PER_CHAR = 0.07   # ~14 chars/s of speech
+
+SENTENCE_END = re.compile(r"[.!?…]+[\"')\]]*\s*$")
+CLAUSE_END = re.compile(r"[,;:—–]\s*$|\s-\s*$")
+
+CHUNK_CHARS = histogram("tessa_chunk_chars", "Characters per TTS chunk.", ["policy", "position"],
+                        (8, 16, 24, 32, 48, 64, 96, 128, 192, 256))
+CHUNK_TARGET_CHARS = histogram("tessa_chunk_target_chars", "Adaptive chunk size target at flush time.", [],
+                               (8, 16, 24, 32, 48, 64, 96, 128, 192, 256))
+CHUNK_FLUSHES = counter("tessa_chunk_flushes_total", "TTS chunk flushes by reason.", ["policy", "reason"])
+AUDIO_GAP_SECONDS = histogram("tessa_audio_gap_seconds",
+                              "Silence between a chunk's playback end and the next chunk's audio.", ["policy"],
+                              (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0))
+
+
+class Throughput:
+    """Process-wide EWMAs of pipeline cost and audio length per character."""
+
+    def __init__(self):
+        self.proc_s_per_char = DEFAULT_PROC_S_PER_CHAR
+        self.audio_s_per_char = DEFAULT_AUDIO_S_PER_CHAR
+        self.samples = 0
+        self._lock = threading.Lock()
+
+    def observe(self, chunk: SpeechChunk) -> None:
+        chars = len(chunk.text.strip())
+        if not chars or chunk.duration <= 0:
+            return
+        with self._lock:
+            self.audio_s_per_char += CHUNK_EWMA * (chunk.duration / chars - self.audio_s_per_char)
+            # speech-cache hits skip the lipsync stage and say nothing about synthesis speed
+            if "lipsync" in chunk.timings:
+                proc = max(chunk.timings.get("tts", 0.0), chunk.timings["lipsync"])
+                self.proc_s_per_char += CHUNK_EWMA * (proc / chars - self.proc_s_per_char)
+                self.samples += 1
+
+
+throughput = Throughput()
+gauge_func("tessa_chunker_seconds_per_char", "Adaptive chunker estimates.",
+           lambda: {("processing",): throughput.proc_s_per_char, ("audio",): throughput.audio_s_per_char}, ["kind"])
+
+
+class Chunker(ABC):
+    policy = "base"
+
+    def __init__(self):
+        self._buf: List[str] = []
+        self._chars = 0
+        self.flushed = 0
+        self._last_flush = time.time()
+        self._play_end: Optional[float] = None  # wall-clock time the audio sent so far finishes playing
+
+    @abstractmethod
+    def feed(self, token: str) -> List[str]:
+        """Add one streamed token; returns the chunks to push now (usually none)."""
+
+    def finish(self) -> Optional[str]:
+        """End of the LLM stream: whatever is left."""
+        return self._take("end") if self._chars and "".join(self._buf).strip() else None
+
+    def observe(self, chunk: SpeechChunk) -> None:
+        """A chunk's audio went out (seq order, duration set)."""
+        now = time.time()
+        if self._play_end is not None and now > self._play_end:
+            AUDIO_GAP_SECONDS.observe(now - self._play_end, policy=self.policy)
+        self._play_end = max(self._play_end or now, now) + chunk.duration
+
+    # ---------- helpers ----------
+    def _append(self, token: str) -> None:
+        self._buf.append(token)
+        self._chars += len(token)
+
+    def _take(self, reason: str) -> str:
+        text = "".join(self._buf)
+        self._buf.clear()
+        self._chars = 0
+        CHUNK_FLUSHES.inc(policy=self.policy, reason=reason)
+        CHUNK_CHARS.observe(len(text.strip()), policy=self.policy, position="first" if self.flushed == 0 else "later")
+        self.flushed += 1
+        self._last_flush = time.time()
+        return text
+
+
+class FixedChunker(Chunker):
+    """The original /ws/chat policy."""
+
+    policy = "fixed"
+
+    def feed(self, token: str) -> List[str]:
+        self._append(token)
+        text = "".join(self._buf)
+        if len(self._buf) >= CHUNK_MAX_TOKENS:
+            return [self._take("size")]
+        if re.search(CHUNK_PUNCTUATION, text):
+            return [self._take("sentence")]
+        if time.time() - self._last_flush > CHUNK_TIMER_S and len(text) > 6:
+            return [self._take("stall")]
+        return []
+
+
+class AdaptiveChunker(Chunker):
+    policy = "adaptive"
+
+    def __init__(self, model: Throughput = throughput):
+        super().__init__()
+        self.model = model
+        self._pending_chars = 0  # pushed, not yet observed
+
+    def target_chars(self) -> int:
+        if self.flushed == 0:
+            return CHUNK_FIRST_CHARS
+        queued = max(0.0, self._play_end - time.time()) if self._play_end is not None else 0.0
+        audio_ahead = queued + self._pending_chars * self.model.audio_s_per_char
+        backlog = self._pending_chars * self.model.proc_s_per_char
+        slack = (audio_ahead - backlog) * CHUNK_SAFETY
+        return int(min(CHUNK_MAX_CHARS, max(CHUNK_MIN_CHARS, slack / self.model.proc_s_per_char)))
+
+    def feed(self, token: str) -> List[str]:
+        out: List[str] = []
+        # a token that starts a word closes the previous one: the only place we split
+        if token[:1].isspace() and self._chars:
+            reason = self._boundary_reason()
+            if reason:
+                out.append(self._push(reason))
+        self._append(token)
+        return out
+
+    def finish(self) -> Optional[str]:
+        text = super().finish()
+        if text is not None:
+            self._pending_chars += len(text.strip())
+        return text
+
+    def observe(self, chunk: SpeechChunk) -> None:
+        super().observe(chunk)
+        self.model.observe(chunk)
+        self._pending_chars = max(0, self._pending_chars - len(chunk.text.strip()))
+
+    # ---------- internals ----------
+    def _boundary_reason(self) -> Optional[str]:
+        text = "".join(self._buf)
+        chars = len(text.strip())
+        if chars < (CHUNK_FIRST_MIN_CHARS if self.flushed == 0 else CHUNK_MIN_CHARS):
+            return None
+        target = self.target_chars()
+        if SENTENCE_END.search(text):
+            return "sentence"
+        if CLAUSE_END.search(text) and (self.flushed == 0 or chars >= 0.6 * target):
+            return "clause"
+        if chars >= target:
+            return "size"  # no clause in sight and the buffer already uses up the slack: cut between words
+        return None
+
+    def _push(self, reason: str) -> str:
+        if self.flushed:
+            CHUNK_TARGET_CHARS.observe(self.target_chars())
+        text = self._take(reason)
+        self._pending_chars += len(text.strip())
+        return text
+
+
+def make_chunker(policy: str = CHUNKER) -> Chunker:
+    return FixedChunker() if policy == "fixed" else AdaptiveChunker()
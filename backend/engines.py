@@ -0,0 +1,24 @@
+# engines.py
+# Which engines are real and which are benchmark stand-ins
+# -------------------------------------------------------
+# FAKE_ENGINES=all                  every engine is faked
+# FAKE_ENGINES=llm,tts,stt,rhubarb  pick some; real engines are used otherwise
+#
+# Production modules ask fake_enabled() here and only import bench.fakes
+# inside the branch that needs it, so a normal deployment never loads the
+# benchmark code. The stand-ins themselves live in bench/fakes.py.
+# -------------------------------------------------------
+
+import os
+from typing import List
+
+FAKE_ENGINES = {e.strip().lower() for e in os.getenv("FAKE_ENGINES", "").split(",") if e.strip()}
+
+
+def fake_enabled(engine: str) -> bool:
+    return "all" in FAKE_ENGINES or engine in FAKE_ENGINES
+
+
+def fake_engines() -> List[str]:
+    """Faked engine names, for /stats."""
+    return sorted(FAKE_ENGINES)
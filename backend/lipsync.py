@@ -0,0 +1,257 @@
+# lipsync.py
+# Pooled Rhubarb runner shared by main.py and main-ws.py
+# -------------------------------------------------------
+# - at most RHUBARB_WORKERS Rhubarb processes at once (default: CPU count)
+# - input WAV goes to RAM-backed scratch (/dev/shm when available), the JSON
+#   result is read from Rhubarb's stdout, so nothing hits the disk
+# - every job has a timeout; a stuck or cancelled job's process is killed
+# - queue/run counters via stats()
+#
+# LIPSYNC_MODE=text swaps Rhubarb for the in-process text+energy generator
+# in visemes.py; lipsync_for() picks whichever is configured.
+# -------------------------------------------------------
+
+import os
+import json
+import time
+import shutil
+import asyncio
+import logging
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from engines import fake_enabled
+from metrics import SUBPROCESS_FAILURES
+from models import model_registry
+
+log = logging.getLogger("lipsync")
+
+BIN_DIR = Path("bin")
+RHUBARB_RECOGNIZER = "phonetic"
+RHUBARB_WORKERS = int(os.getenv("RHUBARB_WORKERS", str(os.cpu_count() or 4)))
+RHUBARB_TIMEOUT_S = float(os.getenv("RHUBARB_TIMEOUT_S", "20"))
+LIPSYNC_MODE = os.getenv("LIPSYNC_MODE", "rhubarb").lower()  # "rhubarb" | "text"
+# goes into speech-cache keys so the two modes never share entries
+LIPSYNC_TAG = "text-energy" if LIPSYNC_MODE == "text" else "rhubarb-stub" if fake_enabled("rhubarb") else RHUBARB_RECOGNIZER
+
+
+class LipsyncError(RuntimeError):
+    pass
+
+
+class LipsyncTimeout(LipsyncError):
+    pass
+
+
+class LipsyncCancelled(LipsyncError):
+    pass
+
+
+def default_scratch_dir() -> Path:
+    shm = Path("/dev/shm")
+    if shm.is_dir() and os.access(shm, os.W_OK):
+        return shm
+    return Path(tempfile.gettempdir())
+
+
+def find_rhubarb() -> Path:
+    exe = BIN_DIR / ("rhubarb.exe" if os.name == "nt" else "rhubarb")
+    if exe.exists():
+        return exe
+    exe_path = shutil.which("rhubarb")
+    if exe_path:
+        return Path(exe_path)
+    raise FileNotFoundError(f"Rhubarb executable not found at {BIN_DIR} and not on PATH. Put rhubarb (or rhubarb.exe) in {BIN_DIR} or install it and ensure it's on PATH.")
+
+
+class LipsyncJob:
+    """Handle for one Rhubarb run; cancel() kills its process."""
+
+    def __init__(self):
+        self.proc: Optional[subprocess.Popen] = None
+        self.cancelled = False
+        self._lock = threading.Lock()
+
+    def attach(self, proc: subprocess.Popen) -> None:
+        with self._lock:
+            self.proc = proc
+            if self.cancelled:
+                proc.kill()
+
+    def cancel(self) -> None:
+        with self._lock:
+            self.cancelled = True
+            if self.proc is not None and self.proc.poll() is None:
+                self.proc.kill()
+
+
+class RhubarbRunner:
+    def __init__(self, workers: int = RHUBARB_WORKERS, timeout: float = RHUBARB_TIMEOUT_S,
+                 recognizer: str = RHUBARB_RECOGNIZER, scratch_dir: Optional[Path] = None):
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.recognizer = recognizer
+        self.scratch_dir = Path(scratch_dir) if scratch_dir else default_scratch_dir()
+        self._command: Optional[List[str]] = None
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="rhubarb")
+        self._jobs: List[LipsyncJob] = []
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.cancelled = 0
+        self.busy_seconds = 0.0
+
+    @property
+    def command(self) -> List[str]:
+        """The rhubarb executable, or the benchmark stub when FAKE_ENGINES includes rhubarb."""
+        if self._command is None:
+            if fake_enabled("rhubarb"):
+                from bench.fakes import stub_rhubarb_cmd
+                self._command = stub_rhubarb_cmd()
+            else:
+                self._command = [str(find_rhubarb())]
+        return self._command
+
+    # ---------- public API ----------
+    def run(self, wav_bytes: bytes, job: Optional[LipsyncJob] = None, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Blocking: queue on the pool and wait for the viseme JSON."""
+        job = job or LipsyncJob()
+        with self._lock:
+            self.queued += 1
+        return self._executor.submit(self._run, wav_bytes, job, timeout).result()
+
+    async def run_async(self, wav_bytes: bytes, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Awaitable run; cancelling the awaiting task kills the Rhubarb process."""
+        job = LipsyncJob()
+        with self._lock:
+            self.queued += 1
+        fut = self._executor.submit(self._run, wav_bytes, job, timeout)
+        try:
+            return await asyncio.wrap_future(fut)
+        except asyncio.CancelledError:
+            job.cancel()
+            raise
+
+    def cancel_all(self) -> int:
+        """Kill every running Rhubarb process; returns how many were running."""
+        with self._lock:
+            jobs = list(self._jobs)
+        for job in jobs:
+            job.cancel()
+        return len(jobs)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queued": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "timeouts": self.timeouts,
+                "cancelled": self.cancelled,
+                "avg_run_s": round(self.busy_seconds / self.completed, 4) if self.completed else 0.0,
+            }
+
+    def shutdown(self) -> None:
+        self.cancel_all()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    # ---------- worker ----------
+    def _run(self, wav_bytes: bytes, job: LipsyncJob, timeout: Optional[float]) -> Dict[str, Any]:
+        with self._lock:
+            self.queued -= 1
+            if job.cancelled:
+                self.cancelled += 1
+                raise LipsyncCancelled("lipsync job cancelled before it started")
+            self.running += 1
+            self._jobs.append(job)
+        t0 = time.time()
+        fd, wav_path = tempfile.mkstemp(suffix=".wav", dir=self.scratch_dir)
+        outcome = "failed"
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(wav_bytes)
+            cmd = [*self.command, "-q", "-f", "json", "-r", self.recognizer, wav_path]
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            job.attach(proc)
+            try:
+                stdout, stderr = proc.communicate(timeout=timeout or self.timeout)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.communicate()
+                outcome = "timeout"
+                raise LipsyncTimeout(f"Rhubarb timed out after {timeout or self.timeout:.1f}s")
+            if job.cancelled:
+                outcome = "cancelled"
+                raise LipsyncCancelled("lipsync job cancelled")
+            if proc.returncode != 0:
+                raise LipsyncError(f"Rhubarb failed (code={proc.returncode}). stderr: {stderr.decode('utf-8', 'replace').strip()!r}")
+            if not stdout.strip():
+                raise LipsyncError(f"Rhubarb produced no JSON output. stderr: {stderr.decode('utf-8', 'replace').strip()!r}")
+            result = json.loads(stdout)
+            outcome = "completed"
+            return result
+        finally:
+            elapsed = time.time() - t0
+            with self._lock:
+                self.running -= 1
+                self._jobs.remove(job)
+                if outcome == "completed":
+                    self.completed += 1
+                    self.busy_seconds += elapsed
+                elif outcome == "timeout":
+                    self.timeouts += 1
+                elif outcome == "cancelled":
+                    self.cancelled += 1
+                else:
+                    self.failed += 1
+            if outcome in ("failed", "timeout"):
+                SUBPROCESS_FAILURES.inc(tool="rhubarb", reason=outcome)
+            if os.getenv("DEBUG_TTS") == "1":
+                log.info("DEBUG_TTS=1 -> kept %s", wav_path)
+            else:
+                try:
+                    os.remove(wav_path)
+                except OSError:
+                    pass
+
+
+# one runner per process, shared by both servers
+lipsync_runner = RhubarbRunner()
+
+
+def warm_lipsync() -> str:
+    """Registry loader: the text-mode lexicon, or resolving the Rhubarb executable."""
+    if LIPSYNC_MODE == "text":
+        from visemes import viseme_generator
+        viseme_generator.warm()
+    else:
+        lipsync_runner.command
+    return LIPSYNC_MODE
+
+
+model_registry.register("lipsync", warm_lipsync)
+
+
+async def lipsync_for(wav_bytes: bytes, text: str) -> Dict[str, Any]:
+    """Mouth cues for a synthesized chunk, from Rhubarb or from its text (LIPSYNC_MODE)."""
+    if LIPSYNC_MODE == "text":
+        from visemes import viseme_generator
+        return viseme_generator.generate(wav_bytes, text)  # a few ms: not worth a thread hop
+    return await lipsync_runner.run_async(wav_bytes)
+
+
+def lipsync_stats() -> Dict[str, Any]:
+    stats: Dict[str, Any] = {"mode": LIPSYNC_MODE, "rhubarb": lipsync_runner.stats()}
+    if LIPSYNC_MODE == "text":
+        from visemes import viseme_generator
+        stats["text"] = viseme_generator.stats()
+    return stats
@@ -0,0 +1,142 @@
+# lipsync_compare.py
+# Compare the text+energy viseme generator (visemes.py) against Rhubarb
+# -------------------------------------------------------
+# For every audios/<name>.wav with a Rhubarb audios/<name>.json next to it:
+#   - builds cues with visemes.py from the WAV and its transcript
+#   - samples both cue tracks every 10 ms and reports how often they disagree,
+#     both per shape and per coarse mouth group (closed / teeth / open / round)
+#
+# Transcript lookup: audios/<name>.txt, then SAMPLE_TEXTS below, then (with
+# --transcribe) Vosk. Files without a transcript are skipped.
+#
+#   python lipsync_compare.py                 # stored Rhubarb JSON as reference
+#   python lipsync_compare.py --run-rhubarb   # re-run Rhubarb and time it too
+#   python lipsync_compare.py --json report.json
+# -------------------------------------------------------
+
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from visemes import viseme_generator, FRAME_S
+
+# lines the bundled sample clips were recorded from
+SAMPLE_TEXTS = {
+    "intro_0": "Hey dear... How was your day?",
+    "intro_1": "I missed you so much... Please don't go for so long!",
+    "api_0": "Please my dear, don't forget to add your API keys!",
+    "api_1": "You don't want to ruin Wawa Sensei with a crazy ChatGPT and ElevenLabs bill, right?",
+}
+
+SHAPES = "XABCDEFGH"
+GROUPS = {"X": 0, "A": 0, "B": 1, "G": 1, "H": 1, "C": 2, "D": 2, "E": 3, "F": 3}
+
+
+def sample_cues(cues: List[Dict[str, Any]], duration: float) -> np.ndarray:
+    """Shape index at every FRAME_S step; gaps and the tail count as X."""
+    n = max(1, int(round(duration / FRAME_S)))
+    track = np.zeros(n, dtype=np.int8)
+    for cue in cues:
+        a = int(round(cue["start"] / FRAME_S))
+        b = int(round(cue["end"] / FRAME_S))
+        track[a:b] = SHAPES.index(cue["value"])
+    return track
+
+
+def disagreement(ours: List[Dict[str, Any]], ref: List[Dict[str, Any]], duration: float) -> Dict[str, float]:
+    a, b = sample_cues(ours, duration), sample_cues(ref, duration)
+    groups = np.array([GROUPS[s] for s in SHAPES], dtype=np.int8)
+    return {
+        "shape": float(np.mean(a != b)),
+        "group": float(np.mean(groups[a] != groups[b])),
+        "frames": int(a.size),
+    }
+
+
+def find_text(wav: Path, transcribe: bool) -> Optional[str]:
+    sidecar = wav.with_suffix(".txt")
+    if sidecar.exists():
+        return sidecar.read_text(encoding="utf-8").strip()
+    if wav.stem in SAMPLE_TEXTS:
+        return SAMPLE_TEXTS[wav.stem]
+    if transcribe:
+        from stt import get_vosk_model, transcribe_stream
+        return transcribe_stream(get_vosk_model(), wav.read_bytes()) or None
+    return None
+
+
+def compare(audio_dir: Path, run_rhubarb: bool = False, transcribe: bool = False) -> Dict[str, Any]:
+    viseme_generator.warm()
+    files = []
+    for wav in sorted(audio_dir.glob("*.wav")):
+        ref_path = wav.with_suffix(".json")
+        if not ref_path.exists():
+            continue
+        text = find_text(wav, transcribe)
+        if not text:
+            print(f"skip {wav.name}: no transcript (add {wav.stem}.txt or use --transcribe)")
+            continue
+        wav_bytes = wav.read_bytes()
+
+        t0 = time.perf_counter()
+        ours = viseme_generator.generate(wav_bytes, text)
+        ours_ms = 1000.0 * (time.perf_counter() - t0)
+
+        rhubarb_ms = None
+        if run_rhubarb:
+            from lipsync import lipsync_runner
+            t0 = time.perf_counter()
+            ref = lipsync_runner.run(wav_bytes)
+            rhubarb_ms = 1000.0 * (time.perf_counter() - t0)
+        else:
+            ref = json.loads(ref_path.read_text(encoding="utf-8"))
+
+        duration = ours["metadata"]["duration"]
+        files.append({
+            "file": wav.name,
+            "text": text,
+            "duration": duration,
+            "ours_ms": round(ours_ms, 3),
+            "rhubarb_ms": round(rhubarb_ms, 3) if rhubarb_ms is not None else None,
+            **disagreement(ours["mouthCues"], ref["mouthCues"], duration),
+        })
+
+    frames = sum(f["frames"] for f in files)
+    return {
+        "files": files,
+        "total": {
+            "files": len(files),
+            "shape": sum(f["shape"] * f["frames"] for f in files) / frames if frames else 0.0,
+            "group": sum(f["group"] * f["frames"] for f in files) / frames if frames else 0.0,
+            "ours_ms_avg": sum(f["ours_ms"] for f in files) / len(files) if files else 0.0,
+        },
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__ or "Compare text+energy visemes with Rhubarb")
+    ap.add_argument("--audio-dir", default="audios", type=Path)
+    ap.add_argument("--run-rhubarb", action="store_true", help="re-run Rhubarb instead of reading the stored JSON")
+    ap.add_argument("--transcribe", action="store_true", help="use Vosk for clips without a known transcript")
+    ap.add_argument("--json", type=Path, help="also write the report here")
+    args = ap.parse_args(argv)
+
+    report = compare(args.audio_dir, run_rhubarb=args.run_rhubarb, transcribe=args.transcribe)
+    print(f"{'file':<14}{'dur s':>7}{'shape %':>9}{'group %':>9}{'ours ms':>9}{'rhubarb ms':>12}")
+    for f in report["files"]:
+        rh = f"{f['rhubarb_ms']:.1f}" if f["rhubarb_ms"] is not None else "-"
+        print(f"{f['file']:<14}{f['duration']:>7.2f}{100 * f['shape']:>9.1f}{100 * f['group']:>9.1f}{f['ours_ms']:>9.2f}{rh:>12}")
+    t = report["total"]
+    print(f"{'total':<14}{'':>7}{100 * t['shape']:>9.1f}{100 * t['group']:>9.1f}{t['ours_ms_avg']:>9.2f}")
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
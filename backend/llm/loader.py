@@ -0,0 +1,17 @@
+# llm/loader.py
+
+import logging
+
+from engines import fake_enabled
+
+logger = logging.getLogger(__name__)
+
+
+def load_llama(**kwargs):
+    """llama_cpp.Llama(**kwargs), or the deterministic stand-in when FAKE_ENGINES includes llm."""
+    if fake_enabled("llm"):
+        from bench.fakes import FakeLlama
+        logger.info("🧪 Using FakeLlama instead of %s", kwargs.get("model_path"))
+        return FakeLlama(**kwargs)
+    from llama_cpp import Llama
+    return Llama(**kwargs)
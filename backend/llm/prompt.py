@@ -0,0 +1,23 @@
+# llm/prompt.py
+
+from typing import Dict, Iterable
+
+
+def build_prompt(system_prompt: str, history: Iterable[Dict[str, str]], user_text: str) -> str:
+    """
+    Instruction/Response prompt over the session's whole history.
+
+    Every past turn is laid out exactly like the prompt + reply that produced
+    it, so as long as the history is only appended to, this prompt extends the
+    session's saved llama.cpp state (PromptStateCache) and a follow-up turn
+    only evaluates its new tokens. The history is trimmed by the session, not
+    here (see sessions.py).
+    """
+    lines = [system_prompt.strip()]
+    for turn in history:
+        if turn["role"] == "user":
+            lines.append(f"### Instruction: {turn['content']}")
+        else:
+            lines.append(f"### Response: {turn['content']}")
+    lines.append(f"### Instruction: {user_text}\n### Response:")
+    return "\n".join(lines)
@@ -0,0 +1,137 @@
+# llm/prompt_cache.py
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+PROMPT_CACHE_SESSIONS = int(os.getenv("PROMPT_CACHE_SESSIONS", "16"))
+PROMPT_CACHE_MB = int(os.getenv("PROMPT_CACHE_MB", "256"))
+
+
+def common_prefix(a: Sequence[int], b: Sequence[int]) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+class PromptStateCache:
+    """
+    Reuses evaluated llama.cpp state across requests.
+
+    - the system prompt is evaluated once at warm-up and snapshotted
+    - after each turn the session's state (prompt + reply) is kept in a
+      bounded LRU; the follow-up prompt appends to that turn (llm/prompt.py),
+      so it only evaluates its new tokens
+
+    prepare() restores the best-matching snapshot; llama-cpp-python's own
+    prefix matching in generate() then skips every token already in the
+    KV cache. Callers must hold the model exclusively between prepare() and
+    save().
+    """
+
+    def __init__(self, llm, system_prompt: str, max_sessions: int = PROMPT_CACHE_SESSIONS, max_bytes: int = PROMPT_CACHE_MB * 1024 * 1024):
+        self.llm = llm
+        self.system_prompt = system_prompt
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self._system: Optional[Tuple[List[int], Any]] = None
+        self._sessions: "OrderedDict[str, Tuple[List[int], Any]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.session_hits = 0
+        self.system_hits = 0
+        self.misses = 0
+        self.saved_tokens = 0
+        self.prompt_tokens = 0
+
+    def tokenize(self, text: str) -> List[int]:
+        # same call create_completion() makes, so prefixes line up token for token
+        return self.llm.tokenize(text.encode("utf-8"), special=True)
+
+    def warm(self) -> None:
+        """Evaluate the system prompt once and keep the snapshot."""
+        start = time.time()
+        tokens = self.tokenize(self.system_prompt)
+        self.llm.reset()
+        self.llm.eval(tokens)
+        self._system = (tokens, self.llm.save_state())
+        logger.info(f"🧊 System prompt state cached ({len(tokens)} tokens) in {time.time() - start:.2f}s")
+
+    def prepare(self, session_id: Optional[str], prompt: str) -> int:
+        """Load the snapshot sharing the longest prefix with `prompt`; returns reused token count."""
+        if self._system is None:
+            self.warm()
+        tokens = self.tokenize(prompt)
+
+        current = list(self.llm.input_ids[: self.llm.n_tokens])
+        best_len, best_state, source = common_prefix(current, tokens), None, "current"
+        with self._lock:
+            candidates = [("system", self._system)]
+            if session_id is not None and session_id in self._sessions:
+                self._sessions.move_to_end(session_id)
+                candidates.append(("session", self._sessions[session_id]))
+        for name, (state_tokens, state) in candidates:
+            n = common_prefix(state_tokens, tokens)
+            if n > best_len:
+                best_len, best_state, source = n, state, name
+
+        if best_state is not None:
+            self.llm.load_state(best_state)
+        # generate() never reuses the final prompt token (it needs its logits)
+        reused = min(best_len, len(tokens) - 1)
+        with self._lock:
+            self.prompt_tokens += len(tokens)
+            if reused <= 0:
+                self.misses += 1
+            else:
+                self.saved_tokens += reused
+                if source == "session":
+                    self.session_hits += 1
+                else:
+                    self.system_hits += 1
+        return max(reused, 0)
+
+    def save(self, session_id: Optional[str]) -> None:
+        """Snapshot the model state left by the turn that just finished."""
+        if session_id is None or self.max_sessions <= 0:
+            return
+        tokens = list(self.llm.input_ids[: self.llm.n_tokens])
+        state = self.llm.save_state()
+        size = getattr(state, "llama_state_size", 0)
+        with self._lock:
+            old = self._sessions.pop(session_id, None)
+            if old is not None:
+                self._bytes -= getattr(old[1], "llama_state_size", 0)
+            self._sessions[session_id] = (tokens, state)
+            self._bytes += size
+            while self._sessions and (len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes):
+                _, (_, evicted) = self._sessions.popitem(last=False)
+                self._bytes -= getattr(evicted, "llama_state_size", 0)
+
+    def drop(self, session_id: str) -> None:
+        with self._lock:
+            old = self._sessions.pop(session_id, None)
+            if old is not None:
+                self._bytes -= getattr(old[1], "llama_state_size", 0)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.session_hits + self.system_hits + self.misses
+            return {
+                "session_hits": self.session_hits,
+                "system_hits": self.system_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.session_hits + self.system_hits) / lookups, 4) if lookups else 0.0,
+                "saved_tokens": self.saved_tokens,
+                "prompt_tokens": self.prompt_tokens,
+                "sessions": len(self._sessions),
+                "state_bytes": self._bytes,
+            }
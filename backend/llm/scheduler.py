@@ -0,0 +1,207 @@
+# llm/scheduler.py
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+LLM_QUEUE_MAX = int(os.getenv("LLM_QUEUE_MAX", "32"))
+LLM_SHORT_PROMPT_CHARS = int(os.getenv("LLM_SHORT_PROMPT_CHARS", "80"))
+LLM_PRIORITY_AGING_S = float(os.getenv("LLM_PRIORITY_AGING_S", "2.0"))
+
+
+class SchedulerFull(RuntimeError):
+    """Raised by submit() when the request queue is at capacity."""
+
+
+@dataclass
+class GenerationJob:
+    session_id: str
+    prompt: str
+    on_token: Callable[[str], None]
+    params: Dict[str, Any]
+    should_stop: Callable[[], bool]
+    priority: int  # 0 = first turn / short input, 1 = regular
+    future: Future = field(default_factory=Future)
+    enqueued_at: float = field(default_factory=time.time)
+
+
+class LLMScheduler:
+    """
+    Single owner of the shared Llama instance.
+
+    - bounded queue (SchedulerFull beyond LLM_QUEUE_MAX waiting jobs)
+    - per-session fairness: sessions take turns, FIFO inside a session
+    - first-turn / short requests are served first; regular jobs that have
+      waited LLM_PRIORITY_AGING_S are promoted so they can't starve
+    - queued jobs can be cancelled; the running one stops at the next token
+
+    Jobs run one at a time: the high-level llama-cpp-python API drives a
+    single sequence, so sessions are not batched into one decode. Switching
+    sessions stays cheap thanks to PromptStateCache.
+
+    The job Future resolves to timing info: queue_wait, ttft, decode, tokens.
+    """
+
+    def __init__(self, llm, prompt_cache=None, max_queue: int = LLM_QUEUE_MAX):
+        self.llm = llm
+        self.prompt_cache = prompt_cache
+        self.max_queue = max_queue
+        self._queues: "OrderedDict[str, Deque[GenerationJob]]" = OrderedDict()  # order = round-robin order
+        self._calls: Deque = deque()  # maintenance callables (warm-up), run before any job
+        self._pending = 0
+        self._cond = threading.Condition()
+        self._running: Optional[GenerationJob] = None
+        self._stopped = False
+        self.completed = 0
+        self.cancelled = 0
+        self.rejected = 0
+        self.queue_wait_total = 0.0
+        self.decode_total = 0.0
+        self.tokens_total = 0
+        self._thread = threading.Thread(target=self._loop, name="llm-scheduler", daemon=True)
+        self._thread.start()
+
+    # ---------- public API ----------
+    def submit(self, session_id: str, prompt: str, on_token: Callable[[str], None], params: Dict[str, Any],
+               should_stop: Callable[[], bool] = lambda: False, first_turn: bool = False) -> Future:
+        short = len(prompt.rsplit("### Instruction:", 1)[-1]) <= LLM_SHORT_PROMPT_CHARS
+        job = GenerationJob(session_id, prompt, on_token, params, should_stop, 0 if (first_turn or short) else 1)
+        with self._cond:
+            if self._pending >= self.max_queue:
+                self.rejected += 1
+                raise SchedulerFull(f"LLM queue is full ({self.max_queue} waiting)")
+            self._queues.setdefault(session_id, deque()).append(job)
+            self._pending += 1
+            self._cond.notify()
+        return job.future
+
+    def call(self, fn: Callable[[], Any]) -> Future:
+        """Run fn() on the scheduler thread, i.e. with exclusive use of the model."""
+        fut: Future = Future()
+        with self._cond:
+            self._calls.append((fn, fut))
+            self._cond.notify()
+        return fut
+
+    def cancel(self, session_id: str) -> int:
+        """Drop the session's queued jobs; returns how many were removed."""
+        with self._cond:
+            q = self._queues.pop(session_id, None)
+            if not q:
+                return 0
+            self._pending -= len(q)
+            self.cancelled += len(q)
+        for job in q:
+            job.future.cancel()
+        return len(q)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "queued": self._pending,
+                "max_queue": self.max_queue,
+                "running": 1 if self._running else 0,
+                "sessions_waiting": len(self._queues),
+                "completed": self.completed,
+                "cancelled": self.cancelled,
+                "rejected": self.rejected,
+                "avg_queue_wait_s": round(self.queue_wait_total / self.completed, 4) if self.completed else 0.0,
+                "avg_decode_s": round(self.decode_total / self.completed, 4) if self.completed else 0.0,
+                "tokens_per_s": round(self.tokens_total / self.decode_total, 2) if self.decode_total else 0.0,
+            }
+
+    def shutdown(self) -> None:
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+    # ---------- worker ----------
+    def _next_job(self) -> GenerationJob:
+        """Pick by (priority, aging) first, then round-robin across sessions."""
+        now = time.time()
+        best_sid, best_rank = None, None
+        for order, (sid, q) in enumerate(self._queues.items()):
+            head = q[0]
+            prio = head.priority
+            if prio and now - head.enqueued_at >= LLM_PRIORITY_AGING_S:
+                prio = 0
+            rank = (prio, order)
+            if best_rank is None or rank < best_rank:
+                best_sid, best_rank = sid, rank
+        q = self._queues[best_sid]
+        job = q.popleft()
+        # served session goes to the back of the round-robin order
+        del self._queues[best_sid]
+        if q:
+            self._queues[best_sid] = q
+        self._pending -= 1
+        return job
+
+    def _loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queues and not self._calls and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                call = self._calls.popleft() if self._calls else None
+                job = self._next_job() if call is None else None
+            if call is not None:
+                fn, fut = call
+                if fut.set_running_or_notify_cancel():
+                    try:
+                        fut.set_result(fn())
+                    except BaseException as e:
+                        fut.set_exception(e)
+                continue
+            with self._cond:
+                if not job.future.set_running_or_notify_cancel():
+                    continue
+                self._running = job
+            try:
+                job.future.set_result(self._run(job))
+            except BaseException as e:
+                logger.error(f"❌ LLM job for session {job.session_id} failed: {e}")
+                job.future.set_exception(e)
+            finally:
+                with self._cond:
+                    self._running = None
+
+    def _run(self, job: GenerationJob) -> Dict[str, Any]:
+        started = time.time()
+        queue_wait = started - job.enqueued_at
+        reused = self.prompt_cache.prepare(job.session_id, job.prompt) if self.prompt_cache else 0
+
+        first_token_at = None
+        tokens = 0
+        for part in self.llm(prompt=job.prompt, stream=True, **job.params):
+            if job.should_stop():
+                break
+            if first_token_at is None:
+                first_token_at = time.time()
+            tokens += 1
+            job.on_token(part["choices"][0]["text"])
+
+        if self.prompt_cache:
+            self.prompt_cache.save(job.session_id)
+        decode = time.time() - started
+        with self._cond:
+            self.completed += 1
+            self.queue_wait_total += queue_wait
+            self.decode_total += decode
+            self.tokens_total += tokens
+        logger.info(f"🧠 LLM job {job.session_id}: waited {queue_wait:.2f}s, decoded {tokens} tokens in {decode:.2f}s (reused {reused} prompt tokens)")
+        return {
+            "queue_wait": queue_wait,
+            "ttft": (first_token_at - started) if first_token_at else None,
+            "decode": decode,
+            "tokens": tokens,
+            "reused_tokens": reused,
+        }
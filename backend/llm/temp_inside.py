@@ -1,6 +1,8 @@
 # main.py
 
-from tessa_chatbot import tessa
+from tessa_chatbot import TessaChatbot
+
+tessa = TessaChatbot()
 
 response = tessa.get_response("hi")
 print(response)
@@ -5,7 +5,9 @@ import sys
 import time
 import logging
 from contextlib import contextmanager
-from llama_cpp import Llama
+from typing import Any, Callable, Dict, Optional, Tuple
+from llm.loader import load_llama
+from llm.prompt_cache import PromptStateCache
 
 logger = logging.getLogger(__name__)
 
@@ -26,7 +28,7 @@ class TessaChatbot:
         start_time = time.time()
 
         with suppress_stdout():
-            self.llm = Llama(
+            self.llm = load_llama(
                 model_path=model_path,
                 n_threads=1,        # 🔽 Reduce threads to lower CPU usage (adjustable)
                 n_batch=8,          # 🔄 Small batch size for faster single-turn inference
@@ -44,22 +46,46 @@ class TessaChatbot:
             "Stay cheerful, short, and casual.\n"
         )
 
+        # ♻️ Evaluate the system prompt once; every request restores that state
+        self.prompt_cache = PromptStateCache(self.llm, self.system_prompt, max_sessions=0)
+        with suppress_stdout():
+            self.prompt_cache.warm()
+
         logger.info(f"✅ Tessa model initialized in {time.time() - start_time:.2f}s")
 
     def get_response(self, user_input: str) -> str:
+        return self.respond(user_input)[0]
+
+    def respond(self, user_input: str, on_token: Optional[Callable[[str], None]] = None) -> Tuple[str, Dict[str, Any]]:
+        """
+        Reply text plus {"decode": seconds, "ttft": seconds, "tokens": generated tokens}.
+        With on_token, the reply streams and each piece is passed to it as generated.
+        """
         prompt = f"{self.system_prompt}### Instruction: {user_input}\n### Response:"
         logger.info(f"💬 Prompting LLM...")
 
         start = time.time()
-        output = self.llm(
+        self.prompt_cache.prepare(None, prompt)
+        params = dict(
             prompt=prompt,
             max_tokens=64,             # 🔽 Limit token output for fast, short replies
             stop=["### Instruction:"]
         )
-        logger.info(f"✅ Response in {time.time() - start:.2f}s")
-
-        return output["choices"][0]["text"].strip()
-
+        if on_token is None:
+            output = self.llm(**params)
+            text = output["choices"][0]["text"]
+            tokens = (output.get("usage") or {}).get("completion_tokens", 0)
+            ttft = None
+        else:
+            parts, ttft = [], None
+            for part in self.llm(stream=True, **params):
+                if ttft is None:
+                    ttft = time.time() - start
+                piece = part["choices"][0]["text"]
+                parts.append(piece)
+                on_token(piece)
+            text, tokens = "".join(parts), len(parts)
+        elapsed = time.time() - start
+        logger.info(f"✅ Response in {elapsed:.2f}s")
 
-# 🔁 Only loaded once when FastAPI starts
-tessa = TessaChatbot()
+        return text.strip(), {"decode": elapsed, "ttft": ttft, "tokens": tokens}
@@ -0,0 +1,408 @@
+# llm/worker_pool.py
+
+import os
+import time
+import logging
+import threading
+import multiprocessing as mp
+from multiprocessing.connection import Connection, wait
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from llm.scheduler import LLM_QUEUE_MAX, SchedulerFull
+
+logger = logging.getLogger(__name__)
+
+LLM_WORKERS = int(os.getenv("LLM_WORKERS", "0"))                # 0 = one in-process context (LLMScheduler)
+LLM_WORKER_THREADS = int(os.getenv("LLM_WORKER_THREADS", "0"))  # 0 = cores / workers
+LLM_AFFINITY_SLACK = int(os.getenv("LLM_AFFINITY_SLACK", "2"))  # re-home a session once its worker is this much busier
+LLM_AFFINITY_MAX = 10000
+REAP_INTERVAL_S = 1.0  # how often the reader checks for dead workers, even while tokens keep arriving
+
+
+def worker_threads(workers: int, threads: int = LLM_WORKER_THREADS) -> int:
+    return threads if threads > 0 else max(1, (os.cpu_count() or 4) // max(1, workers))
+
+
+# ---------- worker process ----------
+def _worker_main(index: int, model_kwargs: Dict[str, Any], system_prompt: Optional[str],
+                 jobs: "mp.Queue", events: Connection) -> None:
+    """
+    One llama.cpp context with its own LLMScheduler and PromptStateCache.
+    Messages in:  ("submit", job_id, session_id, prompt, params, first_turn),
+                  ("cancel", session_id), ("drop", session_id), ("stop",)
+    Messages out: ("ready", index, pid) | ("failed", index, error)
+                  ("token", job_id, text) | ("done", job_id, info, stats)
+                  ("cancelled", job_id) | ("error", job_id, kind, message)
+    """
+    logging.basicConfig(level=logging.INFO, format=f"%(asctime)s [%(levelname)s] [llm-{index}] %(message)s")
+    from llm.loader import load_llama
+    from llm.prompt_cache import PromptStateCache
+    from llm.scheduler import LLMScheduler
+
+    send_lock = threading.Lock()
+
+    def emit(msg: tuple) -> None:
+        # the main thread and the scheduler thread both report
+        with send_lock:
+            events.send(msg)
+
+    try:
+        llm = load_llama(**model_kwargs)
+        cache = PromptStateCache(llm, system_prompt) if system_prompt else None
+        scheduler = LLMScheduler(llm, cache)
+        if cache is not None:
+            scheduler.call(cache.warm).result()
+    except Exception as e:
+        emit(("failed", index, f"{type(e).__name__}: {e}"))
+        return
+    emit(("ready", index, os.getpid()))
+
+    running: Dict[str, set] = {}  # session_id -> job ids queued or running here
+    stopped: set = set()          # job ids whose session was cancelled
+
+    def stats() -> Dict[str, Any]:
+        return {"scheduler": scheduler.snapshot(), "prompt_cache": cache.stats() if cache else None}
+
+    def finished(job_id: int, session_id: str, fut: Future) -> None:
+        running.get(session_id, set()).discard(job_id)
+        stopped.discard(job_id)
+        if fut.cancelled():
+            emit(("cancelled", job_id))
+        elif fut.exception() is not None:
+            emit(("error", job_id, "failed", str(fut.exception())))
+        else:
+            emit(("done", job_id, fut.result(), stats()))
+
+    while True:
+        msg = jobs.get()
+        kind = msg[0]
+        if kind == "stop":
+            scheduler.shutdown()
+            return
+        if kind == "cancel":
+            stopped.update(running.get(msg[1], ()))
+            scheduler.cancel(msg[1])
+        elif kind == "drop":
+            if cache is not None:
+                cache.drop(msg[1])
+        elif kind == "submit":
+            _, job_id, session_id, prompt, params, first_turn = msg
+            try:
+                fut = scheduler.submit(
+                    session_id,
+                    prompt,
+                    on_token=lambda tok, j=job_id: emit(("token", j, tok)),
+                    params=params,
+                    should_stop=lambda j=job_id: j in stopped,
+                    first_turn=first_turn,
+                )
+            except SchedulerFull as e:
+                emit(("error", job_id, "full", str(e)))
+                continue
+            running.setdefault(session_id, set()).add(job_id)
+            fut.add_done_callback(lambda f, j=job_id, s=session_id: finished(j, s, f))
+
+
+# ---------- dispatcher (server process) ----------
+@dataclass
+class _Job:
+    session_id: str
+    worker: int
+    on_token: Callable[[str], None]
+    should_stop: Callable[[], bool]
+    future: Future = field(default_factory=Future)
+    submitted_at: float = field(default_factory=time.time)
+    stop_sent: bool = False
+
+
+class _Worker:
+    def __init__(self, index: int, process, jobs, events: Connection):
+        self.index = index
+        self.process = process
+        self.jobs = jobs
+        self.events = events  # read end of this worker's own event pipe
+        self.pid: Optional[int] = None
+        self.ready = threading.Event()
+        self.error: Optional[str] = None
+        self.inflight = 0
+        self.completed = 0
+        self.tokens = 0
+        self.stats: Dict[str, Any] = {}
+
+    @property
+    def alive(self) -> bool:
+        return self.ready.is_set() and self.error is None and self.process.is_alive()
+
+
+class PooledPromptCacheStats:
+    """PromptStateCache.stats() summed over the workers (as last reported by each)."""
+
+    SUMMED = ("session_hits", "system_hits", "misses", "saved_tokens", "prompt_tokens", "sessions", "state_bytes")
+
+    def __init__(self, pool: "LLMWorkerPool"):
+        self.pool = pool
+
+    def stats(self) -> Dict[str, Any]:
+        total = {k: 0 for k in self.SUMMED}
+        for w in self.pool._workers:
+            for k in self.SUMMED:
+                total[k] += (w.stats.get("prompt_cache") or {}).get(k, 0)
+        lookups = total["session_hits"] + total["system_hits"] + total["misses"]
+        total["hit_rate"] = round((total["session_hits"] + total["system_hits"]) / lookups, 4) if lookups else 0.0
+        return total
+
+
+class LLMWorkerPool:
+    """
+    K llama.cpp worker processes behind the LLMScheduler interface
+    (submit / cancel / snapshot / shutdown), for many-core boxes where one
+    context can't keep up with concurrent sessions.
+
+    - every worker loads the same GGUF with use_mmap, so the weights are
+      mapped once in the page cache and shared between processes
+    - each worker gets `threads` llama.cpp threads (cores / K by default)
+    - a session sticks to the worker that already holds its prompt state;
+      new sessions, or sessions whose worker is LLM_AFFINITY_SLACK jobs busier
+      than the idlest one, go to the least loaded worker
+    - tokens stream back over one pipe per worker, all read by one thread,
+      which calls on_token exactly like the in-process scheduler does
+
+    The job Future resolves to the same timing info as LLMScheduler, with
+    queue_wait measured from submit() here, IPC included.
+    """
+
+    def __init__(self, model_kwargs: Dict[str, Any], system_prompt: Optional[str] = None,
+                 workers: int = LLM_WORKERS, threads: int = LLM_WORKER_THREADS, max_queue: int = LLM_QUEUE_MAX):
+        self.workers = max(1, workers)
+        self.threads = worker_threads(self.workers, threads)
+        self.model_kwargs = dict(model_kwargs, n_threads=self.threads, use_mmap=True)
+        self.system_prompt = system_prompt
+        self.max_queue = max_queue
+        self.prompt_cache = PooledPromptCacheStats(self) if system_prompt else None
+        self._ctx = mp.get_context("spawn")  # fork would copy the parent's threads and locks
+        self._workers: List[_Worker] = []
+        self._jobs: Dict[int, _Job] = {}
+        self._affinity: "OrderedDict[str, int]" = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._stopped = False
+        self._reader: Optional[threading.Thread] = None
+        self.completed = 0
+        self.cancelled = 0
+        self.rejected = 0
+        self.rehomed = 0
+        self.queue_wait_total = 0.0
+        self.decode_total = 0.0
+        self.tokens_total = 0
+        self.started_at = time.time()
+
+    # ---------- lifecycle ----------
+    def start(self, timeout: float = 600.0) -> "LLMWorkerPool":
+        """Spawn the workers and wait until every one has loaded and warmed its model."""
+        t0 = time.time()
+        for i in range(self.workers):
+            jobs = self._ctx.Queue()
+            # one pipe per worker: a worker killed mid-send can't wedge the others' events
+            events, events_w = self._ctx.Pipe(duplex=False)
+            proc = self._ctx.Process(target=_worker_main, name=f"llm-worker-{i}", daemon=True,
+                                     args=(i, self.model_kwargs, self.system_prompt, jobs, events_w))
+            proc.start()
+            events_w.close()  # the worker holds the only write end, so its exit reads as EOF
+            self._workers.append(_Worker(i, proc, jobs, events))
+        self._reader = threading.Thread(target=self._read_loop, name="llm-pool-reader", daemon=True)
+        self._reader.start()
+        for w in self._workers:
+            w.ready.wait(max(0.0, timeout - (time.time() - t0)))
+        failed = [f"worker {w.index}: {w.error or 'timed out'}" for w in self._workers if not w.alive]
+        if len(failed) == self.workers:
+            self.shutdown()
+            raise RuntimeError(f"no LLM worker started ({'; '.join(failed)})")
+        for f in failed:
+            logger.error(f"❌ LLM {f}")
+        logger.info(f"🧠 LLM pool ready: {self.workers - len(failed)} workers × {self.threads} threads in {time.time() - t0:.2f}s")
+        return self
+
+    def shutdown(self) -> None:
+        self._stopped = True
+        for w in self._workers:
+            try:
+                w.jobs.put(("stop",))
+            except (OSError, ValueError):
+                pass
+        for w in self._workers:
+            w.process.join(timeout=5)
+            if w.process.is_alive():
+                w.process.terminate()
+
+    # ---------- public API (same as LLMScheduler) ----------
+    def submit(self, session_id: str, prompt: str, on_token: Callable[[str], None], params: Dict[str, Any],
+               should_stop: Callable[[], bool] = lambda: False, first_turn: bool = False) -> Future:
+        with self._lock:
+            if len(self._jobs) >= self.max_queue + self.workers:
+                self.rejected += 1
+                raise SchedulerFull(f"LLM pool is full ({len(self._jobs)} in flight)")
+            worker = self._pick(session_id)
+            job_id = self._next_id
+            self._next_id += 1
+            job = self._jobs[job_id] = _Job(session_id, worker.index, on_token, should_stop)
+            worker.inflight += 1
+        worker.jobs.put(("submit", job_id, session_id, prompt, params, first_turn))
+        return job.future
+
+    def cancel(self, session_id: str) -> int:
+        """Stop the session's running job at its next token and drop its queued ones."""
+        with self._lock:
+            targets = {j.worker for j in self._jobs.values() if j.session_id == session_id}
+        for index in targets:
+            self._workers[index].jobs.put(("cancel", session_id))
+        return len(targets)
+
+    def forget(self, session_id: str) -> None:
+        """The session is gone: release its affinity and its prompt state in the worker."""
+        with self._lock:
+            index = self._affinity.pop(session_id, None)
+        if index is not None:
+            self._workers[index].jobs.put(("drop", session_id))
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            inflight = len(self._jobs)
+            running = sum(1 for w in self._workers if w.inflight > 0)
+            per_worker = [{
+                "pid": w.pid,
+                "alive": w.alive,
+                "inflight": w.inflight,
+                "completed": w.completed,
+                "tokens": w.tokens,
+                "scheduler": w.stats.get("scheduler"),
+            } for w in self._workers]
+            uptime = time.time() - self.started_at
+            return {
+                "workers": self.workers,
+                "threads_per_worker": self.threads,
+                "queued": inflight - running,
+                "max_queue": self.max_queue,
+                "running": running,
+                "sessions_pinned": len(self._affinity),
+                "completed": self.completed,
+                "cancelled": self.cancelled,
+                "rejected": self.rejected,
+                "rehomed": self.rehomed,
+                "avg_queue_wait_s": round(self.queue_wait_total / self.completed, 4) if self.completed else 0.0,
+                "avg_decode_s": round(self.decode_total / self.completed, 4) if self.completed else 0.0,
+                "tokens_per_s": round(self.tokens_total / self.decode_total, 2) if self.decode_total else 0.0,
+                "aggregate_tokens_per_s": round(self.tokens_total / uptime, 2) if uptime else 0.0,
+                "per_worker": per_worker,
+            }
+
+    # ---------- internals ----------
+    def _pick(self, session_id: Optional[str]) -> _Worker:
+        """Affinity first, least loaded otherwise (caller holds the lock)."""
+        alive = [w for w in self._workers if w.alive]
+        if not alive:
+            raise RuntimeError("no LLM worker is alive")
+        idlest = min(alive, key=lambda w: w.inflight)
+        index = self._affinity.get(session_id) if session_id is not None else None
+        if index is not None:
+            pinned = self._workers[index]
+            if pinned.alive and pinned.inflight - idlest.inflight < LLM_AFFINITY_SLACK:
+                self._affinity.move_to_end(session_id)
+                return pinned
+            self.rehomed += 1
+        if session_id is not None:
+            self._affinity[session_id] = idlest.index
+            self._affinity.move_to_end(session_id)
+            while len(self._affinity) > LLM_AFFINITY_MAX:
+                self._affinity.popitem(last=False)
+        return idlest
+
+    def _finish(self, job_id: int) -> Optional[_Job]:
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+            if job is not None:
+                self._workers[job.worker].inflight -= 1
+        return job
+
+    def _read_loop(self) -> None:
+        last_reap = time.monotonic()
+        open_pipes = {w.events for w in self._workers}
+        while not self._stopped:
+            if open_pipes:
+                ready = wait(list(open_pipes), timeout=REAP_INTERVAL_S)
+            else:
+                ready = []
+                time.sleep(REAP_INTERVAL_S)
+            for conn in ready:
+                try:
+                    msg = conn.recv()
+                except (EOFError, OSError):
+                    open_pipes.discard(conn)  # worker gone; _reap_dead fails its jobs
+                    continue
+                self._dispatch(msg)
+            # another worker streaming must not hide a dead one
+            if time.monotonic() - last_reap >= REAP_INTERVAL_S:
+                last_reap = time.monotonic()
+                self._reap_dead()
+
+    def _dispatch(self, msg: tuple) -> None:
+        kind = msg[0]
+        if kind == "token":
+            job = self._jobs.get(msg[1])
+            if job is None:
+                return
+            job.on_token(msg[2])
+            if not job.stop_sent and job.should_stop():
+                job.stop_sent = True
+                self._workers[job.worker].jobs.put(("cancel", job.session_id))
+        elif kind == "done":
+            job = self._finish(msg[1])
+            if job is None:
+                return
+            info = dict(msg[2])
+            # worker-side wait + IPC: from our submit() to the worker starting the job
+            info["queue_wait"] = max(0.0, time.time() - job.submitted_at - info["decode"])
+            w = self._workers[job.worker]
+            with self._lock:
+                w.completed += 1
+                w.tokens += info["tokens"]
+                w.stats = msg[3]
+                self.completed += 1
+                self.queue_wait_total += info["queue_wait"]
+                self.decode_total += info["decode"]
+                self.tokens_total += info["tokens"]
+            job.future.set_result(info)
+        elif kind == "cancelled":
+            job = self._finish(msg[1])
+            if job is not None:
+                with self._lock:
+                    self.cancelled += 1
+                job.future.cancel()
+        elif kind == "error":
+            job = self._finish(msg[1])
+            if job is not None:
+                job.future.set_exception(SchedulerFull(msg[3]) if msg[2] == "full" else RuntimeError(msg[3]))
+        elif kind == "ready":
+            w = self._workers[msg[1]]
+            w.pid = msg[2]
+            w.ready.set()
+        elif kind == "failed":
+            w = self._workers[msg[1]]
+            w.error = msg[2]
+            w.ready.set()
+
+    def _reap_dead(self) -> None:
+        """Fail the jobs of a worker process that died (OOM, crash) instead of hanging them."""
+        for w in self._workers:
+            if not w.ready.is_set() or w.error is not None or w.process.is_alive():
+                continue
+            w.error = f"exited with code {w.process.exitcode}"
+            logger.error(f"❌ LLM worker {w.index} (pid {w.pid}) {w.error}")
+            with self._lock:
+                dead = [jid for jid, j in self._jobs.items() if j.worker == w.index]
+            for jid in dead:
+                job = self._finish(jid)
+                if job is not None:
+                    job.future.set_exception(RuntimeError(f"LLM worker {w.index} {w.error}"))
@@ -19,18 +19,36 @@ import logging
 import tempfile
 import subprocess
 import traceback
-import audioop
 from pathlib import Path
-from typing import Dict, Any, List, Optional
+from collections import deque
+from typing import Dict, Any, List, Optional, Tuple
 
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 
-from llama_cpp import Llama
-import pyttsx3
+from llm.loader import load_llama
+from engines import fake_engines
+from llm.prompt import build_prompt
+from llm.prompt_cache import PromptStateCache
+from llm.scheduler import LLMScheduler, SchedulerFull
+from llm.worker_pool import LLMWorkerPool, LLM_WORKERS
+from sessions import Session, SessionManager, register_metrics as register_session_metrics
+from tts_cache import speech_cache, cache_key
+from tts_pool import tts_pool, speaker_key, TTS_RATE, TTS_ENGINE as POOL_ENGINE
+from tts_farm import TTSFarm, TTS_PROCS
+from stt import StreamingRecognizer, get_vosk_model, STT_SAMPLE_RATE
+from speech_pipeline import ChunkPipeline, SpeechChunk, LipsyncTimeline
+from audio_utils import to_pcm16_mono
+from lipsync import lipsync_runner, lipsync_for, lipsync_stats, LIPSYNC_TAG
+from models import model_registry
+from reply_cache import ReplyCache, Segment
+from chunker import make_chunker
+from audio_codecs import audio_encoder
+from vad import tts_span, VAD_ENABLED, VAD_TAG
+from metrics import REGISTRY, CONTENT_TYPE, counter, histogram, gauge_func, observe_timings, register_common
 import io
 import wave
-TTS_GUARD = asyncio.Semaphore(1)
 # ---------- Config ----------
 AUDIO_DIR = Path("audios"); AUDIO_DIR.mkdir(exist_ok=True)
 BIN_DIR = Path("bin"); BIN_DIR.mkdir(exist_ok=True)
@@ -40,10 +58,8 @@ N_THREADS = os.cpu_count() or 4
 CTX_LEN = 1024
 N_BATCH = 256
 
-# streaming & TTS chunking knobs
-CHUNK_MAX_TOKENS = 12            # flush to TTS after this many tokens (fallback)
-CHUNK_PUNCTUATION = r"[.!?]\s$"  # regex used to detect sentence-end flush
-TTS_RATE = 135                   # pyttsx3 voice speed
+# streaming -> TTS chunking policy: see chunker.py (CHUNKER=adaptive|fixed)
+TTS_ENGINE = f"{POOL_ENGINE}-pcm22k{VAD_TAG}"  # part of the speech-cache key (TTS_RATE lives in tts_pool.py)
 ASSISTANT_NAME = "tessa"         # choose voice based on this
 SYSTEM_PROMPT = (
     "You are Tessa, a friendly casual chatbot. "
@@ -52,6 +68,8 @@ SYSTEM_PROMPT = (
 )
 
 DEBUG_TTS = os.getenv("DEBUG_TTS", "0") == "1"
+BARGE_IN = os.getenv("BARGE_IN", "1") != "0"  # new user_text mid-turn cancels the running turn
+LLM_CANCEL_WAIT_S = 5.0
 
 # ---------- Logging ----------
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
@@ -74,60 +92,6 @@ def exec_command(cmd: List[str]) -> str:
 def b64(bytes_data: bytes) -> str:
     return base64.b64encode(bytes_data).decode("utf-8")
 
-def to_pcm16_mono(wav_bytes: bytes, target_rate: int = 22050) -> bytes:
-    """
-    Convert arbitrary WAV bytes to PCM16 mono WAV at target_rate using audioop.
-    Returns new WAV bytes.
-    """
-    with io.BytesIO(wav_bytes) as bio_in:
-        try:
-            with wave.open(bio_in, "rb") as r:
-                n_channels = r.getnchannels()
-                sampwidth = r.getsampwidth()
-                framerate = r.getframerate()
-                n_frames = r.getnframes()
-                frames = r.readframes(n_frames)
-        except wave.Error as e:
-            raise RuntimeError(f"Invalid WAV data: {e}")
-
-    # convert sample width to 2 bytes (16-bit) if needed
-    if sampwidth != 2:
-        frames = audioop.lin2lin(frames, sampwidth, 2)
-        sampwidth = 2
-
-    # downmix to mono if needed
-    if n_channels == 2:
-        frames = audioop.tomono(frames, 2, 0.5, 0.5)
-        n_channels = 1
-    elif n_channels != 1:
-        # generic collapse of N channels -> average
-        width = 2
-        samples = len(frames) // (n_channels * width)
-        mono = bytearray()
-        for i in range(samples):
-            acc = 0
-            for c in range(n_channels):
-                off = (i * n_channels + c) * width
-                acc += int.from_bytes(frames[off:off+width], "little", signed=True)
-            acc = int(acc / n_channels)
-            mono += int(acc).to_bytes(2, "little", signed=True)
-        frames = bytes(mono)
-        n_channels = 1
-
-    # resample if needed
-    if framerate != target_rate:
-        frames, _ = audioop.ratecv(frames, 2, 1, framerate, target_rate, None)
-        framerate = target_rate
-
-    # re-wrap as WAV
-    out = io.BytesIO()
-    with wave.open(out, "wb") as w:
-        w.setnchannels(1)
-        w.setsampwidth(2)
-        w.setframerate(framerate)
-        w.writeframes(frames)
-    return out.getvalue()
-
 """ def wav_bytes_from_pyttsx3(text: str, speaker_name: str) -> bytes:
     if not text.strip():
         return b""
@@ -193,253 +157,497 @@ def to_pcm16_mono(wav_bytes: bytes, target_rate: int = 22050) -> bytes:
     finally:
         if os.name == "nt":
             pythoncom.CoUninitialize() """
-import simpleaudio as sa  # pip install simpleaudio
-engine = pyttsx3.init()
-def wav_bytes_from_pyttsx3(text: str, speaker_name: str) -> bytes:
+# TTS worker processes with per-session fair queuing (TTS_PROCS=0: the in-process pool)
+tts_workers = TTSFarm() if TTS_PROCS > 0 else tts_pool
+model_registry.register("tts", tts_workers.start)
+
+def wav_bytes_from_pyttsx3(text: str, speaker_name: str, session_id: Optional[str] = None) -> bytes:
     """
-    Windows: use SAPI directly to create a clean PCM16 mono 22k WAV (best for Rhubarb)
-    Non-Windows: fall back to pyttsx3 (unchanged behavior)
+    Synthesize on the TTS workers (see tts_farm.py / tts_pool.py), normalize to
+    PCM16 mono 22050 Hz, which is what Rhubarb prefers, and trim the engine's
+    leading/trailing silence (see vad.py).
     """
     if not text or not text.strip():
         return b""
 
-    if os.name == "nt":
-        # --- SAPI path ---
-        try:
-            import pythoncom
-            pythoncom.CoInitialize()
-            import comtypes.client as cc
-            from comtypes.gen import SpeechLib  # created automatically by comtypes
-        except Exception as e:
-            # Fall back to pyttsx3 if SAPI/pywin32 isn’t available for some reason
-            logging.error("SAPI init failed, falling back to pyttsx3: %s", e)
-            return _wav_bytes_from_pyttsx3_portable(text, speaker_name)
+    raw = tts_workers.synthesize(text, speaker_name, session_id)
+    if not is_valid_wav(raw):
+        raise RuntimeError("pyttsx3 produced invalid/empty WAV")
+    # one parse and float pass does both the normalizing and the dead-air trim
+    return to_pcm16_mono(raw, target_rate=22050, trim=tts_span if VAD_ENABLED else None)
 
-        try:
-            # Output stream to WAV file
-            stream = cc.CreateObject("SAPI.SpFileStream")
-            fmt = cc.CreateObject("SAPI.SpAudioFormat")
-            fmt.Type = SpeechLib.SAFT22kHz16BitMono  # exactly what Rhubarb prefers
-            stream.Format = fmt
-
-            spvoice = cc.CreateObject("SAPI.SpVoice")
-            engine.stop()
-            # Pick a voice heuristically (optional)
-            target_is_female = speaker_name.lower() in {"tessa", "female", "alice"}
-            try:
-                tokens = spvoice.GetVoices()
-                for i in range(tokens.Count):
-                    t = tokens.Item(i)
-                    desc = t.GetDescription() or ""
-                    dlow = desc.lower()
-                    if target_is_female and any(k in dlow for k in ["zira", "female", "hazel"]):
-                        spvoice.Voice = t
-                        break
-                    if not target_is_female and any(k in dlow for k in ["david", "male"]):
-                        spvoice.Voice = t
-                        break
-            except Exception:
-                pass  # keep default if selection fails
 
-            tmp_path = tempfile.NamedTemporaryFile(suffix=".wav", delete=False).name
-            # SSFMCreateForWrite = 3
-            stream.Open(tmp_path, SpeechLib.SSFMCreateForWrite, True)
-            spvoice.AudioOutputStream = stream
-            spvoice.Rate = 0  # adjust if you want
+def is_valid_wav(wav_bytes: bytes) -> bool:
+    if not wav_bytes or len(wav_bytes) < 44:  # smaller than WAV header
+        return False
+    try:
+        with wave.open(io.BytesIO(wav_bytes), "rb") as wf:
+            wf.getparams()
+        return True
+    except wave.Error:
+        return False
 
-            # Speak synchronously into the file
-            spvoice.Speak(text)
-            spvoice.WaitUntilDone(60_000)
-            stream.Close()
+def chunk_cache_key(text: str, speaker_name: str) -> str:
+    return cache_key(text, speaker_key(speaker_name), TTS_RATE, LIPSYNC_TAG, engine=TTS_ENGINE)
+
+async def tts_stage(chunk: SpeechChunk, speaker_name: str, session_id: Optional[str] = None) -> None:
+    """Pipeline stage 1: WAV for the chunk (and its lipsync too, on a speech-cache hit)."""
+    cached = await asyncio.to_thread(speech_cache.get, chunk_cache_key(chunk.text, speaker_name))
+    if cached is not None:
+        log.info("Speech cache hit for chunk %r", chunk.text[:40])
+        chunk.wav, chunk.lipsync = cached
+        return
+
+    wav_bytes = await asyncio.to_thread(wav_bytes_from_pyttsx3, chunk.text, speaker_name, session_id)
+    if not is_valid_wav(wav_bytes):
+        log.error("Invalid WAV for '%s', skipping chunk %r", speaker_name, chunk.text[:40])
+        return
+    log.info("TTS wav bytes size: %d", len(wav_bytes))
+    chunk.wav = wav_bytes
+
+async def lipsync_stage(chunk: SpeechChunk, speaker_name: str) -> None:
+    """Pipeline stage 2: mouth cues for the chunk (LIPSYNC_MODE), then remember the pair."""
+    chunk.lipsync = await lipsync_for(chunk.wav, chunk.text)
+    await asyncio.to_thread(speech_cache.put, chunk_cache_key(chunk.text, speaker_name), chunk.wav, chunk.lipsync)
+
+async def render_reply(text: str, speaker_name: str) -> Tuple[bytes, Dict[str, Any]]:
+    """Both stages for one whole reply (reply-cache pre-bake)."""
+    chunk = SpeechChunk(text)
+    await tts_stage(chunk, speaker_name, "reply-cache")  # pre-bake queues like one more session
+    if chunk.wav and chunk.lipsync is None:
+        await lipsync_stage(chunk, speaker_name)
+    return chunk.wav, chunk.lipsync
+
+# small talk ("hi", "how are you") is answered from complete rendered replies
+reply_cache = ReplyCache(render_reply)
 
-            with open(tmp_path, "rb") as f:
-                data = f.read()
+# ---------- App ----------
+app = FastAPI()
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"], allow_methods=["*"], allow_headers=["*"], allow_credentials=True
+)
 
-            if not is_valid_wav(data):
-                raise RuntimeError("SAPI produced invalid/empty WAV")
+def load_llm_scheduler():
+    """
+    Registry loader for "llm": one llama.cpp context, owned by the scheduler
+    thread (fair queue across sessions), with the system prompt already
+    evaluated on that thread like every other use of the model.
 
-            try:
-                if os.getenv("DEBUG_TTS") == "1":
-                    logging.info("DEBUG_TTS=1 -> keeping tmp wav: %s", tmp_path)
-                else:
-                    os.remove(tmp_path)
-            except Exception:
-                pass
+    LLM_WORKERS=K > 0: K worker processes instead (see llm/worker_pool.py),
+    each with its own context and scheduler, same submit/cancel interface.
+    """
+    model_kwargs = dict(model_path=LLM_PATH, n_ctx=CTX_LEN, n_threads=N_THREADS, n_batch=N_BATCH, verbose=False)
+    if LLM_WORKERS > 0:
+        return LLMWorkerPool(model_kwargs, SYSTEM_PROMPT.strip() + "\n").start()
+    llm = load_llama(**model_kwargs)
+    scheduler = LLMScheduler(llm, PromptStateCache(llm, SYSTEM_PROMPT.strip() + "\n"))
+    scheduler.call(scheduler.prompt_cache.warm).result()
+    return scheduler
+
+model_registry.register("llm", load_llm_scheduler)
+
+sessions = SessionManager()
+WS_CONNECTIONS = 0
+
+def forget_session(session_id: str) -> None:
+    """An evicted session's prompt state (and worker affinity) goes with it."""
+    scheduler = model_registry.peek("llm")
+    if scheduler is None:
+        return
+    if isinstance(scheduler, LLMWorkerPool):
+        scheduler.forget(session_id)
+    elif scheduler.prompt_cache is not None:
+        scheduler.prompt_cache.drop(session_id)
+
+sessions.on_evict(forget_session)
+
+# ---------- metrics ----------
+def llm_jobs():
+    scheduler = model_registry.peek("llm")
+    return {(k,): v for k, v in scheduler.snapshot().items() if k in ("queued", "running")} if scheduler else None
+
+def prompt_cache():
+    scheduler = model_registry.peek("llm")
+    return scheduler.prompt_cache if scheduler else None
+
+gauge_func("tessa_llm_jobs", "LLM scheduler jobs by state.", llm_jobs, ["state"])
+gauge_func("tessa_ws_connections", "Open /ws/chat connections.", lambda: WS_CONNECTIONS)
+TURNS_CANCELLED = counter("tessa_turns_cancelled_total", "Turns stopped before they finished.", ["reason"])
+CANCEL_RECLAIMED = counter("tessa_cancel_reclaimed_total", "Work dropped or killed by cancelled turns instead of finished.", ["kind"])
+CANCEL_RELEASE_SECONDS = histogram("tessa_cancel_release_seconds", "From cancel to the turn's resources being released.")
+register_session_metrics(sessions)
+register_common(speech_cache, tts_workers, lipsync_runner, prompt_cache, reply_cache)
+
+async def run_turn(ws: WebSocket, session_id: str, sess: Session, user_text: str, speaker_name: str) -> Dict[str, int]:
+    """
+    One assistant turn: stream LLM tokens, flush chunks to TTS + Rhubarb, update history.
+    Cancelling the task (stop_turn) ends it early; it then returns what was thrown away.
+    """
+    await ws.send_json({"type": "started"})
+
+    # append-only over the session history, so the saved llama.cpp state is its prefix
+    prompt = build_prompt(SYSTEM_PROMPT, sess.history, user_text)
+    has_history = bool(sess.history)
+
+    # streaming loop
+    full_text: List[str] = []
+    chunker = make_chunker()
+
+    # TTS of chunk n+1 overlaps Rhubarb of chunk n; chunks go out in order,
+    # so the timeline clock advances in playback order too
+    timeline = LipsyncTimeline()
+
+    emitted: List[Segment] = []
+
+    async def emit(chunk: SpeechChunk):
+        audio, audio_format = await encode_chunk(ws, chunk)
+        # cues + header + audio of one chunk go out together, even on cancel
+        with pipeline.sending():
+            emitted.append((chunk.text, chunk.wav, chunk.lipsync))
+            cues = timeline.add(chunk)
+            chunker.observe(chunk)
+            await ws.send_json({
+                "type": "lipsync_delta",
+                "seq": chunk.seq,
+                "offset": round(chunk.offset, 3),
+                "duration": round(chunk.duration, 3),
+                "mouthCues": cues,
+            })
+            await send_tts_chunk(ws, chunk, audio, audio_format)
+        observe_timings("ws", "chunk", chunk.timings)
+
+    reply = reply_cache.lookup(user_text, speaker_key(speaker_name), has_history)
+    replay = deque(reply.segments if reply is not None else ())
+
+    async def replay_stage(chunk: SpeechChunk) -> None:
+        _, chunk.wav, chunk.lipsync = replay.popleft()
+
+    async def end(seq: int) -> None:
+        # the last tts_chunk went out before the pipeline knew it was the last
+        await ws.send_json({"type": "tts_final", "seq": seq})
+
+    pipeline = ChunkPipeline(
+        tts=replay_stage if reply is not None else lambda c: tts_stage(c, speaker_name, session_id),
+        lipsync=lambda c: lipsync_stage(c, speaker_name),
+        emit=emit,
+        end=end,
+    )
+
+    llm_job = None
+    cancelled = False
+    reclaimed: Dict[str, int] = {}
+    try:
+        if reply is not None:
+            # small talk: the whole reply is already rendered, no LLM/TTS/lipsync
+            log.info("Reply cache hit for %r", user_text[:40])
+            await ws.send_json({"type": "token", "text": reply.text})
+            full_text.append(reply.text)
+            for text, _, _ in reply.segments:
+                pipeline.push(text)
+        else:
+            # llama.cpp streaming runs on the scheduler thread; tokens come back through q
+            loop = asyncio.get_running_loop()
+            q: asyncio.Queue = asyncio.Queue()
 
-            return data
-        finally:
+            # waits for the startup warm-up if the model isn't loaded yet
+            scheduler = await asyncio.to_thread(model_registry.get, "llm")
             try:
-                pythoncom.CoUninitialize()
-            except Exception:
-                pass
-
-    # --- Non-Windows fallback: your original pyttsx3 flow (portable) ---
-    return _wav_bytes_from_pyttsx3_portable(text, speaker_name)
-
-
-def _wav_bytes_from_pyttsx3_portable(text: str, speaker_name: str) -> bytes:
-    """Your original pyttsx3 path, kept as a fallback for non-Windows."""
-    import pyttsx3
-    engine = pyttsx3.init()
-    engine.setProperty("rate", TTS_RATE)
+                llm_job = scheduler.submit(
+                    session_id,
+                    prompt,
+                    on_token=lambda tok: loop.call_soon_threadsafe(q.put_nowait, tok),
+                    params=dict(max_tokens=192, temperature=0.7, top_p=0.9, stop=["### Instruction:"]),
+                    should_stop=sess.cancel.is_set,
+                    first_turn=not has_history,
+                )
+            except SchedulerFull:
+                await pipeline.close()
+                await ws.send_json({"type": "error", "error": "busy"})
+                return {}
+            llm_job.add_done_callback(lambda _: loop.call_soon_threadsafe(q.put_nowait, "__LLM_DONE__"))
+
+            # consumer: send tokens immediately; flush TTS chunks opportunistically
+            while True:
+                tok = await q.get()
+                if tok == "__LLM_DONE__":
+                    break
+
+                # stream raw token to client UI ASAP
+                await ws.send_json({"type": "token", "text": tok})
+
+                full_text.append(tok)
+                for text_chunk in chunker.feed(tok):
+                    pipeline.push(text_chunk)
+
+            # flush any residue at the very end
+            residue = chunker.finish()
+            if residue:
+                pipeline.push(residue)
+
+        # wait for the last chunk to go out
+        await pipeline.close()
+    except asyncio.CancelledError:
+        # cancel / barge-in (stop_turn): release everything this turn holds before anyone acks
+        cancelled = True
+        reclaimed = await pipeline.abort()  # drops queued chunks, kills Rhubarb/ffmpeg mid-run
+        if llm_job is not None and not llm_job.done():
+            # should_stop is already true: this is at most one more token
+            await asyncio.wait([asyncio.wrap_future(llm_job)], timeout=LLM_CANCEL_WAIT_S)
+            reclaimed["llm"] = 1
+    ttfa = pipeline.first_audio_at - pipeline.started_at if pipeline.first_audio_at is not None else None
+    if ttfa is not None:
+        log.info("Turn %s: first audio after %.2fs, %d chunks in %.2fs",
+                 session_id, pipeline.first_audio_at - pipeline.started_at, pipeline.last_seq + 1, time.time() - pipeline.started_at)
+
+    final_text = "".join(full_text).strip()
+    if cancelled:
+        # only what the user actually got to hear
+        final_text = "".join(t for t, _, _ in emitted).strip()
+    # update history
+    sess.remember(user_text, final_text)
+
+    # per-turn seconds for bench/run_bench.py (per-chunk ones ride on tts_chunk)
+    timings: Dict[str, Any] = {"ttfa": ttfa, "total": time.time() - pipeline.started_at}
+    if llm_job is not None and llm_job.done() and not llm_job.cancelled() and llm_job.exception() is None:
+        info = llm_job.result()
+        timings.update(
+            llm_queue_wait=info["queue_wait"],
+            llm_ttft=info["ttft"],
+            llm=info["decode"],
+            llm_tokens=info["tokens"],
+            llm_tokens_per_s=info["tokens"] / info["decode"] if info["decode"] else None,
+        )
+        # every chunk made it out, uninterrupted: keep it as a small-talk variant
+        if not cancelled and not sess.cancel.is_set() and "".join(t for t, _, _ in emitted).strip() == final_text:
+            reply_cache.remember(user_text, speaker_key(speaker_name), final_text, emitted, has_history)
+
+    done = {"type": "done", "text": final_text, "last_seq": pipeline.last_seq, "reply_cache_hit": reply is not None,
+            "lipsync": timeline.merged(), "timings": timings, "cancelled": cancelled}
+    if not cancelled:
+        observe_timings("ws", "turn", timings)
+    try:
+        await ws.send_json(done)
+    except Exception:
+        if not cancelled:
+            raise
+        # cancelled because the socket went away
+    return reclaimed
 
-    target_is_female = speaker_name.lower() in {"tessa", "female", "alice"}
-    for voice in engine.getProperty("voices"):
-        vname = (voice.name or "").lower()
-        vid = (voice.id or "").lower()
-        if target_is_female and any(k in vname or k in vid for k in ["zira", "female", "hazel"]):
-            engine.setProperty("voice", voice.id)
-            break
-        if not target_is_female and any(k in vname or k in vid for k in ["david", "male"]):
-            engine.setProperty("voice", voice.id)
-            break
 
-    tmp_path = tempfile.NamedTemporaryFile(suffix=".wav", delete=False).name
-    try:
-        engine.save_to_file(text, tmp_path)
-        engine.runAndWait()
-        with open(tmp_path, "rb") as f:
-            raw = f.read()
-        if not is_valid_wav(raw):
-            raise RuntimeError("pyttsx3 produced invalid/empty WAV")
-        return raw
-    finally:
-        try:
-            if os.getenv("DEBUG_TTS") == "1":
-                logging.info("DEBUG_TTS=1 -> keeping tmp wav: %s", tmp_path)
-            else:
-                os.remove(tmp_path)
-        except Exception:
-            pass
+async def encode_chunk(ws: WebSocket, chunk: SpeechChunk) -> Tuple[bytes, str]:
+    """The chunk's audio in the negotiated format (see audio_codecs.py); cancelling this kills ffmpeg."""
+    t0 = time.time()
+    audio, audio_format = await audio_encoder.encode_async(chunk.wav, getattr(ws.state, "audio_format", "wav"))
+    chunk.timings["encode"] = time.time() - t0
+    return audio, audio_format
 
 
-def rhubarb_from_wav_bytes(wav_bytes: bytes) -> Dict[str, Any]:
+async def send_tts_chunk(ws: WebSocket, chunk: SpeechChunk, audio: bytes, audio_format: str) -> None:
     """
-    Run Rhubarb on WAV bytes and return viseme JSON.
-    Uses BIN_DIR/rhubarb.exe (Windows) or BIN_DIR/rhubarb (Unix) by default.
+    Mouth cues are not repeated here: they went out just before as a
+    `lipsync_delta` in turn time, and `offset` places this audio on that clock.
+
+    Default: one JSON frame with base64 audio.
+    binary_audio (negotiated in hello): a JSON header frame with seq, text and
+    offset, then the audio as a binary frame. Binary frames are only ever audio
+    and go out in seq order, so a client pairs each one with the latest header;
+    token frames may arrive in between.
+    audio_format (negotiated in hello): wav, or opus/mp3 encoded from the WAV
+    that lipsync already ran on (encode_chunk).
     """
-    exe = BIN_DIR / ("rhubarb.exe" if os.name == "nt" else "rhubarb")
-    print(exe)
-    if not exe.exists():
-        # also try PATH fallback
-        exe_path = shutil.which("rhubarb")
-        if exe_path:
-            exe = Path(exe_path)
-        else:
-            raise FileNotFoundError(f"Rhubarb executable not found at {BIN_DIR} and not on PATH. Put rhubarb (or rhubarb.exe) in {BIN_DIR} or install it and ensure it's on PATH.")
-
-    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as w:
-        w.write(wav_bytes)
-        wav_path = w.name
-    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as j:
-        json_path = j.name
-
-    try:
-        cmd = [str(exe), "-f", "json", "-o", json_path, wav_path, "-r", "phonetic"]
-        log.info("Running rhubarb: %s", " ".join(cmd))
+    header = {
+        "type": "tts_chunk",
+        "seq": chunk.seq,
+        "final": chunk.final,
+        "text": chunk.text,
+        "offset": round(chunk.offset, 3),
+        "duration": round(chunk.duration, 3),
+        "audio_format": audio_format,
+    }
+    if getattr(ws.state, "binary_audio", False):
+        header.update(binary=True, audio_bytes=len(audio), timings=chunk.timings)
+        await ws.send_json(header)
+        await ws.send_bytes(audio)
+    else:
+        header["audio_b64"] = b64(audio)
+        header["timings"] = chunk.timings
+        await ws.send_json(header)
+
+async def stop_turn(session_id: str, sess: Session, turn: Optional[asyncio.Task], reason: str) -> Dict[str, Any]:
+    """
+    Cancel the session's turn and wait until what it held is released: its LLM
+    job, its queued and running TTS, and any Rhubarb/ffmpeg process. Returns
+    what was thrown away, for cancel_ack and metrics.
+    """
+    t0 = time.time()
+    sess.cancel.set()
+    reclaimed: Dict[str, int] = {}
+    scheduler = model_registry.peek("llm")
+    if scheduler is not None:
+        scheduler.cancel(session_id)
+    if TTS_PROCS > 0:
+        tts = tts_workers.cancel(session_id)
+        reclaimed["tts_queued"], reclaimed["tts_killed"] = tts["queued"], tts["running"]
+    running = turn is not None and not turn.done()
+    if running:
+        turn.cancel()
+        await asyncio.wait([turn])
+        if not turn.cancelled() and turn.exception() is None:
+            dropped = dict(turn.result() or {})
+            if TTS_PROCS > 0:
+                # the chunk that was in TTS is the farm job already counted as tts_queued / tts_killed
+                dropped.pop("tts", None)
+            reclaimed.update(dropped)
+        TURNS_CANCELLED.inc(reason=reason)
+    for kind, n in reclaimed.items():
+        if n:
+            CANCEL_RECLAIMED.inc(n, kind=kind)
+    released = time.time() - t0
+    if running:
+        CANCEL_RELEASE_SECONDS.observe(released)
+    log.info("Cancelled turn of %s (%s) in %.3fs: %s", session_id, reason, released, reclaimed)
+    return {"reason": reason, "turn_cancelled": running, "reclaimed": reclaimed, "released_s": round(released, 3)}
+
+def start_turn(ws: WebSocket, session_id: Optional[str], user_text: str, speaker_name: str) -> asyncio.Task:
+    """
+    Run a turn as a task so the receive loop keeps reading (cancel, audio
+    frames). A new turn barges in: the session's running one is stopped and
+    acked first (BARGE_IN=0: wait for it to finish instead).
+    """
+    sess = sessions.get_or_create(session_id or "default")
+    prev: Optional[asyncio.Task] = sess.turn
+
+    async def turn():
+        if prev is not None and not prev.done():
+            if BARGE_IN:
+                released = await stop_turn(session_id or "default", sess, prev, "barge_in")
+                await ws.send_json({"type": "cancel_ack", **released})
+            else:
+                await asyncio.wait([prev])
+        sess.cancel.clear()
         try:
-            out = exec_command(cmd)
-            if out:
-                log.debug("rhubarb stdout: %s", out)
+            return await run_turn(ws, session_id or "default", sess, user_text, speaker_name)
         except Exception as e:
-            # include stdout/stderr in message from exec_command
-            log.error("Rhubarb execution failed: %s", e)
-            raise
-
-        # verify json exists and is non-empty
-        if not os.path.exists(json_path) or os.path.getsize(json_path) == 0:
-            # if rhubarb produced no JSON, try to read stdout/stderr by running with shell for extra info
+            log.error("Turn error:\n%s", traceback.format_exc())
             try:
-                debug_cmd = " ".join(cmd)
-                res = subprocess.run(debug_cmd, shell=True, capture_output=True, text=True)
-                log.error("Rhubarb debug run returned code=%s stdout=%r stderr=%r", res.returncode, res.stdout, res.stderr)
+                await ws.send_json({"type": "error", "error": str(e)})
             except Exception:
-                log.exception("Failed to run rhubarb debug command")
-            raise RuntimeError("Rhubarb produced no JSON output (empty file)")
-
-        with open(json_path, "r", encoding="utf-8") as f:
-            txt = f.read()
-        if not txt.strip():
-            raise RuntimeError("Rhubarb JSON file is empty")
-        return json.loads(txt)
-    finally:
-        # cleanup unless debug
-        if DEBUG_TTS:
-            log.info("DEBUG_TTS=1 -> kept %s and %s", wav_path, json_path)
-        else:
-            for p in (wav_path, json_path):
-                try:
-                    os.remove(p)
-                except Exception:
-                    pass
-def is_valid_wav(wav_bytes: bytes) -> bool:
-    if not wav_bytes or len(wav_bytes) < 44:  # smaller than WAV header
-        return False
-    try:
-        with wave.open(io.BytesIO(wav_bytes), "rb") as wf:
-            wf.getparams()
-        return True
-    except wave.Error:
-        return False
+                pass
 
-def build_prompt(history: List[Dict[str,str]], user_text: str) -> str:
-    # ultra-short context for latency; last 2 user/assistant pairs
-    lines = [SYSTEM_PROMPT.strip()]
-    for turn in history[-2:]:
-        if turn["role"] == "user":
-            lines.append(f"### Instruction: {turn['content']}\n### Response: {turn.get('reply','')}".strip())
-        else:
-            lines.append(f"### Assistant: {turn['content']}".strip())
-    lines.append(f"### Instruction: {user_text}\n### Response:")
-    return "\n".join(lines)
+    task = asyncio.create_task(turn())
+    sess.turn = task
+    sess.owner = ws
+    return task
 
-# ---------- App ----------
-app = FastAPI()
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"], allow_methods=["*"], allow_headers=["*"], allow_credentials=True
-)
+async def open_speech_stream(ws: WebSocket, session_id: Optional[str], speaker_name: str, fmt: str, sample_rate: int) -> StreamingRecognizer:
+    """
+    Per-session Vosk recognizer fed by incoming audio frames. Partials go back
+    as `partial_transcript`; every endpoint becomes a `transcript` and starts
+    the LLM turn right away, without waiting for the upload to finish.
+    """
+    loop = asyncio.get_running_loop()
 
-# load LLM once
-log.info("Loading LLM…")
-t0 = time.time()
-LLM = Llama(
-    model_path=LLM_PATH,
-    n_ctx=CTX_LEN,
-    n_threads=N_THREADS,
-    n_batch=N_BATCH,
-    verbose=False,
-)
-log.info("LLM ready in %.2fs", time.time() - t0)
+    def on_event(kind: str, text: str):
+        # may run on the ffmpeg reader thread
+        asyncio.run_coroutine_threadsafe(deliver(kind, text), loop)
 
-SESSIONS: Dict[str, Dict[str, Any]] = {}  # session_id -> {"history":[{role,content}], "cancel":Event}
+    async def deliver(kind: str, text: str):
+        try:
+            if kind == "partial":
+                await ws.send_json({"type": "partial_transcript", "text": text})
+                return
+            await ws.send_json({"type": "transcript", "text": text})
+            start_turn(ws, session_id, text, speaker_name)
+        except Exception:
+            log.error("Speech event error:\n%s", traceback.format_exc())
+
+    model = await asyncio.to_thread(get_vosk_model)
+    return await asyncio.to_thread(StreamingRecognizer, model, on_event, fmt, sample_rate)
+
+@app.on_event("startup")
+async def startup_event():
+    # LLM, TTS, Vosk and lipsync load in parallel in the background, so the
+    # socket comes up right away; see /ready
+    model_registry.warm()
+    sessions.start()
+    app.state.prebake = asyncio.create_task(reply_cache.prebake())
+
+@app.on_event("shutdown")
+def shutdown_event():
+    sessions.shutdown()
+    tts_workers.shutdown()
+    scheduler = model_registry.peek("llm")
+    if scheduler is not None:
+        scheduler.shutdown()
+    lipsync_runner.shutdown()
+    audio_encoder.shutdown()
 
 @app.get("/")
 async def root():
     return {"status": "✅ WS server running"}
 
+@app.get("/ready")
+async def ready():
+    ok = model_registry.ready()
+    return JSONResponse(status_code=200 if ok else 503, content={"ready": ok, "models": model_registry.status()})
+
+@app.get("/stats")
+async def stats():
+    scheduler = model_registry.peek("llm")
+    return {
+        "prompt_cache": scheduler.prompt_cache.stats() if scheduler else None,
+        "llm_scheduler": scheduler.snapshot() if scheduler else None,
+        "sessions": sessions.stats(),
+        "speech_cache": speech_cache.stats(),
+        "reply_cache": reply_cache.stats(),
+        "lipsync": lipsync_stats(),
+        "audio_encoder": audio_encoder.stats(),
+        "tts": tts_workers.stats() if TTS_PROCS > 0 else {"queue_depths": tts_workers.queue_depths()},
+        "fake_engines": fake_engines(),
+    }
+
+@app.get("/metrics")
+async def metrics():
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
 @app.websocket("/ws/chat")
 async def chat_ws(ws: WebSocket):
+    global WS_CONNECTIONS
     await ws.accept()
+    WS_CONNECTIONS += 1
     session_id: Optional[str] = None
+    speech: Optional[StreamingRecognizer] = None
     try:
         while True:
-            msg = await ws.receive_json()
+            frame = await ws.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
+            if frame.get("bytes") is not None:
+                # binary frame = audio for the open speech stream
+                if speech is not None:
+                    await asyncio.to_thread(speech.feed, frame["bytes"])
+                continue
+            msg = json.loads(frame.get("text") or "{}")
             mtype = msg.get("type")
 
             if mtype == "hello":
                 session_id = msg.get("session_id") or "default"
-                if session_id not in SESSIONS:
-                    SESSIONS[session_id] = {"history": [], "cancel": asyncio.Event()}
-                else:
-                    SESSIONS[session_id]["cancel"].clear()
-                await ws.send_json({"type": "hello_ack", "session_id": session_id})
+                sessions.get_or_create(session_id).cancel.clear()
+                # opt-in: audio as binary frames instead of base64 inside JSON
+                ws.state.binary_audio = bool(msg.get("binary_audio"))
+                # opt-in: "opus" / "mp3" instead of wav; the ack says what we'll actually send
+                ws.state.audio_format = audio_encoder.negotiate(msg.get("audio_format"))
+                await ws.send_json({"type": "hello_ack", "session_id": session_id, "binary_audio": ws.state.binary_audio,
+                                    "audio_format": ws.state.audio_format})
                 continue
 
             if mtype == "cancel":
-                if session_id and session_id in SESSIONS:
-                    SESSIONS[session_id]["cancel"].set()
-                    await ws.send_json({"type": "cancel_ack"})
+                sess = sessions.get(session_id) if session_id else None
+                if sess is not None:
+                    # acked only once the LLM, TTS, Rhubarb and ffmpeg work is actually gone
+                    released = await stop_turn(session_id, sess, sess.turn, "client")
+                    await ws.send_json({"type": "cancel_ack", **released})
                 continue
 
             if mtype == "user_text":
@@ -449,131 +657,31 @@ async def chat_ws(ws: WebSocket):
                     await ws.send_json({"type": "error", "error": "empty_text"})
                     continue
 
-                sess = SESSIONS.setdefault(session_id or "default", {"history": [], "cancel": asyncio.Event()})
-                sess["cancel"].clear()
-                await ws.send_json({"type": "started"})
-
-                prompt = build_prompt(sess["history"], user_text)
-
-                # streaming loop
-                buf_tokens: List[str] = []
-                buf_text: List[str] = []
-                full_text: List[str] = []
-
-                last_flush_time = time.time()
-
-                def should_flush(chunk_so_far: str, tokens_in_chunk: int) -> bool:
-                    # flush if punctuation at end or max tokens or 500ms passed (for responsiveness)
-                    if tokens_in_chunk >= CHUNK_MAX_TOKENS:
-                        return True
-                    if re.search(CHUNK_PUNCTUATION, chunk_so_far):
-                        return True
-                    if time.time() - last_flush_time > 0.5 and len(chunk_so_far) > 6:
-                        return True
-                    return False
-
-                # run llama.cpp streaming (blocking generator) in executor
-                loop = asyncio.get_running_loop()
-                q: asyncio.Queue = asyncio.Queue()
-
-                def llm_worker():
-                    try:
-                        for part in LLM(
-                            prompt=prompt,
-                            max_tokens=192,
-                            temperature=0.7,
-                            top_p=0.9,
-                            stop=["### Instruction:"],
-                            stream=True,
-                        ):
-                            if sess["cancel"].is_set():
-                                break
-                            tok = part["choices"][0]["text"]
-                            asyncio.run_coroutine_threadsafe(q.put(tok), loop)
-                    finally:
-                        asyncio.run_coroutine_threadsafe(q.put("__LLM_DONE__"), loop)
-
-                loop.run_in_executor(None, llm_worker)
-
-                # consumer: send tokens immediately; flush TTS chunks opportunistically
-                while True:
-                    tok = await q.get()
-                    if tok == "__LLM_DONE__":
-                        break
-
-                    # stream raw token to client UI ASAP
-                    await ws.send_json({"type": "token", "text": tok})
-
-                    buf_tokens.append(tok)
-                    buf_text.append(tok)
-                    full_text.append(tok)
-
-                    chunk = "".join(buf_text)
-                    if should_flush(chunk, len(buf_tokens)):
-                        # snapshot current chunk
-                        text_chunk = chunk
-                        buf_tokens.clear()
-                        buf_text.clear()
-                        last_flush_time = time.time()
-
-                        # run TTS + rhubarb in background, stream when ready
-                        async def tts_task(chunk_text=text_chunk, who=speaker_name):
-                            try:
-                                if not chunk_text.strip():
-                                    print(f"[WARN] Skipping TTS for '{who}' — empty string")
-                                    return  # Skip this TTS task entirely
-                                async with TTS_GUARD:
-                                    wav_bytes = await asyncio.to_thread(wav_bytes_from_pyttsx3, chunk_text, who)
-                                if not is_valid_wav(wav_bytes):
-                                    log.error(f"Invalid WAV in tts_task for '{who}', skipping.")
-                                    return                    
-
-                                # ✅ Validate WAV before Rhubarb
-                                if not wav_bytes or len(wav_bytes) < 44:
-                                    logging.error("Skipping Rhubarb: invalid or empty WAV data")
-                                    return  # skip this chunk instead of crashing
-
-                                log.info("TTS wav bytes size: %d", len(wav_bytes))
-                                lips = await asyncio.to_thread(rhubarb_from_wav_bytes, wav_bytes)
-                                await ws.send_json({
-                                    "type": "tts_chunk",
-                                    "text": chunk_text,
-                                    "audio_b64": b64(wav_bytes),
-                                    "lipsync": lips,
-                                })
-                            except Exception as e:
-                                log.error("TTS/Rhubarb error:\n%s", traceback.format_exc())
-
-                        asyncio.create_task(tts_task())
-
-                # flush any residue at the very end
-                if buf_text:
-                    text_chunk = "".join(buf_text)
-                    async def final_tts_task(chunk_text=text_chunk, who=speaker_name):
-                        try:
-                            async with TTS_GUARD:
-                                wav_bytes = await asyncio.to_thread(wav_bytes_from_pyttsx3, chunk_text, who)
-                            if not wav_bytes or len(wav_bytes) < 44 or not is_valid_wav(wav_bytes):
-                                log.error("Generated TTS WAV is invalid or empty, skipping Rhubarb.")
-                                return
-                            log.info("Final TTS wav bytes size: %d", len(wav_bytes))
-                            lips = await asyncio.to_thread(rhubarb_from_wav_bytes, wav_bytes)
-                            await ws.send_json({
-                                "type": "tts_chunk",
-                                "text": chunk_text,
-                                "audio_b64": b64(wav_bytes),
-                                "lipsync": lips,
-                            })
-                        except Exception as e:
-                            log.error("Final TTS/Rhubarb error:\n%s", traceback.format_exc())
-                    asyncio.create_task(final_tts_task())
-
-                final_text = "".join(full_text).strip()
-                # update history
-                sess["history"].append({"role": "user", "content": user_text})
-                sess["history"].append({"role": "assistant", "content": final_text})
-
-                await ws.send_json({"type": "done", "text": final_text})
+                start_turn(ws, session_id, user_text, speaker_name)
+                continue
+
+            if mtype == "audio_start":
+                # speech input: PCM16 (default) or any ffmpeg-readable container, then binary frames
+                if speech is not None:
+                    await asyncio.to_thread(speech.close)
+                speech_name = (msg.get("name") or ASSISTANT_NAME).strip() or ASSISTANT_NAME
+                speech = await open_speech_stream(ws, session_id, speech_name, msg.get("format") or "pcm16", int(msg.get("sample_rate") or STT_SAMPLE_RATE))
+                await ws.send_json({"type": "audio_ack"})
+                continue
+
+            if mtype == "audio_chunk":
+                # JSON fallback for clients that can't send binary frames
+                if speech is None:
+                    await ws.send_json({"type": "error", "error": "no_audio_stream"})
+                    continue
+                await asyncio.to_thread(speech.feed, base64.b64decode(msg.get("audio_b64") or ""))
+                continue
+
+            if mtype == "audio_end":
+                if speech is not None:
+                    rec, speech = speech, None
+                    await asyncio.to_thread(rec.finish)
+                continue
 
     except WebSocketDisconnect:
         pass
@@ -583,6 +691,14 @@ async def chat_ws(ws: WebSocket):
             await ws.send_json({"type": "error", "error": str(e)})
         except Exception:
             pass
+    finally:
+        WS_CONNECTIONS -= 1
+        if speech is not None:
+            await asyncio.to_thread(speech.close)
+        sess = sessions.get(session_id) if session_id else None
+        if sess is not None and sess.busy and sess.owner is ws:
+            # nobody left to hear it
+            await stop_turn(session_id, sess, sess.turn, "disconnect")
 
 # optional run
 # if __name__ == "__main__":
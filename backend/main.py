@@ -1,17 +1,32 @@
+import asyncio
 import base64
 import json
 import os
 import subprocess
+import threading
 import time
-import wave
 import logging
+from contextlib import asynccontextmanager
 from pathlib import Path
-from fastapi import FastAPI, UploadFile, File , Form
+from typing import List, Optional, Tuple
+from fastapi import FastAPI, UploadFile, File , Form, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from vosk import Model, KaldiRecognizer
-import pyttsx3
 from llm.tessa_chatbot import TessaChatbot
+from tts_cache import speech_cache, cache_key
+from tts_pool import tts_pool, speaker_key, TTS_RATE, TTS_ENGINE
+from stages import Stage, StageSet, StageFull
+from stt import transcribe_stream, get_vosk_model
+from engines import fake_enabled, fake_engines
+from lipsync import lipsync_runner, lipsync_for, lipsync_stats, LIPSYNC_TAG
+from models import model_registry
+from reply_cache import ReplyCache, Segment
+from speech_pipeline import ChunkPipeline, SpeechChunk, LipsyncTimeline
+from chunker import make_chunker
+from audio_codecs import audio_encoder
+from vad import trim_wav, VAD_TAG
+from metrics import REGISTRY, CONTENT_TYPE, gauge_func, observe_timings, register_common
 import re
 
 # --- Setup Logging ---
@@ -26,14 +41,35 @@ BIN_DIR = Path("bin"); BIN_DIR.mkdir(exist_ok=True)
 app = FastAPI()
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
 
+# --- Pipeline Stages ---
+# Blocking work never runs on the event loop. Sizes are overridable with
+# STAGE_<NAME>_WORKERS / STAGE_<NAME>_QUEUE; a full stage answers 503.
+CPU_COUNT = os.cpu_count() or 4
+STAGES = StageSet(
+    llm=Stage("llm", workers=1, max_queue=16),            # single llama.cpp context
+    tts=Stage("tts", workers=tts_pool.size, max_queue=16),  # one thread per pre-warmed engine
+    stt=Stage("stt", workers=CPU_COUNT, max_queue=32),    # ffmpeg decode pipe + Vosk recognizer
+    io=Stage("io", workers=CPU_COUNT * 2, max_queue=64),  # file + cache I/O (Rhubarb has its own pool in lipsync.py)
+)
+
+@app.exception_handler(StageFull)
+async def stage_full_handler(request: Request, exc: StageFull):
+    logger.warning(f"🚦 Rejecting {request.url.path}: stage '{exc.stage}' is full")
+    return JSONResponse(status_code=503, content={"error": "busy", "stage": exc.stage}, headers={"Retry-After": "1"})
+
 # --- Vosk STT Setup ---
-VOSK_MODEL_DIR = "vosk-model-small-en-us-0.15"
-vosk_model = Model(VOSK_MODEL_DIR)
+# warmed at startup through the model registry; FAKE_ENGINES=stt needs no model
+def transcribe_upload(upload: bytes, timings: Optional[dict] = None) -> str:
+    if fake_enabled("stt"):
+        from bench.fakes import fake_transcribe
+        return fake_transcribe(None, upload)
+    return transcribe_stream(get_vosk_model(), upload, timings=timings)
 
 # --- Input Schema ---
 class MessageInput(BaseModel):
     message: str
     name: str
+    audio_format: str = "wav"  # or "opus" / "mp3", see audio_codecs.py
 
 class ChatRequest(BaseModel):
     message: str
@@ -53,145 +89,417 @@ def read_json(path: Path):
     with open(path, "r", encoding="utf-8") as f:
         return json.load(f)
 
-def generate_lipsync(wav_path: Path, json_path: Path):
-    exec_command(f'"{BIN_DIR / ("rhubarb.exe" if os.name == "nt" else "rhubarb")}" -f json -o "{json_path}" "{wav_path}" -r phonetic')
+def bytes_to_base64(data: bytes) -> str:
+    return base64.b64encode(data).decode("utf-8")
 
-def generate_audio_pyttsx3(text: str, output_path: Path, name: str):
-    engine = pyttsx3.init()
-    engine.setProperty("rate", 135)
+def speech_key(text: str, name: str) -> str:
+    return cache_key(text, speaker_key(name), TTS_RATE, LIPSYNC_TAG, engine=TTS_ENGINE + VAD_TAG)
 
-    # Choose voice based on character name
-    for voice in engine.getProperty("voices"):
-        if name.lower() == "tessa":
-            if any(k in voice.name.lower() or k in voice.id.lower() for k in ["zira", "hazel", "female"]):
-                engine.setProperty("voice", voice.id)
-                break
-        elif name.lower() == "hardin":
-            if any(k in voice.name.lower() or k in voice.id.lower() for k in ["david", "male"]):
-                engine.setProperty("voice", voice.id)
-                break
+def synthesize_trimmed(text: str, name: str) -> Tuple[bytes, float]:
+    """TTS without the engine's leading/trailing silence (see vad.py), so lipsync and playback skip it too."""
+    return trim_wav(tts_pool.synthesize(text, name))
 
-    engine.save_to_file(text, str(output_path.resolve()))
-    engine.runAndWait()
+async def render_speech(text: str, name: str, timings: dict):
+    """TTS + lipsync for `text`, served from the shared speech cache when possible."""
+    key = speech_key(text, name)
+    cached = await STAGES.io.run(speech_cache.get, key)
+    timings["speech_cache_hit"] = cached is not None
+    if cached is not None:
+        logger.info("♻️ Speech cache hit")
+        return cached
+
+    t0 = time.time()
+    wav_bytes, timings["tts_trimmed"] = await STAGES.tts.run(synthesize_trimmed, text, name)
+    t1 = time.time()
+    lipsync = await lipsync_for(wav_bytes, text)
+    t2 = time.time()
+    timings["tts"], timings["lipsync"] = t1 - t0, t2 - t1
+    await STAGES.io.run(speech_cache.put, key, wav_bytes, lipsync)
+    return wav_bytes, lipsync
+
+# --- Small-talk Reply Cache ---
+# "hi" / "how are you" come back as a complete pre-rendered message
+reply_cache = ReplyCache(lambda text, speaker: render_speech(text, speaker, {}))
+
+async def cached_reply(message: str, name: str, timings: dict, t0: float, endpoint: str, audio_format: str):
+    """The full response for a cached small-talk input, else None."""
+    reply = reply_cache.lookup(message, speaker_key(name))
+    timings["reply_cache_hit"] = reply is not None
+    if reply is None:
+        return None
+    logger.info(f"⚡ Reply cache hit → '{reply.text}'")
+    response = await build_message(reply.segments, timings, audio_format)
+    timings["total"] = time.time() - t0
+    observe_timings("http", endpoint, timings)
+    return response
+
+def remember_reply(message: str, name: str, text: str, segments: List[Segment], llm_info: dict) -> None:
+    if llm_info:  # empty on LLM errors
+        reply_cache.remember(message, speaker_key(name), text, segments)
 
 # --- LLM Chat Setup ---
 class ChatService:
     def __init__(self, chatbot: TessaChatbot):
         self.chatbot = chatbot
+        self._lock = threading.Lock()  # one llama.cpp context -> one caller at a time
 
-    def chat(self, message: str) -> str:
-        return self.chatbot.get_response(message)
+    def chat(self, message: str, on_token=None):
+        with self._lock:
+            return self.chatbot.respond(message, on_token)
 
 global_app = app
 
-@app.on_event("startup")
-def startup_event():
-    tessa = TessaChatbot()
-    global_app.state.chat_service = ChatService(tessa)
+# loads the GGUF once per process, on first use or in the startup warm-up
+model_registry.register("llm", lambda: ChatService(TessaChatbot()))
 
-def get_llm_response(user_message: str) -> str:
+@app.on_event("startup")
+async def startup_event():
+    # returns right away: models load in parallel while the server already
+    # answers; /ready says when they're done, early requests wait for them
+    model_registry.warm()
+    global_app.state.prebake = asyncio.create_task(reply_cache.prebake())
+
+@app.on_event("shutdown")
+def shutdown_event():
+    STAGES.shutdown()
+    tts_pool.shutdown()
+    lipsync_runner.shutdown()
+    audio_encoder.shutdown()
+
+def get_llm_response(user_message: str, on_token=None):
+    """(reply text, {"decode", "ttft", "tokens"}) from the chat service; on_token streams it."""
     try:
-        return global_app.state.chat_service.chat(user_message).strip()
+        text, info = model_registry.get("llm").chat(user_message, on_token)
+        return text.strip(), info
     except Exception as e:
         logger.error(f"❌ LLM Error: {e}")
-        return "[LLM Error]"
+        return "[LLM Error]", {}
+
+# --- Request Scoping ---
+# Requests keep their audio in memory (TTS pool -> bytes, Rhubarb reads a
+# private RAM scratch file), so concurrent users never share files.
+# At most MAX_CONCURRENT_REQUESTS pipelines run at once; the rest wait for a
+# slot. Individual blocking steps go through STAGES.
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", str(os.cpu_count() or 4)))
+REQUEST_SLOTS = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+REQUESTS_WAITING = 0  # waiting for a REQUEST_SLOTS slot
+REQUESTS_ACTIVE = 0
+
+@asynccontextmanager
+async def request_slot():
+    global REQUESTS_WAITING, REQUESTS_ACTIVE
+    REQUESTS_WAITING += 1
+    try:
+        await REQUEST_SLOTS.acquire()
+    finally:
+        REQUESTS_WAITING -= 1
+    REQUESTS_ACTIVE += 1
+    try:
+        yield
+    finally:
+        REQUESTS_ACTIVE -= 1
+        REQUEST_SLOTS.release()
+
+async def run_scoped(pipeline, *args) -> dict:
+    async with request_slot():
+        return await pipeline(*args)
+
+# --- Metrics ---
+def stage_gauge(field: str):
+    return lambda: {(name,): snap[field] for name, snap in STAGES.snapshot().items()}
+
+def chat_prompt_cache():
+    chat_service = model_registry.peek("llm")
+    return chat_service.chatbot.prompt_cache if chat_service else None
+
+gauge_func("tessa_stage_queued", "Jobs waiting for a stage worker.", stage_gauge("queued"), ["stage"])
+gauge_func("tessa_stage_running", "Jobs running in a stage.", stage_gauge("running"), ["stage"])
+gauge_func("tessa_requests_waiting", "Requests waiting for a pipeline slot.", lambda: REQUESTS_WAITING)
+gauge_func("tessa_requests_active", "Requests holding a pipeline slot.", lambda: REQUESTS_ACTIVE)
+register_common(speech_cache, tts_pool, lipsync_runner, chat_prompt_cache, reply_cache)
+
+async def message_entry(text: str, wav_bytes: bytes, lipsync: dict, audio_format: str) -> dict:
+    # lipsync was computed on the WAV; only what goes over the wire is compressed
+    if audio_format == "wav":
+        audio = wav_bytes
+    else:
+        audio, audio_format = await STAGES.io.run(audio_encoder.encode_or_wav, wav_bytes, audio_format)
+    return {
+        "text": text,
+        "audio": bytes_to_base64(audio),
+        "audioFormat": audio_format,
+        "lipsync": lipsync,
+        "facialExpression": "default",
+        "animation": "Talking_0"
+    }
 
-# --- Chat API ---
-@app.post("/chat")
-async def chat(input: MessageInput):
-    logger.info("📥 /chat request")
-    wav_path, json_path = AUDIO_DIR / "message.wav", AUDIO_DIR / "message.json"
+async def build_message(segments: List[Segment], timings: dict, audio_format: str) -> dict:
+    t0 = time.time()
+    messages = [await message_entry(text, wav_bytes, lipsync, audio_format) for text, wav_bytes, lipsync in segments]
+    timings["encode"] = time.time() - t0
+    return {
+        "messages": messages,
+        # per-stage seconds, read by bench/run_bench.py
+        "timings": timings,
+    }
+
+def llm_timings(timings: dict, elapsed: float, info: dict) -> None:
+    timings["llm"] = elapsed
+    tokens = info.get("tokens") or 0
+    timings["llm_tokens"] = tokens
+    timings["llm_tokens_per_s"] = tokens / info["decode"] if tokens and info.get("decode") else None
 
+async def run_chat_pipeline(message: str, name: str, audio_format: str) -> dict:
     t0 = time.time()
-    llm_text = get_llm_response(input.message)
+    timings = {"reply_cache_hit": False}  # hits are answered in chat() without a slot
+    llm_text, llm_info = await STAGES.llm.run(get_llm_response, message)
     # llm_text = re.sub(r'[^A-Za-z\s]', '', llm_text)
     # llm_text = re.sub(r'\s+', ' ', llm_text).strip()
     logger.info(llm_text)
     t1 = time.time(); logger.info(f"🧠 LLM: {t1 - t0:.2f}s")
+    llm_timings(timings, t1 - t0, llm_info)
 
     # Pass name from frontend
-    generate_audio_pyttsx3(llm_text, wav_path, input.name)
-    t2 = time.time(); logger.info(f"🔊 Audio: {t2 - t1:.2f}s")
+    wav_bytes, lipsync = await render_speech(llm_text, name, timings)
+    t2 = time.time(); logger.info(f"🔊 Audio + 🗣️ Lipsync: {t2 - t1:.2f}s")
+    remember_reply(message, name, llm_text, [(llm_text, wav_bytes, lipsync)], llm_info)
 
-    generate_lipsync(wav_path, json_path)
-    t3 = time.time(); logger.info(f"🗣️ Lipsync: {t3 - t2:.2f}s")
-
-    logger.info(f"✅ Total time: {t3 - t0:.2f}s")
-    return {
-        "messages": [{
-            "text": llm_text,
-            "audio": audio_to_base64(wav_path),
-            "lipsync": read_json(json_path),
-            "facialExpression": "default",
-            "animation": "Talking_0"
-        }]
-    }
-
-# --- Voice API ---
-@app.post("/voice")
-async def voice(file: UploadFile = File(...), name: str = Form(...)):
-    logger.info("📥 /voice request")
-    webm_path = AUDIO_DIR / "input.webm"
-    wav_input_path = AUDIO_DIR / "input.wav"
-    wav_output_path = AUDIO_DIR / "output.wav"
-    json_path = AUDIO_DIR / "output.json"
+    logger.info(f"✅ Total time: {t2 - t0:.2f}s")
+    response = await build_message([(llm_text, wav_bytes, lipsync)], timings, audio_format)
+    timings["total"] = time.time() - t0
+    observe_timings("http", "chat", timings)
+    return response
 
+async def run_voice_pipeline(upload: bytes, name: str, audio_format: str) -> dict:
     t0 = time.time()
-    
-    # 1️⃣ Save uploaded file
-    logger.info("💾 Saving uploaded voice file...")
-    with open(webm_path, "wb") as f:
-        f.write(await file.read())
-    
-    # 2️⃣ Convert to WAV
-    logger.info("🎼 Converting WebM → WAV (16kHz mono)...")
-    exec_command(f'ffmpeg -y -i "{webm_path}" -ar 16000 -ac 1 "{wav_input_path}"')
-
-    # 3️⃣ Transcribe speech
-    logger.info("📝 Starting speech recognition...")
-    wf = wave.open(str(wav_input_path), "rb")
-    rec = KaldiRecognizer(vosk_model, wf.getframerate())
-    while True:
-        data = wf.readframes(4000)
-        if not data:
-            break
-        rec.AcceptWaveform(data)
-    transcribed = json.loads(rec.FinalResult()).get("text", "").strip()
+    timings = {}
+
+    # 1️⃣-3️⃣ Decode WebM → 16kHz mono PCM and transcribe as it streams out of ffmpeg
+    logger.info(f"📝 Decoding + recognizing {len(upload)} bytes of uploaded audio...")
+    transcribed = await STAGES.stt.run(transcribe_upload, upload, timings)
     t1 = time.time()
+    timings["stt"] = t1 - t0
     logger.info(transcribed)
     logger.info(f"📝 Transcription complete in {t1 - t0:.2f}s → '{transcribed}'")
+    cached = await cached_reply(transcribed, name, timings, t0, "voice", audio_format)
+    if cached is not None:
+        return cached
 
     # 4️⃣ LLM response
     logger.info("🧠 Sending transcription to LLM...")
-    llm_text = get_llm_response(transcribed)
+    llm_text, llm_info = await STAGES.llm.run(get_llm_response, transcribed)
     t2 = time.time()
+    llm_timings(timings, t2 - t1, llm_info)
     logger.info(f"🧠 LLM complete in {t2 - t1:.2f}s → '{llm_text}'")
 
-    # 5️⃣ Generate TTS audio
-    logger.info("🔊 Generating voice output...")
-    generate_audio_pyttsx3(llm_text, wav_output_path, name)
+    # 5️⃣ Generate TTS audio + 6️⃣ lipsync data (cached)
+    logger.info("🔊 Generating voice output + lipsync...")
+    wav_bytes, lipsync = await render_speech(llm_text, name, timings)
     t3 = time.time()
-    logger.info(f"🔊 Audio generation complete in {t3 - t2:.2f}s")
-
-    # 6️⃣ Generate lipsync data
-    logger.info("🗣️ Creating lipsync data...")
-    generate_lipsync(wav_output_path, json_path)
-    t4 = time.time()
-    logger.info(f"🗣️ Lipsync complete in {t4 - t3:.2f}s")
+    logger.info(f"🔊 Audio + 🗣️ Lipsync complete in {t3 - t2:.2f}s")
+    remember_reply(transcribed, name, llm_text, [(llm_text, wav_bytes, lipsync)], llm_info)
 
     # ✅ Final timing
-    logger.info(f"✅ Total processing time: {t4 - t0:.2f}s")
+    logger.info(f"✅ Total processing time: {t3 - t0:.2f}s")
+    response = await build_message([(llm_text, wav_bytes, lipsync)], timings, audio_format)
+    timings["total"] = time.time() - t0
+    observe_timings("http", "voice", timings)
+    return response
+
+# --- Streaming Chat Pipeline ---
+# /chat/stream runs the /chat pipeline as events on one chunked response,
+# so neither the first token nor the first audio waits for the whole reply:
+#   {"type": "started"}                                   right away
+#   {"type": "token", "text"}                             as the LLM generates
+#   {"type": "message", "seq", "final", "text", "audio", "lipsync",
+#    "facialExpression", "animation", "timings"}          per chunk, once its TTS + lipsync are done
+#   {"type": "final", "seq"}                              when the last message went out without final
+#   {"type": "done", "text", "last_seq", "reply_cache_hit", "timings"}
+#   {"type": "error", "error"}
+# Text is chunked the same way as /ws/chat (chunker.py), and each message
+# has its own lipsync starting at 0.00, like the messages of /chat.
+async def stream_tts_stage(chunk: SpeechChunk, name: str) -> None:
+    cached = await STAGES.io.run(speech_cache.get, speech_key(chunk.text, name))
+    if cached is not None:
+        chunk.wav, chunk.lipsync = cached
+        return
+    chunk.wav, chunk.timings["tts_trimmed"] = await STAGES.tts.run(synthesize_trimmed, chunk.text, name)
+
+async def stream_lipsync_stage(chunk: SpeechChunk, name: str) -> None:
+    chunk.lipsync = await lipsync_for(chunk.wav, chunk.text)
+    await STAGES.io.run(speech_cache.put, speech_key(chunk.text, name), chunk.wav, chunk.lipsync)
+
+async def message_event(chunk: SpeechChunk, audio_format: str) -> dict:
+    t0 = time.time()
+    entry = await message_entry(chunk.text, chunk.wav, chunk.lipsync, audio_format)
+    chunk.timings["encode"] = time.time() - t0
+    return {"type": "message", "seq": chunk.seq, "final": chunk.final, "offset": round(chunk.offset, 3),
+            "duration": round(chunk.duration, 3), **entry, "timings": chunk.timings}
 
-    return {
-        "messages": [{
-            "text": llm_text,
-            "audio": audio_to_base64(wav_output_path),
-            "lipsync": read_json(json_path),
-            "facialExpression": "default",
-            "animation": "Talking_0"
-        }]
-    }
+async def stream_chat_events(message: str, name: str, audio_format: str):
+    t0 = time.time()
+    timings = {}
+    yield {"type": "started"}
+
+    reply = reply_cache.lookup(message, speaker_key(name))
+    timings["reply_cache_hit"] = reply is not None
+    if reply is not None:
+        logger.info(f"⚡ Reply cache hit → '{reply.text}'")
+        yield {"type": "token", "text": reply.text}
+        timeline = LipsyncTimeline()
+        for seq, (text, wav_bytes, lipsync) in enumerate(reply.segments):
+            chunk = SpeechChunk(text, wav_bytes, lipsync, seq=seq, final=seq == len(reply.segments) - 1)
+            timeline.add(chunk)
+            yield await message_event(chunk, audio_format)
+            timings.setdefault("ttfa", time.time() - t0)
+        timings["total"] = time.time() - t0
+        observe_timings("http", "chat_stream", timings)
+        yield {"type": "done", "text": reply.text, "last_seq": len(reply.segments) - 1, "reply_cache_hit": True, "timings": timings}
+        return
+
+    async with request_slot():
+        loop = asyncio.get_running_loop()
+        events: asyncio.Queue = asyncio.Queue()
+        chunker = make_chunker()
+        timeline = LipsyncTimeline()  # only for offset/duration; cues stay per message
+        emitted: List[Segment] = []
+        gone = False
+
+        async def emit(chunk: SpeechChunk):
+            timeline.add(chunk)
+            chunker.observe(chunk)
+            emitted.append((chunk.text, chunk.wav, chunk.lipsync))
+            events.put_nowait(await message_event(chunk, audio_format))
+            observe_timings("http", "chat_stream_chunk", chunk.timings)
+
+        async def end(seq: int):
+            events.put_nowait({"type": "final", "seq": seq})
+
+        pipeline = ChunkPipeline(
+            tts=lambda c: stream_tts_stage(c, name),
+            lipsync=lambda c: stream_lipsync_stage(c, name),
+            emit=emit,
+            end=end,
+        )
+
+        def feed(token: str):
+            # on the event loop, in generation order
+            if gone:
+                return
+            events.put_nowait({"type": "token", "text": token})
+            for text_chunk in chunker.feed(token):
+                pipeline.push(text_chunk)
+
+        async def produce():
+            try:
+                llm_text, llm_info = await STAGES.llm.run(
+                    get_llm_response, message, lambda token: loop.call_soon_threadsafe(feed, token))
+                t1 = time.time(); logger.info(f"🧠 LLM (streamed): {t1 - t0:.2f}s → '{llm_text}'")
+                llm_timings(timings, t1 - t0, llm_info)
+                timings["llm_ttft"] = llm_info.get("ttft")
+                if not llm_info:
+                    events.put_nowait({"type": "error", "error": "llm"})
+                residue = chunker.finish()
+                if residue:
+                    pipeline.push(residue)
+                await pipeline.close()
+                if pipeline.first_audio_at is not None:
+                    timings["ttfa"] = pipeline.first_audio_at - t0
+                timings["total"] = time.time() - t0
+                logger.info(f"✅ Streamed {pipeline.last_seq + 1} chunks, total time: {timings['total']:.2f}s")
+                if "".join(text for text, _, _ in emitted).strip() == llm_text:
+                    remember_reply(message, name, llm_text, emitted, llm_info)
+                observe_timings("http", "chat_stream", timings)
+                events.put_nowait({"type": "done", "text": llm_text, "last_seq": pipeline.last_seq,
+                                   "reply_cache_hit": False, "timings": timings})
+            except StageFull as e:
+                logger.warning(f"🚦 Rejecting /chat/stream: stage '{e.stage}' is full")
+                await pipeline.close()
+                events.put_nowait({"type": "error", "error": "busy", "stage": e.stage})
+            except asyncio.CancelledError:
+                # client gone: drop its queued chunks and kill the Rhubarb runs in progress
+                dropped = await pipeline.abort()
+                logger.info(f"🛑 /chat/stream client left, dropped {dropped['chunks']} chunks")
+                raise
+            finally:
+                events.put_nowait(None)
+
+        producer = asyncio.create_task(produce())
+        try:
+            while (event := await events.get()) is not None:
+                yield event
+        finally:
+            # client went away mid-reply: no more TTS work for it
+            gone = True
+            if not producer.done():
+                producer.cancel()
+
+def encode_event(event: dict, sse: bool) -> str:
+    data = json.dumps(event)
+    return f"event: {event['type']}\ndata: {data}\n\n" if sse else data + "\n"
+
+# --- Chat API ---
+@app.post("/chat")
+async def chat(input: MessageInput):
+    logger.info("📥 /chat request")
+    audio_format = audio_encoder.negotiate(input.audio_format)
+    cached = await cached_reply(input.message, input.name, {}, time.time(), "chat", audio_format)
+    if cached is not None:
+        return cached
+    return await run_scoped(run_chat_pipeline, input.message, input.name, audio_format)
+
+# --- Streaming Chat API ---
+# NDJSON by default; Server-Sent Events with `Accept: text/event-stream` or ?format=sse
+@app.post("/chat/stream")
+async def chat_stream(input: MessageInput, request: Request, format: str = "ndjson"):
+    logger.info("📥 /chat/stream request")
+    sse = format == "sse" or "text/event-stream" in request.headers.get("accept", "")
+
+    async def body():
+        async for event in stream_chat_events(input.message, input.name, audio_encoder.negotiate(input.audio_format)):
+            yield encode_event(event, sse)
+
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream" if sse else "application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},  # no proxy buffering
+    )
+
+# --- Voice API ---
+@app.post("/voice")
+async def voice(file: UploadFile = File(...), name: str = Form(...), audio_format: str = Form("wav")):
+    logger.info("📥 /voice request")
+    upload = await file.read()
+    return await run_scoped(run_voice_pipeline, upload, name, audio_encoder.negotiate(audio_format))
 
 @app.get("/")
 async def root():
-    return {"status": "✅ Optimized FastAPI with Vosk + Tessa is running"}
+    return {
+        "status": "✅ Optimized FastAPI with Vosk + Tessa is running",
+        "max_concurrent_requests": MAX_CONCURRENT_REQUESTS,
+    }
+
+@app.get("/stages")
+async def stage_status():
+    return STAGES.snapshot()
+
+@app.get("/ready")
+async def ready():
+    ok = model_registry.ready()
+    return JSONResponse(status_code=200 if ok else 503, content={"ready": ok, "models": model_registry.status()})
+
+@app.get("/stats")
+async def stats():
+    prompt_cache = chat_prompt_cache()
+    return {
+        "prompt_cache": prompt_cache.stats() if prompt_cache else None,
+        "speech_cache": speech_cache.stats(),
+        "reply_cache": reply_cache.stats(),
+        "lipsync": lipsync_stats(),
+        "audio_encoder": audio_encoder.stats(),
+        "fake_engines": fake_engines(),
+    }
+
+@app.get("/metrics")
+async def metrics():
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
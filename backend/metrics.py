@@ -0,0 +1,241 @@
+# metrics.py
+# Minimal Prometheus metrics (text exposition format 0.0.4), no dependencies
+# -------------------------------------------------------
+# Hot path: Histogram.observe / Counter.inc are a dict lookup, a bisect and
+# an add under a per-metric lock.
+# Everything that already exists as state somewhere (queue depths, sessions,
+# cache hit rates) is a GaugeFunc/CounterFunc read only when /metrics is
+# scraped, so it costs nothing between scrapes.
+# -------------------------------------------------------
+
+import math
+import bisect
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+LabelValues = Tuple[str, ...]
+Samples = Union[float, int, None, Dict[LabelValues, float]]
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 250)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _num(v: float) -> str:
+    if v == math.inf:
+        return "+Inf"
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return repr(v)
+
+
+class _Metric(ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        """Exposition lines for this metric's values."""
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, k)} {_num(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[LabelValues, List[float]] = {}  # per-bucket counts (+Inf last), then sum
+
+    def observe(self, value: Optional[float], **labels) -> None:
+        if value is None:
+            return
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0.0] * (len(self.buckets) + 2)
+            series[i] += 1
+            series[-1] += value
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        lines = []
+        for key, series in items:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (math.inf,), series[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, ('le', _num(float(bound))))} {_num(cumulative)}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_num(series[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {_num(cumulative)}")
+        return lines
+
+
+class GaugeFunc(_Metric):
+    """Value(s) computed at scrape time: fn() -> number, or {label values tuple: number}."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Callable[[], Samples], labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+
+    def _samples(self) -> List[str]:
+        value = self.fn()
+        if value is None:
+            return []
+        if not isinstance(value, dict):
+            return [f"{self.name} {_num(float(value))}"]
+        return [f"{self.name}{_labels(self.labelnames, k)} {_num(float(v))}"
+                for k, v in sorted(value.items()) if v is not None]
+
+
+class CounterFunc(GaugeFunc):
+    """A monotonically increasing value someone else already counts (e.g. a stats() field)."""
+
+    kind = "counter"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            # re-registering a name replaces it, so a reloaded module doesn't duplicate series
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:  # a broken gauge callback must not take /metrics down
+                lines.append(f"# {metric.name} unavailable: {_escape(str(e))}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def counter(name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, help, labelnames))
+
+
+def histogram(name: str, help: str, labelnames: Sequence[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, help, labelnames, buckets))
+
+
+def gauge_func(name: str, help: str, fn: Callable[[], Samples], labelnames: Sequence[str] = ()) -> GaugeFunc:
+    return REGISTRY.register(GaugeFunc(name, help, fn, labelnames))
+
+
+def counter_func(name: str, help: str, fn: Callable[[], Samples], labelnames: Sequence[str] = ()) -> CounterFunc:
+    return REGISTRY.register(CounterFunc(name, help, fn, labelnames))
+
+
+# ---------- metrics shared by both servers ----------
+STAGE_SECONDS = histogram("tessa_stage_seconds", "Latency of one pipeline stage.", ["server", "stage"])
+REQUEST_SECONDS = histogram("tessa_request_seconds", "End-to-end latency of a request or turn.", ["server", "endpoint"])
+LLM_TTFT_SECONDS = histogram("tessa_llm_ttft_seconds", "LLM time to first token.", ["server"])
+LLM_TOKENS_PER_SECOND = histogram("tessa_llm_tokens_per_second", "LLM decode speed per request.", ["server"], RATE_BUCKETS)
+LLM_TOKENS = counter("tessa_llm_tokens_total", "Tokens generated by the LLM.", ["server"])
+TTFA_SECONDS = histogram("tessa_ttfa_seconds", "Time from user input to the first audio sent.", ["server"])
+SUBPROCESS_FAILURES = counter("tessa_subprocess_failures_total", "Failed helper processes.", ["tool", "reason"])
+
+# keys of the per-request "timings" dicts -> stage label
+TIMING_STAGES = ("stt", "llm_queue_wait", "llm", "tts", "lipsync", "encode")
+
+
+def observe_timings(server: str, endpoint: str, timings: Dict[str, Any]) -> None:
+    """Feed a per-request/turn timings dict (see main.py / main-ws.py) into the histograms."""
+    for stage in TIMING_STAGES:
+        value = timings.get(stage)
+        if isinstance(value, (int, float)):
+            STAGE_SECONDS.observe(value, server=server, stage=stage)
+    if isinstance(timings.get("total"), (int, float)):
+        REQUEST_SECONDS.observe(timings["total"], server=server, endpoint=endpoint)
+    LLM_TTFT_SECONDS.observe(timings.get("llm_ttft"), server=server)
+    LLM_TOKENS_PER_SECOND.observe(timings.get("llm_tokens_per_s"), server=server)
+    if timings.get("llm_tokens"):
+        LLM_TOKENS.inc(timings["llm_tokens"], server=server)
+    TTFA_SECONDS.observe(timings.get("ttfa"), server=server)
+
+
+def register_common(speech_cache, tts_pool, lipsync_runner, prompt_cache: Callable[[], Any] = lambda: None,
+                    reply_cache=None) -> None:
+    """Scrape-time gauges for the components both servers share."""
+
+    def cache_hit_ratio():
+        out = {("speech",): speech_cache.stats()["hit_rate"]}
+        pc = prompt_cache()
+        if pc is not None:
+            out[("prompt",)] = pc.stats()["hit_rate"]
+        if reply_cache is not None:
+            out[("reply",)] = reply_cache.stats()["hit_rate"]
+        return out
+
+    def cache_lookups():
+        s = speech_cache.stats()
+        out = {("speech", "hit_mem"): s["hits_mem"], ("speech", "hit_disk"): s["hits_disk"], ("speech", "miss"): s["misses"]}
+        pc = prompt_cache()
+        if pc is not None:
+            p = pc.stats()
+            out.update({("prompt", "hit_session"): p["session_hits"], ("prompt", "hit_system"): p["system_hits"], ("prompt", "miss"): p["misses"]})
+        if reply_cache is not None:
+            r = reply_cache.stats()
+            out.update({("reply", "hit"): r["hits"], ("reply", "miss"): r["misses"]})
+        return out
+
+    gauge_func("tessa_cache_hit_ratio", "Hit ratio since start.", cache_hit_ratio, ["cache"])
+    counter_func("tessa_cache_lookups_total", "Cache lookups by result.", cache_lookups, ["cache", "result"])
+    gauge_func("tessa_tts_queue_depth", "Texts waiting for a TTS worker.",
+               lambda: {(k,): v for k, v in tts_pool.queue_depths().items()}, ["speaker"])
+    gauge_func("tessa_lipsync_jobs", "Lipsync jobs by state.",
+               lambda: {(k,): lipsync_runner.stats()[k] for k in ("queued", "running")}, ["state"])
@@ -0,0 +1,126 @@
+# models.py
+# Process-wide model registry: every model loads once, lazily or in a
+# background warm-up, never at import time
+# -------------------------------------------------------
+# A module registers a loader under a name (stt.py -> "vosk", tts_pool.py ->
+# "tts", lipsync.py -> "lipsync", each server -> "llm"). Nothing runs until:
+#
+#   model_registry.warm()      startup: one thread per model, all in parallel,
+#                              so the server binds and answers /ready at once
+#   model_registry.get(name)   first use: loads on the caller's thread, or
+#                              waits for the warm-up that is already running
+#
+# A failed load is remembered (status "failed" + error) and retried by the
+# next get(), not by warm().
+# -------------------------------------------------------
+
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterable, Optional
+
+log = logging.getLogger("models")
+
+PENDING, LOADING, READY, FAILED = "pending", "loading", "ready", "failed"
+
+
+class ModelNotReady(RuntimeError):
+    pass
+
+
+class _Entry:
+    def __init__(self, name: str, loader: Callable[[], Any]):
+        self.name = name
+        self.loader = loader
+        self.state = PENDING
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+        self.seconds: Optional[float] = None
+        self.done = threading.Event()
+
+
+class ModelRegistry:
+    def __init__(self):
+        self._entries: Dict[str, _Entry] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, loader: Callable[[], Any]) -> None:
+        """Add a loader; re-registering a name that hasn't started loading replaces it."""
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and entry.state != PENDING:
+                return
+            self._entries[name] = _Entry(name, loader)
+
+    def get(self, name: str, timeout: Optional[float] = None) -> Any:
+        """The loaded model; loads it here if nobody has started yet."""
+        entry = self._entry(name)
+        if self._claim(entry, retry=True):
+            self._load(entry)
+        if not entry.done.wait(timeout):
+            raise ModelNotReady(f"{name} is still loading")
+        if entry.state != READY:
+            raise ModelNotReady(f"{name} failed to load: {entry.error}") from entry.error
+        return entry.value
+
+    def peek(self, name: str) -> Any:
+        """The model if it is loaded, else None. Never blocks or starts a load."""
+        entry = self._entries.get(name)
+        return entry.value if entry is not None and entry.state == READY else None
+
+    def warm(self, names: Optional[Iterable[str]] = None) -> None:
+        """Start loading every pending model (or `names`) on its own thread."""
+        for name in list(names if names is not None else self._entries):
+            entry = self._entry(name)
+            if self._claim(entry, retry=False):
+                threading.Thread(target=self._load, args=(entry,), name=f"warm-{name}", daemon=True).start()
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            entries = list(self._entries.values())
+        return {
+            e.name: {
+                "state": e.state,
+                "seconds": round(e.seconds, 3) if e.seconds is not None else None,
+                "error": str(e.error) if e.error is not None else None,
+            }
+            for e in entries
+        }
+
+    def ready(self) -> bool:
+        with self._lock:
+            return all(e.state == READY for e in self._entries.values())
+
+    # ---------- internals ----------
+    def _entry(self, name: str) -> _Entry:
+        try:
+            return self._entries[name]
+        except KeyError:
+            raise KeyError(f"no model registered as {name!r}") from None
+
+    def _claim(self, entry: _Entry, retry: bool) -> bool:
+        with self._lock:
+            if entry.state == PENDING or (retry and entry.state == FAILED):
+                entry.state = LOADING
+                entry.error = None
+                entry.done.clear()
+                return True
+            return False
+
+    def _load(self, entry: _Entry) -> None:
+        t0 = time.time()
+        log.info("Loading %s…", entry.name)
+        try:
+            value = entry.loader()
+        except Exception as e:
+            entry.error, entry.state = e, FAILED
+            log.error("%s failed to load after %.2fs: %s", entry.name, time.time() - t0, e)
+        else:
+            entry.value, entry.state = value, READY
+            log.info("%s ready in %.2fs", entry.name, time.time() - t0)
+        finally:
+            entry.seconds = time.time() - t0
+            entry.done.set()
+
+
+model_registry = ModelRegistry()
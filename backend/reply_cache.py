@@ -0,0 +1,214 @@
+# reply_cache.py
+# Complete rendered replies (text + WAV + mouthCues) for frequent small talk
+# -------------------------------------------------------
+# Most traffic is "hi" / "hello" / "how are you". A hit here skips the LLM,
+# TTS and lipsync entirely and is served straight from memory.
+#
+#   key      (speaker, intent) where the intent comes from smalltalk.json
+#            ("hi", "hey there" -> greeting); any other input is a miss
+#   value    up to REPLY_CACHE_VARIANTS replies, handed out round-robin
+#
+# smalltalk.json intents are pre-baked at startup (top REPLY_CACHE_TOP_N, in
+# file order) through the server's own render function, so their audio also
+# lands in the speech cache and a restart re-bakes from disk.
+# The remaining intents are learned from live LLM replies, but only from
+# turns without history and only served to sessions without history: a
+# reply given mid-conversation may depend on it, and must never reach
+# another user. A learned key is only served once it holds all its
+# variants, so users don't hear the same line on repeat.
+#
+# REPLY_CACHE=0 turns it off (e.g. to benchmark the full pipeline).
+# -------------------------------------------------------
+
+import os
+import re
+import json
+import time
+import asyncio
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from models import ModelNotReady, model_registry
+
+log = logging.getLogger("reply_cache")
+
+SMALLTALK_FILE = Path(os.getenv("SMALLTALK_FILE", "smalltalk.json"))
+REPLY_CACHE_ENABLED = os.getenv("REPLY_CACHE", "1") != "0"
+REPLY_CACHE_TOP_N = int(os.getenv("REPLY_CACHE_TOP_N", "8"))           # intents pre-baked at startup
+REPLY_CACHE_VARIANTS = int(os.getenv("REPLY_CACHE_VARIANTS", "3"))     # replies kept per key
+REPLY_CACHE_MAX_KEYS = int(os.getenv("REPLY_CACHE_MAX_KEYS", "256"))   # learned (speaker, intent) keys, LRU
+REPLY_CACHE_SPEAKERS = [s.strip() for s in os.getenv("REPLY_CACHE_SPEAKERS", "tessa").split(",") if s.strip()]
+
+# words that don't change what the user said ("hi tessa" == "hi")
+FILLER_WORDS = {"tessa", "hardin", "please", "so", "oh", "um", "uh"}
+
+Segment = Tuple[str, bytes, Dict[str, Any]]  # (text, wav_bytes, lipsync) of one audio chunk
+Render = Callable[[str, str], Awaitable[Tuple[bytes, Dict[str, Any]]]]  # (text, speaker) -> (wav, lipsync)
+
+
+def normalize_input(text: str) -> str:
+    """Lowercase, drop punctuation/apostrophes and filler words: "Hi, Tessa!!" -> "hi"."""
+    text = unicodedata.normalize("NFKC", text or "").lower().replace("'", "").replace("’", "")
+    words = [w for w in re.findall(r"[a-z0-9]+", text) if w not in FILLER_WORDS]
+    return " ".join(words)
+
+
+@dataclass
+class Reply:
+    text: str
+    segments: List[Segment]  # one per audio chunk, in playback order
+
+    @property
+    def wav(self) -> bytes:
+        return self.segments[0][1]
+
+    @property
+    def lipsync(self) -> Dict[str, Any]:
+        return self.segments[0][2]
+
+
+class _Variants:
+    def __init__(self, prebaked: bool):
+        self.replies: List[Reply] = []
+        self.next = 0
+        self.prebaked = prebaked
+
+
+def load_intents(path: Path = SMALLTALK_FILE) -> List[Dict[str, Any]]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)["intents"]
+    except (OSError, ValueError, KeyError) as e:
+        log.warning("No small-talk intents from %s: %s", path, e)
+        return []
+
+
+class ReplyCache:
+    """
+    One per server: `render` is that server's text -> (wav, lipsync) path, so
+    cached audio has exactly the format the server would have sent anyway.
+    """
+
+    def __init__(self, render: Render, intents: Optional[List[Dict[str, Any]]] = None,
+                 variants: int = REPLY_CACHE_VARIANTS, max_keys: int = REPLY_CACHE_MAX_KEYS,
+                 enabled: bool = REPLY_CACHE_ENABLED):
+        self.render = render
+        self.intents = load_intents() if intents is None else intents
+        self.variants = variants
+        self.max_keys = max_keys
+        self.enabled = enabled
+        self._aliases: Dict[str, str] = {}
+        for intent in self.intents:
+            for phrase in intent.get("inputs", []):
+                self._aliases.setdefault(normalize_input(phrase), "@" + intent["name"])
+        self._entries: "OrderedDict[Tuple[str, str], _Variants]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.learned = 0
+        self.prebaked = 0
+        self.prebake_s = 0.0
+
+    def key(self, user_text: str, speaker: str) -> Optional[Tuple[str, str]]:
+        """(speaker, intent) for a smalltalk.json input or alias, else None."""
+        intent = self._aliases.get(normalize_input(user_text))
+        return (speaker, intent) if intent else None
+
+    # ---------- public API ----------
+    def lookup(self, user_text: str, speaker: str, has_history: bool = False) -> Optional[Reply]:
+        """
+        Next variant for this input, or None (then remember() the real reply).
+        Learned replies are only handed to sessions without history.
+        """
+        if not self.enabled:
+            return None
+        key = self.key(user_text, speaker)
+        with self._lock:
+            entry = self._entries.get(key) if key else None
+            if entry is not None and not entry.prebaked and (has_history or len(entry.replies) < self.variants):
+                entry = None
+            if entry is None or not entry.replies:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            reply = entry.replies[entry.next % len(entry.replies)]
+            entry.next += 1
+            self.hits += 1
+            return reply
+
+    def remember(self, user_text: str, speaker: str, text: str, segments: List[Segment],
+                 has_history: bool = False) -> None:
+        """Keep a freshly rendered LLM reply as a variant for this input (first turns only)."""
+        if not self.enabled or has_history or not text or not segments or any(not wav for _, wav, _ in segments):
+            return
+        key = self.key(user_text, speaker)
+        if key is None:
+            return
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Variants(prebaked=False)
+            if entry.prebaked or len(entry.replies) >= self.variants or any(r.text == text for r in entry.replies):
+                return
+            entry.replies.append(Reply(text, segments))
+            self._entries.move_to_end(key)
+            self.learned += 1
+            self._evict()
+
+    async def prebake(self, speakers: Iterable[str] = REPLY_CACHE_SPEAKERS, top_n: int = REPLY_CACHE_TOP_N,
+                      requires: Iterable[str] = ("tts", "lipsync")) -> None:
+        """Render the top-N intents' replies for each speaker (run as a startup task)."""
+        if not self.enabled:
+            return
+        try:
+            for name in requires:
+                await asyncio.to_thread(model_registry.get, name)
+        except ModelNotReady as e:
+            log.warning("Skipping small-talk pre-bake: %s", e)
+            return
+        t0 = time.time()
+        for speaker in speakers:
+            for intent in self.intents[:top_n]:
+                replies: List[Reply] = []
+                for text in intent.get("replies", [])[: self.variants]:
+                    try:
+                        wav, lipsync = await self.render(text, speaker)
+                    except Exception as e:
+                        log.warning("Pre-baking %r for %s failed: %s", text[:40], speaker, e)
+                        continue
+                    if wav:
+                        replies.append(Reply(text, [(text, wav, lipsync)]))
+                if not replies:
+                    continue
+                entry = _Variants(prebaked=True)
+                entry.replies = replies
+                with self._lock:
+                    self._entries[(speaker, "@" + intent["name"])] = entry
+                    self.prebaked += len(replies)
+        self.prebake_s = time.time() - t0
+        log.info("Pre-baked %d small-talk replies in %.2fs", self.prebaked, self.prebake_s)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "keys": len(self._entries),
+                "prebaked": self.prebaked,
+                "prebake_s": round(self.prebake_s, 3),
+                "learned": self.learned,
+            }
+
+    # ---------- internals ----------
+    def _evict(self) -> None:
+        learned = [k for k, e in self._entries.items() if not e.prebaked]
+        for key in learned[: max(0, len(learned) - self.max_keys)]:
+            del self._entries[key]
@@ -0,0 +1,205 @@
+# sessions.py
+# Bounded per-session state for /ws/chat
+# -------------------------------------------------------
+# Each session keeps its conversation history, its cancel flag and current
+# turn (and the connection it talks to). build_prompt renders the whole
+# history, so it is only ever appended to: each prompt then extends the
+# llama.cpp state the previous turn saved. Past SESSION_HISTORY_TURNS
+# exchanges or SESSION_HISTORY_CHARS characters (what fits CTX_LEN next to
+# the system prompt and a reply) it is cut back to its newer half in one go,
+# which costs one full prompt evaluation instead of one every turn.
+#
+#   idle TTL     sessions untouched for SESSION_TTL_S are dropped by sweep()
+#   LRU cap      beyond SESSION_MAX the least recently used idle session goes
+#   snapshot     SESSION_SNAPSHOT=<path> saves histories on shutdown (and every
+#                sweep) and restores them at startup, so a restart doesn't make
+#                Tessa forget mid-conversation
+#
+# Sessions with a turn in flight are never evicted. on_evict callbacks let
+# the LLM side drop per-session state (prompt cache snapshots, worker affinity).
+# -------------------------------------------------------
+
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from metrics import counter, gauge_func
+
+log = logging.getLogger("sessions")
+
+SESSION_HISTORY_TURNS = int(os.getenv("SESSION_HISTORY_TURNS", "4"))   # user+assistant pairs kept
+SESSION_HISTORY_CHARS = int(os.getenv("SESSION_HISTORY_CHARS", "2400"))  # ~600 tokens of a 1024-token context
+SESSION_TTL_S = float(os.getenv("SESSION_TTL_S", "1800"))
+SESSION_MAX = int(os.getenv("SESSION_MAX", "1000"))
+SESSION_SWEEP_S = float(os.getenv("SESSION_SWEEP_S", "60"))
+SESSION_SNAPSHOT = os.getenv("SESSION_SNAPSHOT", "")
+
+SESSION_EVICTIONS = counter("tessa_session_evictions_total", "Sessions dropped.", ["reason"])
+
+
+@dataclass
+class Session:
+    session_id: str
+    history: List[Dict[str, str]] = field(default_factory=list)
+    cancel: asyncio.Event = field(default_factory=asyncio.Event)
+    turn: Optional[asyncio.Task] = None
+    owner: Any = None  # the connection `turn` talks to
+    last_active: float = field(default_factory=time.time)
+
+    @property
+    def busy(self) -> bool:
+        return self.turn is not None and not self.turn.done()
+
+    def history_chars(self) -> int:
+        return sum(len(t["content"]) for t in self.history)
+
+    def remember(self, user_text: str, reply: str) -> None:
+        """Append one exchange; trim only once the history outgrows its caps."""
+        self.history += [{"role": "user", "content": user_text}, {"role": "assistant", "content": reply}]
+        self._trim()
+
+    def _trim(self) -> None:
+        if len(self.history) <= 2 * SESSION_HISTORY_TURNS and self.history_chars() <= SESSION_HISTORY_CHARS:
+            return
+        # the newer half, so the prompt stays append-only for a while again
+        del self.history[: len(self.history) - 2 * max(1, SESSION_HISTORY_TURNS // 2)]
+        while len(self.history) > 2 and self.history_chars() > SESSION_HISTORY_CHARS // 2:
+            del self.history[:2]
+
+
+class SessionManager:
+    """Used from the event loop only, so no locking."""
+
+    def __init__(self, ttl_s: float = SESSION_TTL_S, max_sessions: int = SESSION_MAX,
+                 snapshot_path: Optional[str] = SESSION_SNAPSHOT or None):
+        self.ttl_s = ttl_s
+        self.max_sessions = max_sessions
+        self.snapshot_path = Path(snapshot_path) if snapshot_path else None
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._on_evict: List[Callable[[str], Any]] = []
+        self._sweeper: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def on_evict(self, fn: Callable[[str], Any]) -> None:
+        self._on_evict.append(fn)
+
+    # ---------- public API ----------
+    def get(self, session_id: str) -> Optional[Session]:
+        sess = self._sessions.get(session_id)
+        if sess is not None:
+            self._touch(sess)
+        return sess
+
+    def get_or_create(self, session_id: str) -> Session:
+        sess = self.get(session_id)
+        if sess is None:
+            sess = self._sessions[session_id] = Session(session_id)
+            self._enforce_cap(keep=session_id)
+        return sess
+
+    def sweep(self) -> int:
+        """Drop idle sessions past their TTL; returns how many went."""
+        cutoff = time.time() - self.ttl_s
+        expired = [sid for sid, s in self._sessions.items() if s.last_active < cutoff and not s.busy]
+        for sid in expired:
+            self._evict(sid, "ttl")
+        return len(expired)
+
+    def start(self) -> None:
+        """Restore the snapshot and start the periodic sweep (call from the event loop)."""
+        self.restore()
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    def shutdown(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+        self.snapshot()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self._sessions),
+            "busy": sum(1 for s in self._sessions.values() if s.busy),
+            "history_chars": sum(s.history_chars() for s in self._sessions.values()),
+            "max_sessions": self.max_sessions,
+            "ttl_s": self.ttl_s,
+        }
+
+    # ---------- snapshot / restore ----------
+    def snapshot(self) -> None:
+        if self.snapshot_path is None:
+            return
+        data = {sid: {"history": list(s.history), "last_active": s.last_active} for sid, s in self._sessions.items()}
+        tmp = self.snapshot_path.with_suffix(self.snapshot_path.suffix + ".tmp")
+        try:
+            self.snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp.write_text(json.dumps(data), encoding="utf-8")
+            os.replace(tmp, self.snapshot_path)
+        except OSError as e:
+            log.warning("Session snapshot to %s failed: %s", self.snapshot_path, e)
+
+    def restore(self) -> None:
+        if self.snapshot_path is None or not self.snapshot_path.exists():
+            return
+        try:
+            data = json.loads(self.snapshot_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            log.warning("Ignoring session snapshot %s: %s", self.snapshot_path, e)
+            return
+        cutoff = time.time() - self.ttl_s
+        # oldest first, so the OrderedDict ends up in LRU order
+        for sid, saved in sorted(data.items(), key=lambda kv: kv[1].get("last_active", 0)):
+            if saved.get("last_active", 0) < cutoff or sid in self._sessions:
+                continue
+            sess = Session(sid, last_active=saved["last_active"])
+            sess.history.extend(saved.get("history", []))
+            sess._trim()
+            self._sessions[sid] = sess
+        self._enforce_cap()
+        log.info("Restored %d sessions from %s", len(self._sessions), self.snapshot_path)
+
+    # ---------- internals ----------
+    def _touch(self, sess: Session) -> None:
+        sess.last_active = time.time()
+        self._sessions.move_to_end(sess.session_id)
+
+    def _enforce_cap(self, keep: Optional[str] = None) -> None:
+        if len(self._sessions) <= self.max_sessions:
+            return
+        idle = [sid for sid, s in self._sessions.items() if not s.busy and sid != keep]
+        for sid in idle[: len(self._sessions) - self.max_sessions]:
+            self._evict(sid, "lru")
+
+    def _evict(self, session_id: str, reason: str) -> None:
+        sess = self._sessions.pop(session_id, None)
+        if sess is None:
+            return
+        sess.cancel.set()
+        SESSION_EVICTIONS.inc(reason=reason)
+        for fn in self._on_evict:
+            try:
+                fn(session_id)
+            except Exception as e:
+                log.warning("on_evict for %s failed: %s", session_id, e)
+
+    async def _sweep_loop(self) -> None:
+        while True:
+            await asyncio.sleep(SESSION_SWEEP_S)
+            dropped = self.sweep()
+            if dropped:
+                log.info("Dropped %d idle sessions", dropped)
+            self.snapshot()
+
+
+def register_metrics(sessions: SessionManager) -> None:
+    gauge_func("tessa_sessions", "Sessions held in memory.", lambda: len(sessions))
+    gauge_func("tessa_session_history_chars", "Characters of conversation history held in memory.",
+               lambda: sessions.stats()["history_chars"])
@@ -0,0 +1,239 @@
+# speech_pipeline.py
+# Ordered, pipelined TTS -> lipsync stage for one streamed turn
+# -------------------------------------------------------
+#   push(text) ──> [tts task] ──> [lipsync task] ──> emit(chunk)
+#
+# Two tasks connected by FIFO queues: TTS of chunk n+1 runs while Rhubarb
+# works on chunk n, and chunks are emitted strictly in push order with a
+# contiguous `seq`. close() waits until everything pushed has been emitted,
+# so the caller can send `done` after the last audio. abort() is the other
+# way out (barge-in): queued chunks are dropped and stage work in progress is
+# cancelled, which kills its Rhubarb/ffmpeg process.
+#
+# The last chunk is flagged `final` when nothing can follow it by the time it
+# goes out. Otherwise (TTS of a later chunk was still running, or that chunk
+# failed) end(last_seq) follows once TTS is done, so every turn that made
+# audio ends with exactly one of the two.
+#
+# LipsyncTimeline turns the per-chunk Rhubarb cues (each starting at 0.00)
+# into one turn-wide timeline, advancing a clock by each WAV's real length.
+# -------------------------------------------------------
+
+import io
+import time
+import wave
+import asyncio
+import logging
+import traceback
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+log = logging.getLogger("speech_pipeline")
+
+
+@dataclass
+class SpeechChunk:
+    text: str
+    wav: bytes = b""
+    lipsync: Optional[Dict[str, Any]] = None
+    seq: int = -1
+    final: bool = False
+    offset: float = 0.0    # start of this chunk's audio within the turn, seconds
+    duration: float = 0.0  # length of this chunk's audio, seconds
+    timings: Dict[str, float] = field(default_factory=dict)
+
+
+Stage = Callable[[SpeechChunk], Awaitable[None]]
+End = Callable[[int], Awaitable[None]]
+
+
+class ChunkPipeline:
+    """
+    tts(chunk) must fill chunk.wav (leave it empty to drop the chunk) and may
+    fill chunk.lipsync (e.g. from a cache) to skip the lipsync stage.
+    lipsync(chunk) must fill chunk.lipsync. emit(chunk) sends it.
+
+    The last emitted chunk gets `final` if nothing else can follow it by then;
+    if not, end(seq) is awaited with its seq once the stream is over (never
+    after abort(), nor for a turn without chunks). `last_seq` is always valid
+    after close().
+    """
+
+    def __init__(self, tts: Stage, lipsync: Stage, emit: Stage, end: Optional[End] = None):
+        self._tts = tts
+        self._lipsync = lipsync
+        self._emit = emit
+        self._end = end
+        self._final_sent = False
+        self._tts_q: "asyncio.Queue[Optional[SpeechChunk]]" = asyncio.Queue()
+        self._lips_q: "asyncio.Queue[Optional[SpeechChunk]]" = asyncio.Queue()
+        self._tts_done = False
+        self._next_seq = 0
+        self._in_tts: Optional[SpeechChunk] = None
+        self._in_lipsync: Optional[SpeechChunk] = None  # lipsync or emit
+        self._send_idle = asyncio.Event()
+        self._send_idle.set()
+        self.aborted = False
+        self.started_at = time.time()
+        self.first_audio_at: Optional[float] = None
+        self._tasks = [
+            asyncio.create_task(self._tts_loop()),
+            asyncio.create_task(self._lipsync_loop()),
+        ]
+
+    @property
+    def last_seq(self) -> int:
+        return self._next_seq - 1
+
+    def push(self, text: str) -> None:
+        if text.strip() and not self.aborted:
+            self._tts_q.put_nowait(SpeechChunk(text))
+
+    async def close(self) -> None:
+        """No more chunks; wait until every pushed chunk has been emitted."""
+        self._tts_q.put_nowait(None)
+        # not gather(): a caller being cancelled must go through abort(), not cut a send in half
+        await asyncio.wait(self._tasks)
+        for task in self._tasks:
+            task.result()
+
+    @contextmanager
+    def sending(self):
+        """For emit(): frames sent inside this block go out together, even if abort() comes meanwhile."""
+        self._send_idle.clear()
+        try:
+            yield
+        finally:
+            self._send_idle.set()
+
+    async def abort(self) -> Dict[str, int]:
+        """
+        Drop every chunk not emitted yet and cancel the stage work in progress.
+        Returns what was thrown away: chunks in total, and how many of them
+        were in TTS / lipsync / emit (e.g. encoding) at the time.
+        """
+        self.aborted = True
+        await self._send_idle.wait()
+        queued = 0
+        for q in (self._tts_q, self._lips_q):
+            while not q.empty():
+                queued += q.get_nowait() is not None
+        in_lipsync = self._in_lipsync is not None
+        dropped = {
+            "tts": 1 if self._in_tts is not None else 0,
+            "lipsync": 1 if in_lipsync and self._in_lipsync.lipsync is None else 0,
+            "emit": 1 if in_lipsync and self._in_lipsync.lipsync is not None else 0,
+        }
+        dropped["chunks"] = queued + sum(dropped.values())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        return dropped
+
+    async def _tts_loop(self) -> None:
+        while True:
+            chunk = await self._tts_q.get()
+            if chunk is None:
+                break
+            t0 = time.time()
+            self._in_tts = chunk
+            try:
+                await self._tts(chunk)
+            except Exception:
+                log.error("TTS error for chunk %r:\n%s", chunk.text[:40], traceback.format_exc())
+                continue
+            finally:
+                self._in_tts = None
+            chunk.timings["tts"] = time.time() - t0
+            if chunk.wav:
+                self._lips_q.put_nowait(chunk)
+        self._tts_done = True
+        self._lips_q.put_nowait(None)
+
+    async def _lipsync_loop(self) -> None:
+        while True:
+            chunk = await self._lips_q.get()
+            if chunk is None:
+                break
+            self._in_lipsync = chunk
+            try:
+                await self._finish_chunk(chunk)
+            finally:
+                self._in_lipsync = None
+        if self._next_seq and not self._final_sent and self._end is not None:
+            try:
+                await self._end(self.last_seq)
+            except Exception:
+                log.error("End marker error after chunk %d:\n%s", self.last_seq, traceback.format_exc())
+
+    async def _finish_chunk(self, chunk: SpeechChunk) -> None:
+        if chunk.lipsync is None:
+            t0 = time.time()
+            try:
+                await self._lipsync(chunk)
+            except Exception:
+                log.error("Lipsync error for chunk %r:\n%s", chunk.text[:40], traceback.format_exc())
+                return
+            chunk.timings["lipsync"] = time.time() - t0
+        chunk.seq = self._next_seq
+        self._next_seq += 1
+        # only the end-of-stream marker left behind us -> this is the last chunk
+        chunk.final = self._final_sent = self._tts_done and self._lips_q.qsize() == 1
+        if self.first_audio_at is None:
+            self.first_audio_at = time.time()
+        try:
+            await self._emit(chunk)
+        except Exception:
+            log.error("Emit error for chunk %d:\n%s", chunk.seq, traceback.format_exc())
+
+
+def wav_duration(wav_bytes: bytes) -> float:
+    with wave.open(io.BytesIO(wav_bytes), "rb") as wf:
+        return wf.getnframes() / float(wf.getframerate())
+
+
+class LipsyncTimeline:
+    """
+    Running mouth-cue timeline for one turn. add() chunks in seq order; each
+    call returns that chunk's cues shifted to absolute turn time, and
+    merged() the whole thing.
+    """
+
+    def __init__(self):
+        self.offset = 0.0
+        self.cues: List[Dict[str, Any]] = []
+
+    def add(self, chunk: SpeechChunk) -> List[Dict[str, Any]]:
+        try:
+            duration = wav_duration(chunk.wav)
+        except (wave.Error, EOFError, ZeroDivisionError):
+            duration = float(((chunk.lipsync or {}).get("metadata") or {}).get("duration", 0.0))
+        chunk.offset, chunk.duration = self.offset, duration
+
+        shifted: List[Dict[str, Any]] = []
+        for cue in (chunk.lipsync or {}).get("mouthCues", []):
+            start = min(float(cue["start"]), duration)
+            end = min(float(cue["end"]), duration)
+            if end <= start:
+                continue  # Rhubarb's own duration can run a frame past the WAV
+            shifted.append({
+                "start": round(self.offset + start, 3),
+                "end": round(self.offset + end, 3),
+                "value": cue["value"],
+            })
+        if shifted:
+            # Rhubarb rounds its duration to 10 ms; hold the last shape to the real end
+            shifted[-1]["end"] = round(self.offset + duration, 3)
+
+        for cue in shifted:
+            last = self.cues[-1] if self.cues else None
+            if last is not None and last["value"] == cue["value"] and abs(last["end"] - cue["start"]) < 1e-6:
+                last["end"] = cue["end"]  # e.g. trailing X of one chunk + leading X of the next
+            else:
+                self.cues.append(dict(cue))
+        self.offset = round(self.offset + duration, 6)
+        return shifted
+
+    def merged(self) -> Dict[str, Any]:
+        return {"duration": round(self.offset, 3), "mouthCues": self.cues}
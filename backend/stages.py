@@ -0,0 +1,114 @@
+# stages.py
+# Bounded executors for the blocking stages of the speech pipeline
+# -------------------------------------------------------
+# Each stage (llm, tts, stt, io) gets its own thread pool so a slow stage
+# never starves the others or the event loop. A stage accepts at most
+# `workers + max_queue` jobs; beyond that `run()` raises StageFull so the
+# caller can shed load (HTTP 503) instead of queueing forever.
+#
+# Threads (not processes) are used for inference too: llama.cpp, Vosk and
+# pyttsx3 hold their models in-process and release the GIL while working.
+#
+# Sizes come from STAGE_<NAME>_WORKERS / STAGE_<NAME>_QUEUE env vars.
+# -------------------------------------------------------
+
+import os
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+log = logging.getLogger("stages")
+
+
+class StageFull(RuntimeError):
+    """Raised when a stage already holds its maximum number of jobs."""
+
+    def __init__(self, stage: str):
+        super().__init__(f"Stage '{stage}' is at capacity")
+        self.stage = stage
+
+
+class Stage:
+    def __init__(self, name: str, workers: int, max_queue: int):
+        self.name = name
+        self.workers = max(1, int(os.getenv(f"STAGE_{name.upper()}_WORKERS", workers)))
+        self.max_queue = max(0, int(os.getenv(f"STAGE_{name.upper()}_QUEUE", max_queue)))
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"stage-{name}")
+        self._lock = threading.Lock()
+        self._inflight = 0  # queued + running
+        self._running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Run fn(*args) on this stage's pool; raises StageFull when the queue is full."""
+        with self._lock:
+            if self._inflight >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise StageFull(self.name)
+            self._inflight += 1
+
+        def job():
+            with self._lock:
+                self._running += 1
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self._running -= 1
+
+        def release(fut):
+            # fires on completion *or* cancellation, so the slot is never leaked
+            with self._lock:
+                self._inflight -= 1
+                if fut.cancelled():
+                    return
+                if fut.exception() is not None:
+                    self.failed += 1
+                else:
+                    self.completed += 1
+
+        cf = self._executor.submit(job)
+        cf.add_done_callback(release)
+        return await asyncio.wrap_future(cf)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "running": self._running,
+                "queued": self._inflight - self._running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+            }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class StageSet:
+    """Named collection of stages, e.g. stages.llm / stages['tts']."""
+
+    def __init__(self, **stages: Stage):
+        self._stages = stages
+
+    def __getattr__(self, name: str) -> Stage:
+        try:
+            return self.__dict__["_stages"][name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __getitem__(self, name: str) -> Stage:
+        return self._stages[name]
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        return {name: stage.snapshot() for name, stage in self._stages.items()}
+
+    def shutdown(self) -> None:
+        for stage in self._stages.values():
+            stage.shutdown()
@@ -0,0 +1,229 @@
+# stt.py
+# Vosk speech recognition fed straight from an ffmpeg decode pipe
+# -------------------------------------------------------
+# upload bytes --stdin--> ffmpeg --stdout (16 kHz mono s16le)--> KaldiRecognizer
+#
+# Nothing touches the disk, and recognition runs while ffmpeg is still
+# decoding, so STT finishes roughly when the decode does.
+#
+# StreamingRecognizer does the same incrementally for audio that arrives in
+# pieces (the /ws/chat speech input), reporting partials and endpoints.
+#
+# Both put a vad.SpeechGate between the PCM and Kaldi: leading/trailing
+# silence never reaches the decoder and long pauses are shortened. Because
+# the gate holds silence back, it also does the endpointing for streams.
+# -------------------------------------------------------
+
+import json
+import logging
+import subprocess
+import threading
+from typing import Callable, Dict, List, Optional
+
+from engines import fake_enabled
+from metrics import SUBPROCESS_FAILURES
+from models import model_registry
+from vad import SpeechGate
+
+log = logging.getLogger("stt")
+
+VOSK_MODEL_DIR = "vosk-model-small-en-us-0.15"
+STT_SAMPLE_RATE = 16000
+READ_BYTES = 4000 * 2  # 4000 frames of s16le mono, same granularity as the old wave loop
+WRITE_BYTES = 64 * 1024
+
+
+def _load_vosk_model():
+    if fake_enabled("stt"):
+        return None  # bench.fakes.fake_transcribe needs no model
+    from vosk import Model
+    return Model(VOSK_MODEL_DIR)
+
+
+model_registry.register("vosk", _load_vosk_model)
+
+
+def get_vosk_model():
+    """The process-wide Vosk model (see models.py); loads it on first use."""
+    return model_registry.get("vosk")
+
+
+def ffmpeg_pcm_cmd(sample_rate: int = STT_SAMPLE_RATE) -> List[str]:
+    return [
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-nostdin",
+        "-i", "pipe:0",
+        "-f", "s16le", "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(sample_rate),
+        "pipe:1",
+    ]
+
+
+def transcribe_stream(model, data: bytes, sample_rate: int = STT_SAMPLE_RATE, timings: Optional[Dict[str, float]] = None) -> str:
+    """
+    Decode any ffmpeg-readable container (WebM/Opus from the browser) and run
+    Vosk on the speech in the PCM as it comes out of the pipe. Returns the
+    final transcript; `timings` gets stt_audio / stt_trimmed seconds.
+    """
+    from vosk import KaldiRecognizer
+
+    proc = subprocess.Popen(ffmpeg_pcm_cmd(sample_rate), stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stderr_chunks: List[bytes] = []
+
+    def feed():
+        try:
+            view = memoryview(data)
+            for off in range(0, len(view), WRITE_BYTES):
+                proc.stdin.write(view[off:off + WRITE_BYTES])
+        except (BrokenPipeError, OSError):
+            pass  # ffmpeg bailed out early; its stderr says why
+        finally:
+            try:
+                proc.stdin.close()
+            except OSError:
+                pass
+
+    def drain_stderr():
+        stderr_chunks.append(proc.stderr.read())
+
+    writer = threading.Thread(target=feed, name="stt-ffmpeg-in", daemon=True)
+    errors = threading.Thread(target=drain_stderr, name="stt-ffmpeg-err", daemon=True)
+    writer.start()
+    errors.start()
+
+    rec = KaldiRecognizer(model, sample_rate)
+    gate = SpeechGate(sample_rate)
+    try:
+        while True:
+            pcm = proc.stdout.read(READ_BYTES)
+            if not pcm:
+                break
+            for speech, _ in gate.feed(pcm):
+                rec.AcceptWaveform(speech)
+        tail = gate.finish()
+        if tail:
+            rec.AcceptWaveform(tail)
+    finally:
+        proc.stdout.close()
+        returncode = proc.wait()
+        writer.join()
+        errors.join()
+
+    if returncode != 0:
+        SUBPROCESS_FAILURES.inc(tool="ffmpeg", reason="failed")
+        stderr = b"".join(stderr_chunks).decode("utf-8", "replace").strip()
+        raise RuntimeError(f"ffmpeg decode failed (code={returncode}): {stderr}")
+    if timings is not None:
+        timings["stt_audio"] = gate.stats.seconds_in
+        timings["stt_trimmed"] = gate.stats.trimmed
+    return json.loads(rec.FinalResult()).get("text", "").strip()
+
+
+class StreamingRecognizer:
+    """
+    Incremental recognizer for one utterance stream.
+
+    fmt="pcm16": feed() takes raw s16le mono frames at `sample_rate` and runs
+    the recognizer in the calling thread.
+    Any other fmt (e.g. "webm"): feed() writes container bytes into a
+    long-lived ffmpeg process; a reader thread recognizes its PCM output.
+
+    on_event(kind, text) is called with kind "partial" (text changed) or
+    "final" (the VAD or Vosk detected an endpoint, or finish() was called).
+    It may be invoked from a worker thread.
+    """
+
+    def __init__(self, model, on_event: Callable[[str, str], None], fmt: str = "pcm16", sample_rate: int = STT_SAMPLE_RATE):
+        from vosk import KaldiRecognizer
+
+        self.fmt = fmt
+        self.on_event = on_event
+        self.sample_rate = sample_rate if fmt == "pcm16" else STT_SAMPLE_RATE
+        self.rec = KaldiRecognizer(model, self.sample_rate)
+        self.gate = SpeechGate(self.sample_rate)
+        self.bytes_in = 0
+        self._last_partial = ""
+        self._lock = threading.Lock()
+        self._proc: Optional[subprocess.Popen] = None
+        self._reader: Optional[threading.Thread] = None
+        if fmt != "pcm16":
+            self._proc = subprocess.Popen(ffmpeg_pcm_cmd(STT_SAMPLE_RATE), stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            self._reader = threading.Thread(target=self._read_pcm, args=(self._proc,), name="stt-stream-pcm", daemon=True)
+            self._reader.start()
+
+    def feed(self, data: bytes) -> None:
+        if not data:
+            return
+        self.bytes_in += len(data)
+        if self._proc is not None:
+            try:
+                self._proc.stdin.write(data)
+                self._proc.stdin.flush()
+            except (BrokenPipeError, OSError):
+                SUBPROCESS_FAILURES.inc(tool="ffmpeg", reason="stream_closed")
+                log.warning("ffmpeg stream decoder closed its input early")
+        else:
+            self._accept(data)
+
+    def finish(self) -> str:
+        """Flush everything still buffered and return the last (final) transcript."""
+        self._close_decoder()
+        with self._lock:
+            tail = self.gate.finish()
+        if tail:
+            self._recognize(tail)
+        return self._endpoint()
+
+    def close(self) -> None:
+        self._close_decoder(kill=True)
+
+    def _close_decoder(self, kill: bool = False) -> None:
+        if self._proc is None:
+            return
+        proc, self._proc = self._proc, None
+        try:
+            proc.stdin.close()
+        except OSError:
+            pass
+        if kill:
+            proc.kill()
+        proc.wait()
+        if self._reader is not None:
+            self._reader.join()
+
+    def _read_pcm(self, proc: subprocess.Popen) -> None:
+        while True:
+            pcm = proc.stdout.read1(READ_BYTES)  # whatever is ready, so partials keep flowing
+            if not pcm:
+                break
+            self._accept(pcm)
+
+    def _accept(self, pcm: bytes) -> None:
+        with self._lock:
+            pieces = self.gate.feed(pcm)
+        for speech, endpoint in pieces:
+            if speech:
+                self._recognize(speech)
+            if endpoint:
+                self._endpoint()
+
+    def _endpoint(self) -> str:
+        with self._lock:
+            text = json.loads(self.rec.FinalResult()).get("text", "").strip()
+            self._last_partial = ""
+        if text:
+            self.on_event("final", text)
+        return text
+
+    def _recognize(self, pcm: bytes) -> None:
+        with self._lock:
+            if self.rec.AcceptWaveform(pcm):
+                text = json.loads(self.rec.Result()).get("text", "").strip()
+                self._last_partial = ""
+                kind = "final"
+            else:
+                text = json.loads(self.rec.PartialResult()).get("partial", "").strip()
+                if text == self._last_partial:
+                    return
+                self._last_partial = text
+                kind = "partial"
+        if text:
+            self.on_event(kind, text)
@@ -1,6 +1,8 @@
 # backend/main.py
 
-from llm.tessa_chatbot import tessa
+from llm.tessa_chatbot import TessaChatbot
+
+tessa = TessaChatbot()
 
 response = tessa.get_response("hi")
 print(response)
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the backend modules are flat, imported from the backend directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,143 @@
+import struct
+
+import numpy as np
+import pytest
+
+from audio_utils import (
+    WAVE_FORMAT_EXTENSIBLE, WAVE_FORMAT_IEEE_FLOAT, WAVE_FORMAT_PCM,
+    convert_width, parse_wav, pcm_to_float, read_wav, resample, speech_span, to_pcm16_mono, wrap_wav,
+)
+
+RATES = (16000, 22050, 24000, 44100, 48000)
+
+
+def sine(freq, rate, seconds=0.5, amp=0.5):
+    t = np.arange(int(rate * seconds)) / rate
+    return (amp * np.sin(2 * np.pi * freq * t)).astype(np.float32)
+
+
+def make_wav(data, rate, channels=1, width=2, tag=WAVE_FORMAT_PCM, extensible=False, data_size=None):
+    """WAV bytes with a hand-written fmt chunk, for headers wrap_wav never writes."""
+    bits = width * 8
+    fmt = struct.pack("<HHIIHH", WAVE_FORMAT_EXTENSIBLE if extensible else tag, channels, rate,
+                      rate * channels * width, channels * width, bits)
+    if extensible:
+        # cbSize, valid bits, channel mask, then the subformat GUID (starts with the real tag)
+        fmt += struct.pack("<HHI", 22, bits, 0) + struct.pack("<H", tag) + b"\x00\x00\x00\x00\x10\x00\x80\x00\x00\xaa\x00\x38\x9b\x71"
+    body = b"WAVE" + b"fmt " + struct.pack("<I", len(fmt)) + fmt
+    body += b"LIST" + struct.pack("<I", 3) + b"abc\x00"  # odd-sized chunk: parser must skip the pad byte
+    body += b"data" + struct.pack("<I", len(data) if data_size is None else data_size) + data
+    return b"RIFF" + struct.pack("<I", len(body)) + body
+
+
+@pytest.fixture
+def pcm16():
+    rng = np.random.default_rng(0)
+    return rng.integers(-32768, 32768, size=4000, dtype=np.int64).astype("<i2")
+
+
+@pytest.mark.parametrize("width", [3, 4])
+def test_wide_round_trip_is_lossless(pcm16, width):
+    wide = convert_width(pcm16.tobytes(), 2, width)
+    assert len(wide) == pcm16.size * width
+    assert convert_width(wide, width, 2) == pcm16.tobytes()
+
+
+def test_8bit_round_trip_keeps_the_top_byte(pcm16):
+    narrow = convert_width(pcm16.tobytes(), 2, 1)
+    assert len(narrow) == pcm16.size
+    back = np.frombuffer(convert_width(narrow, 1, 2), dtype="<i2").astype(np.int32)
+    err = np.abs(back - pcm16)
+    assert err[pcm16 < 32640].max() <= 128  # rounds to the nearest step...
+    assert err.max() <= 256                   # ...except where the top step clips
+    # silence is 0x80 in unsigned 8-bit WAV
+    assert convert_width(b"\x00\x00", 2, 1) == b"\x80"
+
+
+@pytest.mark.parametrize("width", [1, 2, 3, 4])
+def test_pcm_to_float_matches_every_width(pcm16, width):
+    expected = pcm16.astype(np.float32) / 32768.0
+    frames = convert_width(pcm16.tobytes(), 2, width)
+    x = pcm_to_float(frames, width)
+    assert x.shape == (pcm16.size, 1)
+    assert np.abs(x[:, 0] - expected).max() <= (1 / 128 if width == 1 else 1e-6)
+
+
+@pytest.mark.parametrize("width", [1, 2, 3, 4])
+def test_parse_wav_reads_wrapped_pcm(pcm16, width):
+    frames = convert_width(pcm16.tobytes(), 2, width)
+    info, view = parse_wav(wrap_wav(frames, 22050, sample_width=width))
+    assert (info.channels, info.sample_rate, info.sample_width, info.format_tag) == (1, 22050, width, WAVE_FORMAT_PCM)
+    assert bytes(view) == frames
+
+
+@pytest.mark.parametrize("dtype,width", [("<f4", 4), ("<f8", 8)])
+@pytest.mark.parametrize("extensible", [False, True])
+def test_float_wav(dtype, width, extensible):
+    x = sine(440, 24000)
+    stereo = np.stack([x, -x], axis=1).astype(dtype)
+    wav = make_wav(stereo.tobytes(), 24000, channels=2, width=width, tag=WAVE_FORMAT_IEEE_FLOAT, extensible=extensible)
+    info, view = parse_wav(wav)
+    assert (info.channels, info.sample_width, info.format_tag) == (2, width, WAVE_FORMAT_IEEE_FLOAT)
+    y = pcm_to_float(view, info.sample_width, info.channels, info.format_tag)
+    np.testing.assert_allclose(y, stereo, atol=1e-7)
+    mono, rate = read_wav(wav)
+    assert rate == 24000 and np.abs(mono).max() < 1e-7  # the channels cancel
+
+
+def test_extensible_pcm_24bit(pcm16):
+    frames = convert_width(pcm16.tobytes(), 2, 3)
+    info, view = parse_wav(make_wav(frames, 48000, width=3, extensible=True))
+    assert (info.sample_width, info.format_tag) == (3, WAVE_FORMAT_PCM)
+    out = to_pcm16_mono(make_wav(frames, 48000, width=3, extensible=True), target_rate=48000)
+    assert bytes(parse_wav(out)[1]) == pcm16.tobytes()
+
+
+@pytest.mark.parametrize("size", [0xFFFFFFFF, 0])
+def test_streamed_wav_reads_to_the_end(pcm16, size):
+    # a pipe writer does not know the length; a torn last frame is dropped
+    wav = make_wav(pcm16.tobytes() + b"\x01", 16000, data_size=size)
+    info, view = parse_wav(wav)
+    assert bytes(view) == pcm16.tobytes()
+
+
+def test_unsupported_format_is_rejected():
+    with pytest.raises(ValueError):
+        parse_wav(make_wav(b"\x00" * 8, 8000, tag=0x0006))  # A-law
+    with pytest.raises(ValueError):
+        parse_wav(b"RIFF\x00\x00\x00\x00WAVEdata")
+
+
+@pytest.mark.parametrize("src", RATES)
+@pytest.mark.parametrize("dst", RATES)
+def test_resample_length_and_accuracy(src, dst):
+    freq = 1000.0
+    x = sine(freq, src)
+    y = resample(x, src, dst)
+    assert y.dtype == np.float32
+    assert y.size == x.size * dst // src
+    expected = sine(freq, dst)[: y.size]
+    edge = dst // 100  # the kernel sees zeros past both ends
+    err = np.abs(y[edge:-edge] - expected[edge:-edge]).max()
+    assert err < 2e-3, (src, dst, err)
+
+
+@pytest.mark.parametrize("src,dst", [(48000, 16000), (44100, 22050), (22050, 16000)])
+def test_resample_removes_content_above_the_new_nyquist(src, dst):
+    x = sine(0.5 * dst + 1000, src)
+    y = resample(x, src, dst)
+    edge = dst // 100
+    assert np.abs(y[edge:-edge]).max() < 0.01
+
+
+def test_resample_keeps_dc():
+    y = resample(np.full(4410, 0.25, np.float32), 44100, 16000)
+    edge = 160
+    np.testing.assert_allclose(y[edge:-edge], 0.25, atol=1e-5)
+
+
+def test_speech_span():
+    mask = np.array([0, 0, 1, 1, 0, 1, 0, 0], dtype=bool)
+    assert speech_span(mask, hop=100, pad=50, n_samples=800) == (150, 650)
+    assert speech_span(mask, hop=100, pad=500, n_samples=800) == (0, 800)
+    assert speech_span(np.zeros(8, dtype=bool), hop=100, pad=50, n_samples=800) == (0, 800)
@@ -0,0 +1,110 @@
+import chunker
+from chunker import AdaptiveChunker, Throughput
+from speech_pipeline import SpeechChunk
+
+WORDS = ("the quick brown fox jumps over the lazy dog while a small bird sings softly in the old oak tree "
+         "and the farmer walks slowly home across the wide green field before the evening rain").split()
+
+
+def tokens_of(text):
+    """Llama-style tokens: words carry their leading space, long words come in pieces."""
+    out = []
+    for i, word in enumerate(text.split(" ")):
+        word = word if i == 0 else " " + word
+        out += [word[:4], word[4:]] if len(word) > 6 else [word]
+    return [t for t in out if t]
+
+
+def run(tokens, c=None):
+    """(text, reason) for every chunk, including the one finish() returns."""
+    c = c or AdaptiveChunker(Throughput())
+    reasons = []
+    take = c._take
+
+    def recording_take(reason):
+        reasons.append(reason)
+        return take(reason)
+
+    c._take = recording_take
+    chunks = [text for t in tokens for text in c.feed(t)]
+    last = c.finish()
+    if last is not None:
+        chunks.append(last)
+    assert len(chunks) == len(reasons)
+    return list(zip(chunks, reasons))
+
+
+def test_chunks_never_split_words():
+    text = " ".join(WORDS * 3)
+    tokens = tokens_of(text)
+    out = run(tokens)
+    assert "".join(chunk for chunk, _ in out) == text
+    for chunk, _ in out[1:]:
+        assert chunk.startswith(" ")  # each chunk starts at a word, so the previous one ended at one
+    words = set(WORDS)
+    for chunk, _ in out:
+        assert all(w in words for w in chunk.split())
+
+
+def test_first_chunk_bounds():
+    out = run(tokens_of(" ".join(WORDS)))
+    first, reason = out[0]
+    assert reason == "size"
+    assert chunker.CHUNK_FIRST_MIN_CHARS <= len(first.strip())
+    longest = max(len(w) for w in WORDS) + 1
+    assert len(first.strip()) < chunker.CHUNK_FIRST_CHARS + longest
+
+
+def test_first_chunk_is_not_too_short():
+    # a sentence end before CHUNK_FIRST_MIN_CHARS does not flush on its own
+    out = run(tokens_of("Hi. I am Tessa, nice to meet you and all that"))
+    assert out[0] == ("Hi. I am Tessa,", "clause")
+
+
+def test_first_chunk_takes_an_early_clause():
+    out = run(tokens_of("Well, honestly, I think that is a great idea for the weekend"))
+    assert out[0][1] == "clause"
+    assert out[0][0] == "Well, honestly,"
+
+
+def test_sentence_end_flushes():
+    out = run(tokens_of("That sounds like fun! Tell me more about it."))
+    assert out == [("That sounds like fun!", "sentence"), (" Tell me more about it.", "end")]
+
+
+def test_later_clause_waits_for_most_of_the_target():
+    c = AdaptiveChunker(Throughput())
+    first = run(tokens_of("That sounds like a lot of fun."), c)
+    assert first == [("That sounds like a lot of fun.", "end")]
+    target = c.target_chars()
+    assert target > chunker.CHUNK_MIN_CHARS
+
+    # a clause well short of 0.6 * target is not a reason to cut
+    short_clause = " Sure, " + " ".join(["we", "can", "go"] * 20)
+    out = run(tokens_of(short_clause), c)
+    assert out[0][1] == "size"
+    assert len(out[0][0].strip()) >= target
+    assert not out[0][0].strip().endswith("Sure,")
+
+
+def test_size_flush_tracks_pipeline_speed():
+    slow, fast = Throughput(), Throughput()
+    slow.proc_s_per_char = fast.proc_s_per_char * 3  # synthesis barely keeps up with playback
+
+    def second_chunk(model):
+        c = AdaptiveChunker(model)
+        out = run(tokens_of(" ".join(WORDS * 2)), c)
+        assert [r for _, r in out[:2]] == ["size", "size"]
+        return len(out[1][0].strip())
+
+    assert second_chunk(slow) < second_chunk(fast)
+
+
+def test_observe_releases_pending_chars():
+    c = AdaptiveChunker(Throughput())
+    out = run(tokens_of("That sounds like a lot of fun."), c)
+    before = c.target_chars()
+    c.observe(SpeechChunk(out[0][0], seq=0, duration=2.0, timings={"tts": 0.3, "lipsync": 0.2}))
+    assert c._pending_chars == 0
+    # 2 s of audio still to play (and a faster pipeline than assumed) leaves more slack
+    assert c.target_chars() > before
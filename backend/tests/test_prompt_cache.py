@@ -0,0 +1,47 @@
+import pytest
+
+import bench.fakes
+from bench.fakes import FakeLlama
+from llm.prompt import build_prompt
+from llm.prompt_cache import PromptStateCache
+from llm.scheduler import LLMScheduler
+
+SYSTEM_PROMPT = "You are Tessa, a friendly casual chatbot.\n"
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    monkeypatch.setattr(bench.fakes, "FAKE_LLM_PROMPT_MS", 0.0)
+    monkeypatch.setattr(bench.fakes, "FAKE_LLM_TOKEN_MS", 0.0)
+    llm = FakeLlama()
+    scheduler = LLMScheduler(llm, PromptStateCache(llm, SYSTEM_PROMPT))
+    scheduler.call(scheduler.prompt_cache.warm).result()
+    yield scheduler
+    scheduler.shutdown()
+
+
+def run_turn(scheduler, history, user_text, session_id="s1"):
+    prompt = build_prompt(SYSTEM_PROMPT, history, user_text)
+    tokens = []
+    info = scheduler.submit(session_id, prompt, tokens.append, {"max_tokens": 64}).result(timeout=10)
+    history += [{"role": "user", "content": user_text}, {"role": "assistant", "content": "".join(tokens).strip()}]
+    return prompt, info
+
+
+def test_follow_up_turns_only_evaluate_new_tokens(scheduler):
+    cache = scheduler.prompt_cache
+    history = []
+    run_turn(scheduler, history, "hi")
+    run_turn(scheduler, history, "how are you")
+    # what turn 2 left in the KV cache: its prompt plus the reply it generated
+    saved = cache._sessions["s1"][0]
+    # another session takes the model in between, so turn 3 has to restore s1's snapshot
+    run_turn(scheduler, [], "hello", session_id="s2")
+    hits = cache.session_hits
+
+    prompt, info = run_turn(scheduler, history, "what's new")
+    tokens = cache.tokenize(prompt)
+    assert tokens[: len(saved)] == saved
+    assert info["reused_tokens"] == len(saved)
+    assert len(tokens) - info["reused_tokens"] == len(cache.tokenize("\n### Instruction: what's new\n### Response:"))
+    assert cache.session_hits == hits + 1
@@ -0,0 +1,30 @@
+from reply_cache import ReplyCache
+
+INTENTS = [
+    {"name": "greeting", "inputs": ["hi", "hello"], "replies": ["Hey!"]},
+    {"name": "good_morning", "inputs": ["good morning"], "replies": ["Morning!"]},
+]
+SEGMENTS = [("text", b"RIFF", {"mouthCues": []})]
+
+
+def test_only_smalltalk_intents_have_keys():
+    cache = ReplyCache(None, intents=INTENTS)
+    assert cache.key("Hi, Tessa!", "tessa") == ("tessa", "@greeting")
+    for text in ("why?", "really?", "tell me more", "no"):
+        assert cache.key(text, "tessa") is None
+
+
+def test_free_form_short_inputs_are_never_learned():
+    cache = ReplyCache(None, intents=INTENTS, variants=1)
+    cache.remember("why?", "tessa", "Because of what you said earlier.", SEGMENTS)
+    assert cache.lookup("why?", "tessa") is None
+    assert cache.stats()["learned"] == 0
+
+
+def test_learned_replies_stay_out_of_conversations():
+    cache = ReplyCache(None, intents=INTENTS, variants=2)
+    cache.remember("good morning", "tessa", "Mid-conversation reply", SEGMENTS, has_history=True)
+    cache.remember("good morning", "tessa", "Morning A", SEGMENTS)
+    cache.remember("good morning", "tessa", "Morning B", SEGMENTS)
+    assert cache.lookup("good morning", "tessa", has_history=True) is None
+    assert {cache.lookup("good morning", "tessa").text for _ in range(2)} == {"Morning A", "Morning B"}
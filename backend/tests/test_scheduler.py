@@ -0,0 +1,118 @@
+import threading
+import time
+
+import pytest
+
+import llm.scheduler
+from llm.scheduler import LLMScheduler, SchedulerFull
+
+LONG = "x" * (llm.scheduler.LLM_SHORT_PROMPT_CHARS + 1)
+
+
+class GatedLlama:
+    """Records which prompt ran; a prompt of "block" holds the model until release()."""
+
+    def __init__(self):
+        self.ran = []
+        self.gate = threading.Event()
+        self.blocked = threading.Event()
+
+    def __call__(self, prompt, stream, **params):
+        if prompt == "block":
+            self.blocked.set()
+            self.gate.wait(5)
+        self.ran.append(prompt)
+        yield {"choices": [{"text": "ok"}]}
+
+    def release(self):
+        self.gate.set()
+
+
+@pytest.fixture
+def model():
+    return GatedLlama()
+
+
+@pytest.fixture
+def scheduler(model):
+    scheduler = LLMScheduler(model, max_queue=8)
+    yield scheduler
+    model.release()
+    scheduler.shutdown()
+
+
+def hold(scheduler, model):
+    """Occupy the model so the next submits all queue up behind it."""
+    fut = scheduler.submit("busy", "block", lambda t: None, {})
+    assert model.blocked.wait(5)
+    return fut
+
+
+def submit(scheduler, session_id, prompt, **kw):
+    return scheduler.submit(session_id, prompt, lambda t: None, {}, **kw)
+
+
+def test_sessions_take_turns(scheduler, model):
+    hold(scheduler, model)
+    futures = [submit(scheduler, "a", p) for p in ("a1", "a2", "a3")]
+    futures += [submit(scheduler, "b", "b1"), submit(scheduler, "c", "c1")]
+    model.release()
+    for f in futures:
+        f.result(timeout=5)
+    assert model.ran == ["block", "a1", "b1", "c1", "a2", "a3"]
+
+
+def test_short_prompt_goes_first(scheduler, model):
+    hold(scheduler, model)
+    regular = submit(scheduler, "long", LONG)
+    short = submit(scheduler, "short", "hi")
+    model.release()
+    regular.result(timeout=5)
+    short.result(timeout=5)
+    assert model.ran == ["block", "hi", LONG]
+
+
+def test_waiting_regular_job_is_promoted(scheduler, model, monkeypatch):
+    monkeypatch.setattr(llm.scheduler, "LLM_PRIORITY_AGING_S", 0.05)
+    hold(scheduler, model)
+    regular = submit(scheduler, "long", LONG)
+    time.sleep(0.1)
+    short = submit(scheduler, "short", "hi")
+    model.release()
+    regular.result(timeout=5)
+    short.result(timeout=5)
+    # both rank 0 now, so round-robin order decides: "long" queued first
+    assert model.ran == ["block", LONG, "hi"]
+
+
+def test_cancel_drops_queued_jobs(scheduler, model):
+    running = hold(scheduler, model)
+    dropped = [submit(scheduler, "a", "a1"), submit(scheduler, "a", "a2")]
+    kept = submit(scheduler, "b", "b1")
+    assert scheduler.snapshot()["queued"] == 3
+
+    assert scheduler.cancel("a") == 2
+    assert scheduler.cancel("a") == 0
+    assert all(f.cancelled() for f in dropped)
+    snap = scheduler.snapshot()
+    assert (snap["queued"], snap["cancelled"], snap["sessions_waiting"], snap["running"]) == (1, 2, 1, 1)
+
+    model.release()
+    running.result(timeout=5)
+    kept.result(timeout=5)
+    assert model.ran == ["block", "b1"]
+    assert scheduler.snapshot()["completed"] == 2
+
+
+def test_full_queue_rejects(model):
+    scheduler = LLMScheduler(model, max_queue=2)
+    try:
+        hold(scheduler, model)
+        submit(scheduler, "a", "a1")
+        submit(scheduler, "b", "b1")
+        with pytest.raises(SchedulerFull):
+            submit(scheduler, "c", "c1")
+        assert scheduler.snapshot()["rejected"] == 1
+    finally:
+        model.release()
+        scheduler.shutdown()
@@ -0,0 +1,51 @@
+import asyncio
+
+from speech_pipeline import ChunkPipeline, SpeechChunk
+
+
+def run_turn(texts, tts_delay=None, fail=(), gap=0.01):
+    """Emitted (seq, final) pairs and end() calls for one turn of `texts`."""
+    emitted, ends = [], []
+
+    async def tts(chunk: SpeechChunk):
+        await asyncio.sleep((tts_delay or {}).get(chunk.text, 0))
+        chunk.wav = b"" if chunk.text in fail else b"RIFF"
+
+    async def lipsync(chunk: SpeechChunk):
+        chunk.lipsync = {"mouthCues": []}
+
+    async def emit(chunk: SpeechChunk):
+        emitted.append((chunk.seq, chunk.final))
+
+    async def end(seq: int):
+        ends.append(seq)
+
+    async def main():
+        pipeline = ChunkPipeline(tts, lipsync, emit, end)
+        for text in texts:
+            pipeline.push(text)
+            await asyncio.sleep(gap)
+        await pipeline.close()
+        return pipeline.last_seq
+
+    last_seq = asyncio.run(main())
+    return emitted, ends, last_seq
+
+
+def test_last_chunk_flagged_final_when_known():
+    # closed before the chunk's TTS finishes: nothing can follow it
+    emitted, ends, last_seq = run_turn(["a"], gap=0)
+    assert emitted == [(0, True)] and ends == [] and last_seq == 0
+
+
+def test_end_marker_when_tts_finishes_after_the_last_chunk():
+    # "c" is pushed while "b" is emitted, then its TTS fails: "b" is the last chunk
+    emitted, ends, last_seq = run_turn(["a", "b", "c"], tts_delay={"c": 0.05}, fail={"c"})
+    assert emitted == [(0, False), (1, False)]
+    assert ends == [1] == [last_seq]
+
+
+def test_exactly_one_final_signal_per_turn():
+    emitted, ends, last_seq = run_turn(["a", "b", "c", "d"], tts_delay={"b": 0.02, "d": 0.03})
+    finals = [seq for seq, final in emitted if final] + ends
+    assert finals == [last_seq] == [3]
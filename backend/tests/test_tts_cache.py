@@ -0,0 +1,35 @@
+import threading
+
+from tts_cache import SpeechCache
+
+WAV = b"RIFF" + b"\0" * 1000
+LIPS = {"mouthCues": [{"start": 0.0, "end": 0.1, "value": "X"}]}
+
+
+def disk_size(cache):
+    cache._disk_size = None
+    return cache._scan_disk_size()
+
+
+def test_re_put_does_not_grow_the_counted_size(tmp_path):
+    cache = SpeechCache(tmp_path, mem_items=0, disk_bytes=1 << 20)
+    cache.put("a", WAV, LIPS)
+    cache.put("b", WAV, LIPS)
+    counted = cache._disk_size
+    cache.put("a", WAV, LIPS)
+    cache.put("a", WAV + b"\0" * 10, LIPS)
+    assert cache._disk_size == counted + 10 == disk_size(cache)
+
+
+def test_concurrent_misses_for_one_key(tmp_path):
+    cache = SpeechCache(tmp_path, mem_items=0, disk_bytes=1 << 20)
+    cache.put("warm", WAV, LIPS)  # size is scanned on the first write, counted after that
+    threads = [threading.Thread(target=cache.put, args=("a", WAV, LIPS)) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    counted = cache._disk_size
+    assert counted == disk_size(cache)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["a.json", "a.wav", "warm.json", "warm.wav"]
+    assert SpeechCache(tmp_path, mem_items=0, disk_bytes=1 << 20).get("a") == (WAV, LIPS)
@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+import vad
+from vad import SpeechGate
+
+RATE = 16000
+
+
+def signal(*parts):
+    """("tone" | "silence", seconds) parts -> s16le bytes; silence is a -70 dBFS noise floor."""
+    rng = np.random.default_rng(0)
+    out = []
+    for kind, seconds in parts:
+        n = int(round(seconds * RATE))
+        if kind == "tone":
+            out.append(0.3 * np.sin(2 * np.pi * 300 * np.arange(n) / RATE))
+        else:
+            out.append(rng.normal(0, 3e-4, n))
+    return (np.concatenate(out) * 32767).astype("<i2").tobytes()
+
+
+def at(seconds):
+    return int(round(seconds * RATE)) * 2
+
+
+def run(pcm, block=0.1):
+    """(all bytes the gate let through, byte offsets of the endpoints) for pcm fed in blocks."""
+    gate = SpeechGate(RATE, enabled=True)
+    out, endpoints = b"", []
+    step = at(block) + 2  # not frame-aligned: exercises the carried-over remainder
+    for i in range(0, len(pcm), step):
+        for piece, endpoint in gate.feed(pcm[i:i + step]):
+            out += piece
+            if endpoint:
+                endpoints.append(len(out))
+    return out + gate.finish(), endpoints, gate
+
+
+def test_pre_roll_and_trailing_context():
+    pcm = signal(("silence", 1.0), ("tone", 0.5), ("silence", 1.0))
+    out, endpoints, gate = run(pcm)
+    # VAD_PAD_S of the silence on each side of the speech, nothing else
+    assert out == pcm[at(1.0 - vad.VAD_PAD_S):at(1.5 + vad.VAD_PAD_S)]
+    assert endpoints == [len(out)]
+    assert gate.stats.endpoints == 1
+    assert gate.stats.trimmed == pytest.approx(2.5 - (0.5 + 2 * vad.VAD_PAD_S))
+
+
+def test_long_pause_is_shortened():
+    pause = vad.VAD_MAX_PAUSE_S + 0.3
+    assert pause < vad.VAD_ENDPOINT_S
+    pcm = signal(("silence", 1.0), ("tone", 0.3), ("silence", pause), ("tone", 0.3), ("silence", 1.0))
+    out, endpoints, _ = run(pcm)
+    second = 1.3 + pause
+    # the end of the pause is kept: it leads into the next word
+    expected = (pcm[at(1.0 - vad.VAD_PAD_S):at(1.3)]
+                + pcm[at(second - vad.VAD_MAX_PAUSE_S):at(second + 0.3 + vad.VAD_PAD_S)])
+    assert out == expected
+    assert endpoints == [len(out)]
+
+
+def test_short_pause_is_kept_whole():
+    pcm = signal(("silence", 0.5), ("tone", 0.3), ("silence", 0.2), ("tone", 0.3), ("silence", 1.0))
+    out, endpoints, _ = run(pcm)
+    assert out == pcm[at(0.5 - vad.VAD_PAD_S):at(1.3 + vad.VAD_PAD_S)]
+    assert len(endpoints) == 1
+
+
+def test_endpoint_after_enough_silence():
+    pcm = signal(("silence", 0.5), ("tone", 0.4), ("silence", vad.VAD_ENDPOINT_S + 0.2),
+                 ("tone", 0.4), ("silence", vad.VAD_ENDPOINT_S - 0.2))
+    out, endpoints, gate = run(pcm)
+    # the first utterance ends; the second is still waiting for its silence when the stream stops
+    utterance = at(vad.VAD_PAD_S + 0.4 + vad.VAD_PAD_S)
+    assert endpoints == [utterance]
+    assert gate.stats.endpoints == 1
+    assert len(out) == 2 * utterance  # finish() still adds the trailing context
+
+
+def test_silence_only_is_dropped():
+    out, endpoints, gate = run(signal(("silence", 2.0)))
+    assert out == b"" and endpoints == []
+    assert gate.stats.trimmed == pytest.approx(2.0)
+
+
+def test_block_size_does_not_matter():
+    pcm = signal(("silence", 0.6), ("tone", 0.3), ("silence", 0.6), ("tone", 0.5), ("silence", 1.0))
+    assert run(pcm, block=0.03)[:2] == run(pcm, block=0.5)[:2]
+
+
+def test_disabled_gate_passes_everything():
+    pcm = signal(("silence", 0.5), ("tone", 0.2))
+    gate = SpeechGate(RATE, enabled=False)
+    assert gate.feed(pcm) == [(pcm, False)]
+    assert gate.finish() == b""
+    assert gate.stats.trimmed == 0
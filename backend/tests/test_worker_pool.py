@@ -0,0 +1,38 @@
+import time
+import threading
+
+import pytest
+
+from llm.worker_pool import LLMWorkerPool
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    # spawned workers read these when they import engines / bench.fakes
+    monkeypatch.setenv("FAKE_ENGINES", "llm")
+    monkeypatch.setenv("FAKE_LLM_TOKEN_MS", "200")
+    pool = LLMWorkerPool({"model_path": "fake.gguf"}, workers=2, threads=1).start(timeout=60)
+    yield pool
+    pool.shutdown()
+
+
+def test_dead_worker_fails_its_job_while_another_streams(pool):
+    first_token = threading.Event()
+    survivor_tokens = []
+    victim = pool.submit("victim", "hello there", lambda t: first_token.set(), {"max_tokens": 64})
+    survivor = pool.submit("survivor", "how are you", survivor_tokens.append, {"max_tokens": 64})
+    assert pool._affinity["victim"] != pool._affinity["survivor"]
+
+    assert first_token.wait(10)
+    pool._workers[pool._affinity["victim"]].process.kill()
+    killed_at = time.monotonic()
+
+    with pytest.raises(RuntimeError, match="exited"):
+        victim.result(timeout=10)
+    # reaped within a couple of reap intervals, not after the survivor goes quiet
+    assert time.monotonic() - killed_at < 2.5
+    assert not survivor.done()
+
+    info = survivor.result(timeout=30)
+    assert info["tokens"] == len(survivor_tokens) > 0
+    assert pool.snapshot()["per_worker"][pool._affinity["victim"]]["alive"] is False
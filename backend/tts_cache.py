@@ -0,0 +1,201 @@
+# tts_cache.py
+# Content-addressed cache for rendered speech (WAV bytes + Rhubarb mouthCues)
+# -------------------------------------------------------
+# Shared by main.py and main-ws.py so repeated utterances ("Hi! How are you?")
+# skip both the TTS engine and the Rhubarb subprocess.
+#
+#   tier 1: in-memory LRU (entry count bounded)
+#   tier 2: on-disk store under audios/cache (byte bounded, oldest-used evicted)
+# -------------------------------------------------------
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+log = logging.getLogger("tts_cache")
+
+CACHE_DIR = Path(os.getenv("TTS_CACHE_DIR", "audios/cache"))
+CACHE_MEM_ITEMS = int(os.getenv("TTS_CACHE_MEM_ITEMS", "256"))
+CACHE_DISK_MB = int(os.getenv("TTS_CACHE_DISK_MB", "256"))
+
+Entry = Tuple[bytes, Dict[str, Any]]  # (wav_bytes, lipsync json)
+
+
+def normalize_text(text: str) -> str:
+    """NFC-normalize and collapse whitespace; casing/punctuation are kept since they change prosody."""
+    return " ".join(unicodedata.normalize("NFC", text or "").split())
+
+
+def cache_key(text: str, voice: str, rate: int, recognizer: str = "phonetic", engine: str = "pyttsx3") -> str:
+    """Stable hex digest for (normalized text, voice, TTS rate, rhubarb recognizer, engine)."""
+    parts = [normalize_text(text), (voice or "").strip().lower(), str(int(rate)), recognizer, engine]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def _file_size(path: Path) -> int:
+    try:
+        return path.stat().st_size
+    except OSError:
+        return 0
+
+
+class SpeechCache:
+    def __init__(self, cache_dir: Path = CACHE_DIR, mem_items: int = CACHE_MEM_ITEMS, disk_bytes: int = CACHE_DISK_MB * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.mem_items = mem_items
+        self.disk_bytes = disk_bytes
+        self._mem: "OrderedDict[str, Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_size: Optional[int] = None  # computed lazily on first disk write
+        self.hits_mem = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self.evictions_disk = 0
+        if self.disk_bytes > 0:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    # ---------- public API ----------
+    def get(self, key: str) -> Optional[Entry]:
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry is not None:
+                self._mem.move_to_end(key)
+                self.hits_mem += 1
+                return entry
+
+        entry = self._disk_get(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits_disk += 1
+            self._mem_put(key, entry)
+        return entry
+
+    def put(self, key: str, wav_bytes: bytes, lipsync: Dict[str, Any]) -> None:
+        if not wav_bytes:
+            return
+        entry = (wav_bytes, lipsync)
+        with self._lock:
+            self._mem_put(key, entry)
+        try:
+            self._disk_put(key, entry)
+        except OSError as e:
+            log.warning("TTS cache disk write failed for %s: %s", key[:12], e)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits_mem + self.hits_disk + self.misses
+            return {
+                "hits_mem": self.hits_mem,
+                "hits_disk": self.hits_disk,
+                "misses": self.misses,
+                "hit_rate": round((self.hits_mem + self.hits_disk) / lookups, 4) if lookups else 0.0,
+                "mem_items": len(self._mem),
+                "disk_bytes": self._disk_size or 0,
+                "evictions_disk": self.evictions_disk,
+            }
+
+    # ---------- memory tier ----------
+    def _mem_put(self, key: str, entry: Entry) -> None:
+        if self.mem_items <= 0:
+            return
+        self._mem[key] = entry
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.mem_items:
+            self._mem.popitem(last=False)
+
+    # ---------- disk tier ----------
+    def _paths(self, key: str) -> Tuple[Path, Path]:
+        return self.cache_dir / f"{key}.wav", self.cache_dir / f"{key}.json"
+
+    def _disk_get(self, key: str) -> Optional[Entry]:
+        if self.disk_bytes <= 0:
+            return None
+        wav_path, json_path = self._paths(key)
+        try:
+            wav_bytes = wav_path.read_bytes()
+            with open(json_path, "r", encoding="utf-8") as f:
+                lipsync = json.load(f)
+        except (OSError, ValueError):
+            return None
+        now = time.time()
+        try:
+            os.utime(wav_path, (now, now))  # mtime doubles as "last used" for eviction
+        except OSError:
+            pass
+        return wav_bytes, lipsync
+
+    def _disk_put(self, key: str, entry: Entry) -> None:
+        if self.disk_bytes <= 0:
+            return
+        wav_bytes, lipsync = entry
+        wav_path, json_path = self._paths(key)
+        payload = json.dumps(lipsync).encode("utf-8")
+        if len(wav_bytes) + len(payload) > self.disk_bytes:
+            return
+        # per-writer temp names: two misses for the same text may write it at once
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        tmp_json, tmp_wav = json_path.with_name(json_path.name + suffix), wav_path.with_name(wav_path.name + suffix)
+        tmp_json.write_bytes(payload)
+        tmp_wav.write_bytes(wav_bytes)
+
+        with self._lock:
+            # a re-put replaces files that are already counted: add only the difference
+            replaced = sum(_file_size(p) for p in (json_path, wav_path))
+            # json first: a .wav without its .json is never returned by _disk_get
+            os.replace(tmp_json, json_path)
+            os.replace(tmp_wav, wav_path)
+            if self._disk_size is None:
+                self._disk_size = self._scan_disk_size()
+            else:
+                self._disk_size += len(wav_bytes) + len(payload) - replaced
+            if self._disk_size > self.disk_bytes:
+                self._evict_disk()
+
+    def _scan_disk_size(self) -> int:
+        total = 0
+        for p in self.cache_dir.glob("*"):
+            try:
+                total += p.stat().st_size
+            except OSError:
+                pass
+        return total
+
+    def _evict_disk(self) -> None:
+        """Drop least-recently-used entries until the store is back under 90% of its budget."""
+        entries = []
+        for wav_path in self.cache_dir.glob("*.wav"):
+            json_path = wav_path.with_suffix(".json")
+            try:
+                st = wav_path.stat()
+                size = st.st_size + (json_path.stat().st_size if json_path.exists() else 0)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, size, wav_path, json_path))
+        entries.sort()
+
+        total = sum(e[1] for e in entries)
+        target = int(self.disk_bytes * 0.9)
+        for _, size, wav_path, json_path in entries:
+            if total <= target:
+                break
+            for p in (wav_path, json_path):
+                try:
+                    p.unlink()
+                except OSError:
+                    pass
+            total -= size
+            self.evictions_disk += 1
+        self._disk_size = total
+
+
+# one cache per process, shared by both servers
+speech_cache = SpeechCache()
@@ -0,0 +1,402 @@
+# tts_farm.py
+# TTS worker processes with per-session fair queuing
+# -------------------------------------------------------
+# pyttsx3/eSpeak engines can't be shared between threads, and espeak keeps
+# one process-wide state, so a single process synthesizes one text at a time
+# no matter how many threads ask. The farm runs TTS_PROCS processes, each
+# with its own tts_pool (pre-warmed engines, see tts_pool.py), and hands them
+# work from per-session queues:
+#
+#   fairness   sessions with queued texts take turns (round robin), so a
+#              chatty session can't push everyone else's audio back
+#   ordering   a session has at most one text on a worker at a time and its
+#              queue is FIFO, so its chunks finish in the order they came in
+#   restarts   a worker that dies (or hangs past TTS_JOB_TIMEOUT_S) is
+#              replaced; its text is retried once on the new process
+#   cancel     cancel(session_id) drops the session's queued texts and kills
+#              the worker on its current one (TTS_CANCEL_KILL=0: let that one
+#              finish and discard it); killed workers are replaced like dead ones
+#
+# TTS_PROCS=0 keeps the in-process tts_pool instead.
+# -------------------------------------------------------
+
+import os
+import time
+import queue
+import logging
+import threading
+import multiprocessing as mp
+from collections import OrderedDict, deque
+from concurrent.futures import CancelledError, Future
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional
+
+from metrics import SUBPROCESS_FAILURES
+from tts_pool import speaker_key
+
+log = logging.getLogger("tts_farm")
+
+TTS_PROCS = int(os.getenv("TTS_PROCS", str(min(4, os.cpu_count() or 1))))
+TTS_SESSION_QUEUE_MAX = int(os.getenv("TTS_SESSION_QUEUE_MAX", "32"))  # texts one session may have waiting
+TTS_JOB_TIMEOUT_S = float(os.getenv("TTS_JOB_TIMEOUT_S", "30"))        # longer than this -> worker is killed
+TTS_CANCEL_KILL = os.getenv("TTS_CANCEL_KILL", "1") != "0"
+TTS_RETRIES = 1
+TTS_RESTART_BACKOFF_S = 1.0                                            # doubles per failed start, up to 60 s
+DEFAULT_SESSION = "default"
+
+
+class TTSFarmFull(RuntimeError):
+    pass
+
+
+# ---------- worker process ----------
+def _worker_main(index: int, jobs: "mp.Queue", events: "mp.Queue") -> None:
+    """
+    One process, one tts_pool (FAKE_ENGINES comes along in the environment).
+    Messages in:  ("synth", job_id, text, speaker), ("stop",)
+    Messages out: ("ready", index, pid) | ("failed", index, error)
+                  ("done", index, job_id, wav, seconds) | ("error", index, job_id, message)
+    """
+    logging.basicConfig(level=logging.INFO, format=f"%(asctime)s [%(levelname)s] [tts-{index}] %(message)s")
+    from tts_pool import tts_pool
+
+    try:
+        tts_pool.start()
+    except Exception as e:
+        events.put(("failed", index, f"{type(e).__name__}: {e}"))
+        return
+    events.put(("ready", index, os.getpid()))
+
+    while True:
+        msg = jobs.get()
+        if msg[0] == "stop":
+            tts_pool.shutdown()
+            return
+        _, job_id, text, speaker = msg
+        t0 = time.time()
+        try:
+            wav = tts_pool.synthesize(text, speaker)
+        except Exception as e:
+            events.put(("error", index, job_id, f"{type(e).__name__}: {e}"))
+            continue
+        events.put(("done", index, job_id, wav, time.time() - t0))
+
+
+# ---------- dispatcher (server process) ----------
+@dataclass
+class _Job:
+    job_id: int
+    session_id: str
+    text: str
+    speaker: str
+    future: Future = field(default_factory=Future)
+    submitted_at: float = field(default_factory=time.time)
+    started_at: float = 0.0
+    attempts: int = 0
+
+
+def _drop(job: _Job) -> None:
+    # a retried job is already running as far as its Future knows
+    if not job.future.cancel() and not job.future.done():
+        job.future.set_exception(CancelledError())
+
+
+class _Worker:
+    def __init__(self, index: int):
+        self.index = index
+        self.process = None
+        self.jobs = None
+        self.pid: Optional[int] = None
+        self.ready = threading.Event()
+        self.error: Optional[str] = None
+        self.job: Optional[_Job] = None
+        self.completed = 0
+        self.restarts = 0
+        self.failed_starts = 0
+        self.spawned_at = 0.0
+
+    @property
+    def alive(self) -> bool:
+        return self.ready.is_set() and self.error is None and self.process is not None and self.process.is_alive()
+
+
+class TTSFarm:
+    """
+    Drop-in for tts_pool.TTSPool (start / submit / synthesize / queue_depths /
+    size / shutdown), plus session_id on submit, cancel(session_id) and stats().
+    """
+
+    def __init__(self, procs: int = TTS_PROCS, session_queue_max: int = TTS_SESSION_QUEUE_MAX,
+                 job_timeout: float = TTS_JOB_TIMEOUT_S):
+        self.procs = max(1, procs)
+        self.session_queue_max = session_queue_max
+        self.job_timeout = job_timeout
+        self._ctx = mp.get_context("spawn")  # fork would copy the parent's threads and engine state
+        self._events = self._ctx.Queue()
+        self._workers: List[_Worker] = [_Worker(i) for i in range(self.procs)]
+        self._pending: "OrderedDict[str, Deque[_Job]]" = OrderedDict()  # round-robin order of waiting sessions
+        self._running_sessions: set = set()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._started = False
+        self._stopped = False
+        self._reader: Optional[threading.Thread] = None
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.killed = 0
+        self.retried = 0
+        self.wait_total = 0.0
+        self.synth_total = 0.0
+
+    @property
+    def size(self) -> int:
+        return self.procs
+
+    # ---------- lifecycle ----------
+    def start(self, timeout: float = 60.0) -> "TTSFarm":
+        """Spawn the workers and wait until their engines are up; safe to call more than once."""
+        with self._start_lock:
+            if self._started:
+                return self
+            t0 = time.time()
+            for w in self._workers:
+                self._spawn(w)
+            self._reader = threading.Thread(target=self._read_loop, name="tts-farm-reader", daemon=True)
+            self._reader.start()
+            for w in self._workers:
+                w.ready.wait(max(0.0, timeout - (time.time() - t0)))
+            failed = [f"worker {w.index}: {w.error or 'timed out'}" for w in self._workers if not w.alive]
+            if len(failed) == self.procs:
+                self.shutdown()
+                raise RuntimeError(f"no TTS worker started ({'; '.join(failed)})")
+            for f in failed:
+                log.error("TTS %s", f)
+            self._started = True
+            log.info("TTS farm ready: %d processes in %.2fs", self.procs - len(failed), time.time() - t0)
+            return self
+
+    def shutdown(self) -> None:
+        self._stopped = True
+        with self._lock:
+            waiting = [j for q in self._pending.values() for j in q]
+            waiting += [w.job for w in self._workers if w.job is not None]
+            self._pending.clear()
+        for job in waiting:
+            _drop(job)
+        for w in self._workers:
+            if w.jobs is not None:
+                try:
+                    w.jobs.put(("stop",))
+                except (OSError, ValueError):
+                    pass
+        for w in self._workers:
+            if w.process is not None:
+                w.process.join(timeout=5)
+                if w.process.is_alive():
+                    w.process.terminate()
+
+    # ---------- public API ----------
+    def submit(self, text: str, speaker: str, session_id: Optional[str] = None) -> Future:
+        """Queue `text` behind the session's earlier texts; the Future resolves to raw WAV bytes."""
+        if not self._started:
+            self.start()
+        session_id = session_id or DEFAULT_SESSION
+        with self._lock:
+            waiting = self._pending.get(session_id)
+            if waiting is not None and len(waiting) >= self.session_queue_max:
+                raise TTSFarmFull(f"session {session_id} has {len(waiting)} texts waiting for TTS")
+            job = _Job(self._next_id, session_id, text, speaker_key(speaker))
+            self._next_id += 1
+            self._pending.setdefault(session_id, deque()).append(job)
+            self._dispatch()
+        return job.future
+
+    def synthesize(self, text: str, speaker: str, session_id: Optional[str] = None) -> bytes:
+        return self.submit(text, speaker, session_id).result()
+
+    def cancel(self, session_id: str, kill_running: bool = TTS_CANCEL_KILL) -> Dict[str, int]:
+        """Drop the session's queued texts and abort the one on a worker; returns how many of each."""
+        with self._lock:
+            jobs = list(self._pending.pop(session_id, None) or ())
+            queued = len(jobs)
+            killed = [w for w in self._workers if w.job is not None and w.job.session_id == session_id] if kill_running else []
+            for w in killed:
+                jobs.append(self._release(w))
+                w.error = "killed by cancel"  # not a crash: _check_workers just replaces it
+            self.cancelled += len(jobs)
+            self.killed += len(killed)
+        for w in killed:
+            w.process.kill()
+        for job in jobs:
+            _drop(job)
+        return {"queued": queued, "running": len(killed)}
+
+    def queue_depths(self) -> Dict[str, int]:
+        with self._lock:
+            depths: Dict[str, int] = {}
+            for q in self._pending.values():
+                for job in q:
+                    depths[job.speaker] = depths.get(job.speaker, 0) + 1
+            return depths
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "procs": self.procs,
+                "alive": sum(1 for w in self._workers if w.alive),
+                "queued": sum(len(q) for q in self._pending.values()),
+                "sessions_waiting": len(self._pending),
+                "running": sum(1 for w in self._workers if w.job is not None),
+                "completed": self.completed,
+                "failed": self.failed,
+                "cancelled": self.cancelled,
+                "killed": self.killed,
+                "retried": self.retried,
+                "avg_wait_s": round(self.wait_total / self.completed, 4) if self.completed else 0.0,
+                "avg_synth_s": round(self.synth_total / self.completed, 4) if self.completed else 0.0,
+                "per_worker": [{
+                    "pid": w.pid,
+                    "alive": w.alive,
+                    "busy": w.job is not None,
+                    "completed": w.completed,
+                    "restarts": w.restarts,
+                    "error": w.error,
+                } for w in self._workers],
+            }
+
+    # ---------- internals ----------
+    def _spawn(self, w: _Worker) -> None:
+        w.jobs = self._ctx.Queue()
+        w.process = self._ctx.Process(target=_worker_main, name=f"tts-worker-{w.index}", daemon=True,
+                                      args=(w.index, w.jobs, self._events))
+        w.ready.clear()
+        w.error = None
+        w.pid = None
+        w.spawned_at = time.time()
+        w.process.start()
+
+    def _dispatch(self) -> None:
+        """Give every idle worker the next text in round-robin session order (caller holds the lock)."""
+        for w in self._workers:
+            if w.job is not None or not w.alive:
+                continue
+            job = self._next_job()
+            if job is None:
+                return
+            w.job = job
+            job.started_at = time.time()
+            self._running_sessions.add(job.session_id)
+            w.jobs.put(("synth", job.job_id, job.text, job.speaker))
+
+    def _next_job(self) -> Optional[_Job]:
+        for session_id in list(self._pending):
+            if session_id in self._running_sessions:
+                continue  # its previous text is still on a worker: keep its order
+            waiting = self._pending.pop(session_id)
+            job = waiting.popleft()
+            if waiting:
+                self._pending[session_id] = waiting  # back of the line
+            if job.attempts or job.future.set_running_or_notify_cancel():
+                return job
+            self.cancelled += 1
+        return None
+
+    def _release(self, w: _Worker, job_id: Optional[int] = None) -> Optional[_Job]:
+        """Take the worker's current job off it (caller holds the lock)."""
+        job = w.job
+        if job is None or (job_id is not None and job.job_id != job_id):
+            return None
+        w.job = None
+        self._running_sessions.discard(job.session_id)
+        return job
+
+    def _read_loop(self) -> None:
+        while not self._stopped:
+            try:
+                msg = self._events.get(timeout=0.5)
+            except queue.Empty:
+                msg = None
+            except (EOFError, OSError):
+                return
+            if msg is not None:
+                self._handle(msg)
+            self._check_workers()
+
+    def _handle(self, msg) -> None:
+        kind = msg[0]
+        w = self._workers[msg[1]]
+        if kind in ("done", "error"):
+            with self._lock:
+                job = self._release(w, msg[2])
+                if job is not None and kind == "done":
+                    w.completed += 1
+                    self.completed += 1
+                    self.wait_total += job.started_at - job.submitted_at
+                    self.synth_total += msg[4]
+                elif job is not None:
+                    self.failed += 1
+                self._dispatch()
+            if job is None:
+                return
+            if kind == "done":
+                job.future.set_result(msg[3])
+            else:
+                job.future.set_exception(RuntimeError(msg[3]))
+        elif kind == "ready":
+            with self._lock:
+                w.pid = msg[2]
+                w.failed_starts = 0
+                w.ready.set()
+                self._dispatch()
+        elif kind == "failed":
+            w.error = msg[2]
+            w.failed_starts += 1
+            w.ready.set()
+            SUBPROCESS_FAILURES.inc(tool="tts", reason="start_failed")
+            log.error("TTS worker %d failed to start: %s", w.index, w.error)
+
+    def _check_workers(self) -> None:
+        """Kill hung workers, replace dead ones and retry (or fail) the text they were on."""
+        now = time.time()
+        for w in self._workers:
+            if self._stopped or w.process is None:
+                return
+            job = w.job
+            if job is not None and now - job.started_at > self.job_timeout and w.process.is_alive():
+                log.error("TTS worker %d (pid %s) stuck %.0fs on %r; killing it", w.index, w.pid, now - job.started_at, job.text[:40])
+                SUBPROCESS_FAILURES.inc(tool="tts", reason="timeout")
+                w.process.kill()
+                w.process.join()
+            if w.process.is_alive():
+                continue
+            if w.error is None:
+                w.error = f"exited with code {w.process.exitcode}"
+                if not w.ready.is_set():
+                    w.failed_starts += 1
+                    w.ready.set()
+                SUBPROCESS_FAILURES.inc(tool="tts", reason="crashed")
+                log.error("TTS worker %d (pid %s) %s", w.index, w.pid, w.error)
+            self._requeue(w)
+            backoff = min(60.0, TTS_RESTART_BACKOFF_S * 2 ** w.failed_starts)
+            if now - w.spawned_at >= backoff:
+                w.restarts += 1
+                log.info("Restarting TTS worker %d", w.index)
+                self._spawn(w)
+
+    def _requeue(self, w: _Worker) -> None:
+        with self._lock:
+            job = self._release(w)
+            if job is None:
+                return
+            job.attempts += 1
+            if job.attempts > TTS_RETRIES:
+                self.failed += 1
+            else:
+                # front of its own queue, so the session's order holds
+                self.retried += 1
+                self._pending.setdefault(job.session_id, deque()).appendleft(job)
+                self._dispatch()
+                return
+        job.future.set_exception(RuntimeError(f"TTS worker {w.index} {w.error} on this text"))
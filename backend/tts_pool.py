@@ -0,0 +1,250 @@
+# tts_pool.py
+# Pre-warmed pyttsx3 workers with voice profiles resolved once at startup
+# -------------------------------------------------------
+# pyttsx3.init() + voice enumeration + "zira"/"david" string matching used to
+# run on every utterance. Here each character voice gets one or more long-lived
+# worker threads that own their own engine (created inside the thread, as SAPI
+# COM objects require) with voice and rate already applied. A request only pays
+# for save_to_file + runAndWait.
+# -------------------------------------------------------
+
+import os
+import time
+import queue
+import logging
+import tempfile
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from engines import fake_enabled
+from models import model_registry
+
+log = logging.getLogger("tts_pool")
+
+TTS_RATE = 135
+TTS_ENGINE = "fake-sine" if fake_enabled("tts") else "pyttsx3"  # speech-cache key part
+TTS_WORKERS_PER_VOICE = int(os.getenv("TTS_WORKERS_PER_VOICE", "1"))
+
+# character -> substrings to look for in voice name/id, in order of preference
+VOICE_HINTS: Dict[str, List[str]] = {
+    "tessa": ["zira", "hazel", "female"],
+    "hardin": ["david", "male"],
+}
+SPEAKER_ALIASES = {"female": "tessa", "alice": "tessa", "male": "hardin"}
+DEFAULT_SPEAKER = "tessa"
+
+# Only SAPI gives every engine its own synthesizer; espeak/nsss keep one
+# process-wide state, so their workers take turns and re-apply their voice.
+_SHARED_DRIVER_LOCK = threading.Lock()
+_shared_driver_voice: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class VoiceProfile:
+    speaker: str
+    voice_id: Optional[str]  # None -> engine default
+    rate: int
+
+
+def speaker_key(name: str) -> str:
+    key = (name or "").strip().lower()
+    key = SPEAKER_ALIASES.get(key, key)
+    return key if key in VOICE_HINTS else DEFAULT_SPEAKER
+
+
+def _new_engine():
+    from pyttsx3.engine import Engine  # a fresh instance; pyttsx3.init() would hand back a shared one
+    return Engine()
+
+
+def _com_init():
+    if os.name == "nt":
+        import pythoncom
+        pythoncom.CoInitialize()
+
+
+def _com_uninit():
+    if os.name == "nt":
+        try:
+            import pythoncom
+            pythoncom.CoUninitialize()
+        except Exception:
+            pass
+
+
+def _match_voice(voices, hints: List[str], exclude: List[str]) -> Optional[str]:
+    for hint in hints:
+        for voice in voices:
+            label = f"{voice.name or ''} {voice.id or ''}".lower()
+            if hint in label and not any(x in label for x in exclude):
+                return voice.id
+    return None
+
+
+def resolve_voice_profiles(rate: int = TTS_RATE) -> Dict[str, VoiceProfile]:
+    """Enumerate installed voices once and pick one per character."""
+    result: Dict[str, VoiceProfile] = {}
+    errors: List[BaseException] = []
+
+    def probe():
+        _com_init()
+        try:
+            voices = _new_engine().getProperty("voices")
+            female_hints = VOICE_HINTS["tessa"]
+            for speaker, hints in VOICE_HINTS.items():
+                # "female" contains "male": don't let hardin's "male" hint match a female voice
+                exclude = female_hints if speaker != "tessa" else []
+                result[speaker] = VoiceProfile(speaker, _match_voice(voices, hints, exclude), rate)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            _com_uninit()
+
+    t = threading.Thread(target=probe, name="tts-probe", daemon=True)
+    t.start()
+    t.join()
+    if errors:
+        raise RuntimeError(f"TTS voice probe failed: {errors[0]}") from errors[0]
+    for p in result.values():
+        log.info("TTS voice for %s: %s", p.speaker, p.voice_id or "<engine default>")
+    return result
+
+
+class TTSWorker(threading.Thread):
+    def __init__(self, profile: VoiceProfile, jobs: "queue.Queue", index: int):
+        super().__init__(name=f"tts-{profile.speaker}-{index}", daemon=True)
+        self.profile = profile
+        self.jobs = jobs
+        self.ready = threading.Event()
+        self.error: Optional[BaseException] = None
+        self.engine = None
+        self.shared_driver = os.name != "nt"
+
+    def run(self):
+        _com_init()
+        try:
+            self.engine = _new_engine()
+            self.engine.setProperty("rate", self.profile.rate)
+            if self.profile.voice_id:
+                self.engine.setProperty("voice", self.profile.voice_id)
+        except BaseException as e:
+            self.error = e
+            self.ready.set()
+            _com_uninit()
+            return
+        self.ready.set()
+
+        try:
+            while True:
+                job = self.jobs.get()
+                if job is None:
+                    break
+                text, fut = job
+                if not fut.set_running_or_notify_cancel():
+                    continue
+                try:
+                    fut.set_result(self._synthesize(text))
+                except BaseException as e:
+                    fut.set_exception(e)
+        finally:
+            _com_uninit()
+
+    def _synthesize(self, text: str) -> bytes:
+        global _shared_driver_voice
+        fd, tmp_path = tempfile.mkstemp(suffix=".wav")
+        os.close(fd)
+        try:
+            t0 = time.time()
+            if self.shared_driver:
+                with _SHARED_DRIVER_LOCK:
+                    if _shared_driver_voice != self.profile.voice_id:
+                        if self.profile.voice_id:
+                            self.engine.setProperty("voice", self.profile.voice_id)
+                        _shared_driver_voice = self.profile.voice_id
+                    self.engine.save_to_file(text, tmp_path)
+                    self.engine.runAndWait()
+            else:
+                self.engine.save_to_file(text, tmp_path)
+                self.engine.runAndWait()
+            with open(tmp_path, "rb") as f:
+                data = f.read()
+            log.info("TTS %s: %d chars -> %d bytes in %.2fs", self.name, len(text), len(data), time.time() - t0)
+            return data
+        finally:
+            try:
+                if os.getenv("DEBUG_TTS") == "1":
+                    log.info("DEBUG_TTS=1 -> keeping tmp wav: %s", tmp_path)
+                else:
+                    os.remove(tmp_path)
+            except OSError:
+                pass
+
+
+class TTSPool:
+    def __init__(self, workers_per_voice: int = TTS_WORKERS_PER_VOICE, rate: int = TTS_RATE):
+        self.workers_per_voice = max(1, workers_per_voice)
+        self.rate = rate
+        self.profiles: Dict[str, VoiceProfile] = {}
+        self._queues: Dict[str, "queue.Queue"] = {}
+        self._workers: List[TTSWorker] = []
+        self._start_lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        return self.workers_per_voice * len(VOICE_HINTS)
+
+    def start(self, timeout: float = 30.0) -> "TTSPool":
+        """Resolve voices and spin up every worker; safe to call more than once."""
+        with self._start_lock:
+            if self._workers:
+                return self
+            t0 = time.time()
+            self.profiles = resolve_voice_profiles(self.rate)
+            for speaker, profile in self.profiles.items():
+                jobs: "queue.Queue" = queue.Queue()
+                self._queues[speaker] = jobs
+                for i in range(self.workers_per_voice):
+                    worker = TTSWorker(profile, jobs, i)
+                    worker.start()
+                    self._workers.append(worker)
+            for worker in self._workers:
+                worker.ready.wait(timeout)
+                if worker.error is not None:
+                    raise RuntimeError(f"TTS worker {worker.name} failed to start: {worker.error}") from worker.error
+            log.info("TTS pool ready: %d workers in %.2fs", len(self._workers), time.time() - t0)
+            return self
+
+    def submit(self, text: str, speaker: str, session_id: Optional[str] = None) -> Future:
+        """
+        Queue `text` for the speaker's voice; the Future resolves to raw WAV bytes.
+        session_id is accepted for tts_farm.TTSFarm compatibility; here each
+        voice is one FIFO queue.
+        """
+        if not self._workers:
+            self.start()
+        fut: Future = Future()
+        self._queues[speaker_key(speaker)].put((text, fut))
+        return fut
+
+    def synthesize(self, text: str, speaker: str, session_id: Optional[str] = None) -> bytes:
+        return self.submit(text, speaker).result()
+
+    def queue_depths(self) -> Dict[str, int]:
+        return {speaker: q.qsize() for speaker, q in self._queues.items()}
+
+    def shutdown(self) -> None:
+        for speaker, q in self._queues.items():
+            for _ in range(self.workers_per_voice):
+                q.put(None)
+
+
+# one pool per process, shared by both servers
+if fake_enabled("tts"):
+    from bench.fakes import FakeTTSPool
+    tts_pool = FakeTTSPool()
+else:
+    tts_pool = TTSPool()
+
+model_registry.register("tts", tts_pool.start)
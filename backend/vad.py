@@ -0,0 +1,216 @@
+# vad.py
+# NumPy energy + zero-crossing voice activity detection
+# -------------------------------------------------------
+# Two jobs, one set of frame features (VAD_FRAME_S frames, all frames of a
+# block computed at once: RMS in dBFS and zero-crossing rate):
+#
+#   SpeechGate   STT input, streamed: drops leading silence, shortens pauses
+#                to VAD_MAX_PAUSE_S, drops trailing silence and reports an
+#                endpoint after VAD_ENDPOINT_S of silence, so Kaldi only
+#                decodes speech (plus VAD_PAD_S of context around it)
+#   tts_span     TTS output, whole clip: cuts the engine's leading/trailing
+#                padding before lipsync, caching and playback, inside
+#                to_pcm16_mono's conversion (trim_wav for WAVs kept as is)
+#
+# A frame is speech when it is VAD_MARGIN_DB above the noise floor (the
+# quietest frames so far) and above VAD_THRESHOLD_DB, or when it is up to
+# VAD_ZCR_SLACK_DB quieter than that but crosses zero often, which is how
+# unvoiced consonants ("s", "f", "th") look at word edges.
+#
+# VAD=0 turns both off; trimmed seconds go to tessa_vad_trimmed_seconds.
+# -------------------------------------------------------
+
+import os
+import logging
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from audio_utils import WAVE_FORMAT_PCM, parse_wav, pcm_to_float, downmix, wrap_wav, speech_span
+from metrics import counter, histogram
+
+log = logging.getLogger("vad")
+
+VAD_ENABLED = os.getenv("VAD", "1") != "0"
+VAD_FRAME_S = 0.02
+VAD_THRESHOLD_DB = float(os.getenv("VAD_THRESHOLD_DB", "-50"))  # never call anything quieter speech
+VAD_MARGIN_DB = float(os.getenv("VAD_MARGIN_DB", "12"))          # speech vs noise floor
+VAD_ZCR = 0.25                                                   # zero crossings per sample: fricative-like
+VAD_ZCR_SLACK_DB = 6.0                                           # < VAD_MARGIN_DB: broadband noise is high-ZCR too
+VAD_PAD_S = float(os.getenv("VAD_PAD_S", "0.2"))                 # context kept around speech (STT)
+VAD_MAX_PAUSE_S = float(os.getenv("VAD_MAX_PAUSE_S", "0.4"))     # longer pauses are shortened to this
+VAD_ENDPOINT_S = float(os.getenv("VAD_ENDPOINT_S", "0.8"))       # silence that ends an utterance
+VAD_NOISE_EWMA = 0.05
+TTS_TRIM_PAD_S = float(os.getenv("TTS_TRIM_PAD_S", "0.04"))      # TTS tails are clean: keep little
+TTS_TRIM_PEAK_DB = 45.0                                          # TTS silence: this far below the clip peak
+
+# goes into speech-cache keys, so trimmed and untrimmed audio never mix
+VAD_TAG = "+vad" if VAD_ENABLED else ""
+
+SILENCE_DB = -100.0
+
+VAD_TRIMMED_SECONDS = histogram("tessa_vad_trimmed_seconds", "Audio removed by the VAD per upload or TTS chunk.", ["kind"],
+                                (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0))
+VAD_AUDIO_SECONDS = counter("tessa_vad_audio_seconds_total", "Audio seen by the VAD.", ["kind", "part"])
+
+
+def frame_features(x: np.ndarray, frame: int) -> Tuple[np.ndarray, np.ndarray]:
+    """(dBFS, zero-crossing rate) of each whole frame of float samples in [-1, 1]."""
+    n = x.size // frame
+    frames = x[: n * frame].reshape(n, frame)
+    power = np.mean(frames * frames, axis=1)
+    db = np.where(power > 0, 10.0 * np.log10(np.maximum(power, 1e-20)), SILENCE_DB)
+    signs = np.signbit(frames)
+    zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / float(frame)
+    return db, zcr
+
+
+def speech_frames(db: np.ndarray, zcr: np.ndarray, threshold_db: float) -> np.ndarray:
+    return (db > threshold_db) | ((db > threshold_db - VAD_ZCR_SLACK_DB) & (zcr > VAD_ZCR))
+
+
+@dataclass
+class GateStats:
+    seconds_in: float = 0.0
+    seconds_out: float = 0.0
+    endpoints: int = 0
+
+    @property
+    def trimmed(self) -> float:
+        return max(0.0, self.seconds_in - self.seconds_out)
+
+
+class SpeechGate:
+    """
+    Streaming gate in front of a recognizer, for s16le mono PCM.
+
+    feed(pcm) returns [(pcm to recognize, endpoint), ...]: endpoint is True
+    when the utterance ends in silence right after that piece. finish() drops
+    whatever silence is still held back. Not thread-safe: one gate per stream.
+    """
+
+    def __init__(self, sample_rate: int, enabled: bool = VAD_ENABLED):
+        self.sample_rate = sample_rate
+        self.enabled = enabled
+        self.frame = max(1, int(sample_rate * VAD_FRAME_S))
+        self.frame_bytes = self.frame * 2
+        self.pad_frames = max(1, round(VAD_PAD_S / VAD_FRAME_S))
+        self.pause_frames = max(self.pad_frames, round(VAD_MAX_PAUSE_S / VAD_FRAME_S))
+        self.endpoint_frames = max(self.pause_frames, round(VAD_ENDPOINT_S / VAD_FRAME_S))
+        self.noise_db: Optional[float] = None
+        self.stats = GateStats()
+        self._rest = b""
+        self._in_speech = False
+        self._held: List[bytes] = []  # silent frames: the pre-roll before speech, or the current pause
+
+    def feed(self, pcm: bytes) -> List[Tuple[bytes, bool]]:
+        if not self.enabled:
+            seconds = len(pcm) / 2 / self.sample_rate
+            self.stats.seconds_in += seconds
+            self.stats.seconds_out += seconds
+            return [(pcm, False)] if pcm else []
+        data = self._rest + pcm
+        usable = len(data) - len(data) % self.frame_bytes
+        self._rest = data[usable:]
+        if not usable:
+            return []
+        x = np.frombuffer(data[:usable], dtype="<i2").astype(np.float32) / 32768.0
+        db, zcr = frame_features(x, self.frame)
+        # noise floor: the block's quietest frames, followed down at once and up slowly
+        floor = float(np.percentile(db, 10))
+        if self.noise_db is None:
+            self.noise_db = min(floor, VAD_THRESHOLD_DB)  # a stream may open mid-word
+        elif floor < self.noise_db:
+            self.noise_db = floor
+        else:
+            self.noise_db += VAD_NOISE_EWMA * (floor - self.noise_db)
+        speech = speech_frames(db, zcr, self.threshold_db())
+
+        pieces: List[Tuple[bytes, bool]] = []
+        out: List[bytes] = []
+        for i, is_speech in enumerate(speech):
+            frame = data[i * self.frame_bytes:(i + 1) * self.frame_bytes]
+            if is_speech:
+                if self._held:
+                    # pre-roll or a pause inside the utterance: keep at most pad / max pause of it
+                    keep = self.pad_frames if not self._in_speech else self.pause_frames
+                    out.extend(self._held[-keep:])
+                    self._held.clear()
+                self._in_speech = True
+                out.append(frame)
+                continue
+            self._held.append(frame)
+            if self._in_speech and len(self._held) >= self.endpoint_frames:
+                out.extend(self._held[: self.pad_frames])  # trailing context, then the utterance is over
+                self._held.clear()
+                self._in_speech = False
+                self.stats.endpoints += 1
+                pieces.append((b"".join(out), True))
+                out = []
+            elif not self._in_speech and len(self._held) > self.pad_frames:
+                del self._held[: len(self._held) - self.pad_frames]
+
+        if out:
+            pieces.append((b"".join(out), False))
+        self.stats.seconds_in += usable / 2 / self.sample_rate
+        self.stats.seconds_out += sum(len(b) for b, _ in pieces) / 2 / self.sample_rate
+        return pieces
+
+    def threshold_db(self) -> float:
+        return max(VAD_THRESHOLD_DB, (self.noise_db if self.noise_db is not None else SILENCE_DB) + VAD_MARGIN_DB)
+
+    def finish(self) -> bytes:
+        """End of stream: trailing context after the last speech, if any; records the totals."""
+        tail = b"".join(self._held[: self.pad_frames]) if self._in_speech else b""
+        self.stats.seconds_in += len(self._rest) / 2 / self.sample_rate
+        self.stats.seconds_out += len(tail) / 2 / self.sample_rate
+        self._held.clear()
+        self._rest = b""
+        self._in_speech = False
+        VAD_TRIMMED_SECONDS.observe(self.stats.trimmed, kind="stt")
+        VAD_AUDIO_SECONDS.inc(self.stats.seconds_out, kind="stt", part="kept")
+        VAD_AUDIO_SECONDS.inc(self.stats.trimmed, kind="stt", part="trimmed")
+        return tail
+
+
+def tts_span(x: np.ndarray, sample_rate: int, pad_s: float = TTS_TRIM_PAD_S) -> Tuple[int, int]:
+    """
+    Sample range of a synthesized chunk without its leading/trailing dead air,
+    (0, len) when there is nothing worth cutting. Fits to_pcm16_mono(trim=...).
+    """
+    hop = max(1, int(sample_rate * VAD_FRAME_S / 2))  # finer frames: cuts land closer to the speech
+    db, zcr = frame_features(x, hop)
+    if db.size == 0:
+        return 0, x.size
+    threshold = max(VAD_THRESHOLD_DB, float(db.max()) - TTS_TRIM_PEAK_DB)
+    start, end = speech_span(speech_frames(db, zcr, threshold), hop, int(pad_s * sample_rate), x.size)
+    if start == 0 and end >= x.size - hop:
+        return 0, x.size
+    trimmed = (x.size - (end - start)) / sample_rate
+    VAD_TRIMMED_SECONDS.observe(trimmed, kind="tts")
+    VAD_AUDIO_SECONDS.inc((end - start) / sample_rate, kind="tts", part="kept")
+    VAD_AUDIO_SECONDS.inc(trimmed, kind="tts", part="trimmed")
+    return start, end
+
+
+def trim_wav(wav_bytes: bytes, pad_s: float = TTS_TRIM_PAD_S, enabled: bool = VAD_ENABLED) -> Tuple[bytes, float]:
+    """
+    (WAV without leading/trailing dead air, seconds removed) for a synthesized
+    chunk. Non-PCM, unparsable or all-silent input comes back unchanged.
+    """
+    if not enabled or not wav_bytes:
+        return wav_bytes, 0.0
+    try:
+        info, frames = parse_wav(wav_bytes)
+    except ValueError:
+        return wav_bytes, 0.0
+    if info.format_tag != WAVE_FORMAT_PCM:
+        return wav_bytes, 0.0
+    x = downmix(pcm_to_float(frames, info.sample_width, info.channels, info.format_tag))
+    start, end = tts_span(x, info.sample_rate, pad_s)
+    if (start, end) == (0, x.size):
+        return wav_bytes, 0.0
+    fb = info.frame_bytes
+    trimmed = (x.size - (end - start)) / info.sample_rate
+    return wrap_wav(frames[start * fb:end * fb], info.sample_rate, info.channels, info.sample_width), trimmed
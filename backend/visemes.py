@@ -0,0 +1,340 @@
+# visemes.py
+# In-process text + energy lipsync, an alternative to running Rhubarb
+# -------------------------------------------------------
+# We already know the exact text every chunk was synthesized from, so instead
+# of recognizing phones from audio:
+#   1. text -> phonemes: eSpeak's English word list (eSpeak/dictsource/en_list),
+#      then Rhubarb's bundled CMU dictionary, then a letter-group fallback
+#   2. phonemes -> Rhubarb mouth shapes (A-H, X) with relative durations
+#   3. a vectorized NumPy RMS envelope of the WAV gives the speech segments;
+#      the phoneme timeline is stretched over them, pauses become X and quiet
+#      vowels are drawn less open
+# Output uses Rhubarb's JSON schema ({"metadata", "mouthCues"}), so clients
+# can't tell the two apart. A chunk takes a few milliseconds.
+# -------------------------------------------------------
+
+import re
+import time
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from audio_utils import read_wav
+
+log = logging.getLogger("visemes")
+
+ESPEAK_LIST = Path("eSpeak") / "dictsource" / "en_list"
+CMUDICT_PATH = Path("bin") / "res" / "sphinx" / "cmudict-en-us.dict"
+
+FRAME_S = 0.01        # envelope hop; Rhubarb also reports 10 ms steps
+MIN_PAUSE_S = 0.2    # quieter stretches shorter than this stay inside a word
+MIN_BURST_S = 0.03    # louder blips shorter than this are noise
+MIN_CUE_S = 0.04      # shorter cues are folded into the previous one
+VOWEL_WEIGHT = 1.8    # vowel vs consonant share of the speech time
+STOP_WEIGHT = 0.8
+
+# phoneme -> (mouth shapes, is_vowel); a multi-letter shape string is a glide
+# split evenly over the phoneme (e.g. AY = "DB": wide open, then teeth). H is
+# Rhubarb's shape for long L sounds only, so a plain L is drawn as B.
+ARPABET_SHAPES: Dict[str, Tuple[str, bool]] = {
+    "AA": ("D", True), "AE": ("C", True), "AH": ("C", True), "AO": ("E", True),
+    "AW": ("DF", True), "AY": ("DB", True), "EH": ("C", True), "ER": ("E", True),
+    "EY": ("CB", True), "IH": ("B", True), "IY": ("B", True), "OW": ("EF", True),
+    "OY": ("EB", True), "UH": ("F", True), "UW": ("F", True),
+    "B": ("A", False), "M": ("A", False), "P": ("A", False),
+    "F": ("G", False), "V": ("G", False),
+    "L": ("B", False), "W": ("F", False),
+    "CH": ("B", False), "D": ("B", False), "DH": ("B", False), "G": ("B", False),
+    "HH": ("B", False), "JH": ("B", False), "K": ("B", False), "N": ("B", False),
+    "NG": ("B", False), "R": ("B", False), "S": ("B", False), "SH": ("B", False),
+    "T": ("B", False), "TH": ("B", False), "Y": ("B", False), "Z": ("B", False),
+    "ZH": ("B", False),
+}
+
+# eSpeak English phoneme mnemonics -> ARPAbet
+ESPEAK_TO_ARPABET: Dict[str, str] = {
+    "@": "AH", "@L": "L", "3": "ER", "3:": "ER", "VR": "ER", "IR": "ER",
+    "a": "AE", "a#": "AH", "A:": "AA", "A@": "AA", "aa": "AA", "V": "AH",
+    "aI": "AY", "aI@": "AY", "aI3": "AY", "aU": "AW", "aU@": "AW",
+    "e": "EH", "E": "EH", "e@": "EH", "eI": "EY",
+    "i": "IY", "i:": "IY", "i@": "IY", "I": "IH", "I#": "IH",
+    "0": "AA", "O:": "AO", "O@": "AO", "o@": "AO", "oU": "OW", "OI": "OY",
+    "u:": "UW", "U": "UH", "U@": "UH",
+    "p": "P", "b": "B", "t": "T", "d": "D", "k": "K", "g": "G",
+    "f": "F", "v": "V", "T": "TH", "D": "DH", "s": "S", "z": "Z",
+    "S": "SH", "Z": "ZH", "h": "HH", "m": "M", "n": "N", "N": "NG",
+    "l": "L", "r": "R", "j": "Y", "w": "W", "tS": "CH", "dZ": "JH", "x": "K",
+}
+_ESPEAK_KEYS = sorted(ESPEAK_TO_ARPABET, key=len, reverse=True)
+_ESPEAK_VARIANT = set("123456789#/-:")  # suffixes like t2, l/2, r-: same mouth shape
+
+# spelling fallback for words in neither dictionary; longest groups first
+LETTER_GROUPS: List[Tuple[str, List[str]]] = [
+    ("tion", ["SH", "AH", "N"]), ("ight", ["AY", "T"]), ("ough", ["AO"]),
+    ("th", ["TH"]), ("sh", ["SH"]), ("ch", ["CH"]), ("ph", ["F"]), ("wh", ["W"]),
+    ("ng", ["NG"]), ("ck", ["K"]), ("qu", ["K", "W"]),
+    ("oo", ["UW"]), ("ee", ["IY"]), ("ea", ["IY"]), ("ou", ["AW"]), ("ow", ["OW"]),
+    ("ai", ["EY"]), ("ay", ["EY"]), ("oa", ["OW"]), ("oi", ["OY"]), ("oy", ["OY"]),
+    ("er", ["ER"]), ("ir", ["ER"]), ("ur", ["ER"]), ("ar", ["AA", "R"]), ("or", ["AO", "R"]),
+    ("a", ["AE"]), ("e", ["EH"]), ("i", ["IH"]), ("o", ["AA"]), ("u", ["AH"]), ("y", ["IY"]),
+    ("b", ["B"]), ("c", ["K"]), ("d", ["D"]), ("f", ["F"]), ("g", ["G"]), ("h", ["HH"]),
+    ("j", ["JH"]), ("k", ["K"]), ("l", ["L"]), ("m", ["M"]), ("n", ["N"]), ("p", ["P"]),
+    ("q", ["K"]), ("r", ["R"]), ("s", ["S"]), ("t", ["T"]), ("v", ["V"]), ("w", ["W"]),
+    ("x", ["K", "S"]), ("z", ["Z"]),
+]
+
+WORD_RE = re.compile(r"[a-z]+(?:'[a-z]+)?")
+STOPS = {"P", "B", "T", "D", "K", "G"}
+
+
+def espeak_to_arpabet(phonemes: str) -> List[str]:
+    """Tokenize an eSpeak phoneme string (e.g. "h@l'oU") into ARPAbet symbols."""
+    out: List[str] = []
+    i = 0
+    while i < len(phonemes):
+        for key in _ESPEAK_KEYS:
+            if phonemes.startswith(key, i):
+                out.append(ESPEAK_TO_ARPABET[key])
+                i += len(key)
+                break
+        else:
+            # stress marks, variant digits and anything we don't model
+            i += 1
+            continue
+        while i < len(phonemes) and phonemes[i] in _ESPEAK_VARIANT:
+            i += 1
+    return out
+
+
+def spell_to_arpabet(word: str) -> List[str]:
+    if len(word) > 2 and word.endswith("e") and not word.endswith("ee"):
+        word = word[:-1]  # silent final e
+    out: List[str] = []
+    i = 0
+    while i < len(word):
+        for group, phones in LETTER_GROUPS:
+            if word.startswith(group, i):
+                out.extend(phones)
+                i += len(group)
+                break
+        else:
+            i += 1
+    return out
+
+
+def load_espeak_list(path: Path) -> Dict[str, List[str]]:
+    words: Dict[str, List[str]] = {}
+    with open(path, encoding="utf-8-sig", errors="replace") as f:
+        for line in f:
+            line = line.split("//", 1)[0].strip()
+            if not line or line[0] in "?(_$":
+                continue  # conditional variants, multi-word entries, letter names
+            parts = line.split()
+            if len(parts) < 2 or parts[1].startswith("$"):
+                continue  # flags only: pronunciation comes from en_rules
+            word = parts[0].lower()
+            if word not in words:
+                phones = espeak_to_arpabet(parts[1])
+                if phones:
+                    words[word] = phones
+    return words
+
+
+def load_cmudict(path: Path) -> Dict[str, List[str]]:
+    words: Dict[str, List[str]] = {}
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) < 2 or "(" in parts[0]:
+                continue  # alternate pronunciations: keep the first one
+            words[parts[0]] = [re.sub(r"\d", "", p) for p in parts[1:]]
+    return words
+
+
+def energy_envelope(samples: np.ndarray, sample_rate: int, frame_s: float = FRAME_S) -> np.ndarray:
+    """RMS per frame_s frame (the tail shorter than one frame is dropped)."""
+    hop = max(1, int(sample_rate * frame_s))
+    n = len(samples) // hop
+    if n == 0:
+        return np.zeros(0, dtype=np.float32)
+    frames = samples[: n * hop].reshape(n, hop)
+    return np.sqrt(np.mean(frames * frames, axis=1))
+
+
+def _runs(mask: np.ndarray) -> np.ndarray:
+    """[start, end) frame pairs of the True runs in mask."""
+    padded = np.concatenate(([False], mask, [False]))
+    edges = np.flatnonzero(padded[1:] != padded[:-1])
+    return edges.reshape(-1, 2)
+
+
+def speech_segments(env: np.ndarray) -> np.ndarray:
+    """[start, end) frame pairs where the envelope says someone is talking."""
+    if env.size == 0:
+        return np.zeros((0, 2), dtype=np.int64)
+    smooth = np.convolve(env, np.ones(3) / 3.0, mode="same")
+    floor, peak = np.percentile(smooth, 10), np.percentile(smooth, 98)
+    active = smooth > max(floor + 0.06 * (peak - floor), 1e-4)
+
+    # bridge short dips (stop closures, word joins), then drop short blips
+    for start, end in _runs(~active):
+        if start > 0 and end < active.size and (end - start) * FRAME_S < MIN_PAUSE_S:
+            active[start:end] = True
+    for start, end in _runs(active):
+        if (end - start) * FRAME_S < MIN_BURST_S:
+            active[start:end] = False
+    return _runs(active)
+
+
+class TextVisemeGenerator:
+    """
+    generate(wav_bytes, text) -> Rhubarb-style lipsync JSON.
+
+    Dictionaries load on first use (the CMU one takes a moment); call
+    warm() at startup to pay that up front.
+    """
+
+    def __init__(self, espeak_list: Path = ESPEAK_LIST, cmudict: Path = CMUDICT_PATH):
+        self.espeak_list = Path(espeak_list)
+        self.cmudict = Path(cmudict)
+        self._espeak: Optional[Dict[str, List[str]]] = None
+        self._cmu: Dict[str, List[str]] = {}
+        self._load_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.generated = 0
+        self.busy_seconds = 0.0
+        self.words = 0
+        self.spelled_words = 0
+
+    def warm(self) -> None:
+        with self._load_lock:
+            if self._espeak is not None:
+                return
+            start = time.time()
+            self._espeak = load_espeak_list(self.espeak_list) if self.espeak_list.exists() else {}
+            if self.cmudict.exists():
+                self._cmu = load_cmudict(self.cmudict)
+            log.info("Viseme lexicon: %d eSpeak + %d CMU words in %.2fs",
+                     len(self._espeak), len(self._cmu), time.time() - start)
+
+    def word_phonemes(self, word: str) -> Tuple[List[str], bool]:
+        """ARPAbet phonemes for one lowercase word, and whether they were guessed from spelling."""
+        if self._espeak is None:
+            self.warm()
+        for lexicon in (self._espeak, self._cmu):
+            if word in lexicon:
+                return lexicon[word], False
+            base = word[:-2] if word.endswith("'s") else word[:-1] if word.endswith("s") else None
+            if base and base in lexicon:
+                return lexicon[base] + ["Z"], False
+        return spell_to_arpabet(word.replace("'", "")), True
+
+    def phonemes(self, text: str) -> List[str]:
+        out: List[str] = []
+        words = WORD_RE.findall(text.lower())
+        spelled = 0
+        for word in words:
+            phones, guessed = self.word_phonemes(word)
+            out.extend(phones)
+            spelled += guessed
+        with self._stats_lock:
+            self.words += len(words)
+            self.spelled_words += spelled
+        return out
+
+    def generate(self, wav_bytes: bytes, text: str) -> Dict[str, Any]:
+        if self._espeak is None:
+            self.warm()
+        start = time.time()
+        samples, rate = read_wav(wav_bytes)
+        duration = len(samples) / float(rate) if rate else 0.0
+        env = energy_envelope(samples, rate)
+        segments = speech_segments(env)
+        cues = self._timeline(self.phonemes(text), env, segments, duration)
+        with self._stats_lock:
+            self.generated += 1
+            self.busy_seconds += time.time() - start
+        return {
+            "metadata": {"soundFile": "", "duration": round(duration, 2)},
+            "mouthCues": cues,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                "generated": self.generated,
+                "avg_ms": round(1000.0 * self.busy_seconds / self.generated, 3) if self.generated else 0.0,
+                "words": self.words,
+                "spelled_words": self.spelled_words,
+            }
+
+    # ---------- timeline ----------
+    def _timeline(self, phones: List[str], env: np.ndarray, segments: np.ndarray, duration: float) -> List[Dict[str, Any]]:
+        raw: List[Tuple[float, float, str]] = []
+        speech_frames = int((segments[:, 1] - segments[:, 0]).sum()) if len(segments) else 0
+        shapes: List[Tuple[str, float, bool]] = []
+        for p in phones:
+            shape, vowel = ARPABET_SHAPES.get(p, ("B", False))
+            weight = VOWEL_WEIGHT if vowel else STOP_WEIGHT if p in STOPS else 1.0
+            for s in shape:
+                shapes.append((s, weight / len(shape), vowel))
+
+        if speech_frames == 0 or not shapes:
+            return self._finish([(0.0, duration, "X")], duration)
+
+        # phoneme boundaries on the "speech only" time axis, in frames
+        weights = np.array([w for _, w, _ in shapes])
+        bounds = np.concatenate(([0.0], np.cumsum(weights))) * (speech_frames / weights.sum())
+        # map speech-axis frames back to real frames, segment by segment
+        seg_offsets = np.concatenate(([0], np.cumsum(segments[:, 1] - segments[:, 0])))
+        cum_energy = np.concatenate(([0.0], np.cumsum(env)))
+        peak = float(env.max()) or 1.0
+
+        cursor = 0.0
+        for i, (s0, s1) in enumerate(segments):
+            if s0 * FRAME_S > cursor:
+                raw.append((cursor, s0 * FRAME_S, "X"))
+            lo, hi = seg_offsets[i], seg_offsets[i + 1]
+            first = int(np.searchsorted(bounds, lo, side="right")) - 1
+            last = int(np.searchsorted(bounds, hi, side="left"))
+            for k in range(max(first, 0), min(last, len(shapes))):
+                a = s0 + max(bounds[k], lo) - lo
+                b = s0 + min(bounds[k + 1], hi) - lo
+                if b <= a:
+                    continue
+                shape, _, vowel = shapes[k]
+                if vowel and shape in "DC":
+                    ia, ib = int(a), max(int(b), int(a) + 1)
+                    level = (cum_energy[ib] - cum_energy[ia]) / (ib - ia) / peak
+                    if shape == "D" and level < 0.45:
+                        shape = "C"
+                    elif shape == "C" and level < 0.2:
+                        shape = "B"
+                raw.append((a * FRAME_S, b * FRAME_S, shape))
+            cursor = s1 * FRAME_S
+        if cursor < duration:
+            raw.append((cursor, duration, "X"))
+        return self._finish(raw, duration)
+
+    @staticmethod
+    def _finish(raw: List[Tuple[float, float, str]], duration: float) -> List[Dict[str, Any]]:
+        """Round to Rhubarb's 10 ms grid, fold tiny cues and merge repeats."""
+        cues: List[Dict[str, Any]] = []
+        for start, end, shape in raw:
+            start, end = round(float(start), 2), round(float(min(end, duration)), 2)
+            if cues:
+                start = cues[-1]["end"]
+            if end <= start:
+                continue
+            if cues and (cues[-1]["value"] == shape or end - start < MIN_CUE_S):
+                cues[-1]["end"] = end
+                continue
+            cues.append({"start": start, "end": end, "value": shape})
+        return cues
+
+
+# one generator per process, shared by both servers
+viseme_generator = TextVisemeGenerator()